@@ -1,13 +1,14 @@
 import os
+import json
 from sqlite3 import IntegrityError
 from datetime import datetime
 from typing import Optional, List, Tuple
 from dataclasses import asdict
 from db import (
-    Flow, Match, FlowMatch, MatchNote, FlowHistory, FlowHistoryResult, _delete_row,
+    Flow, Match, FlowMatch, MatchNote, MatchSnapshot, FlowHistory, FlowHistoryResult, _delete_row,
     insert_row, get_row, update_row, archive_row, prepare_row
 )
-from waystation import get_git_info
+from waystation import FLOW_CONTEXT_LINES, SearchHit, get_git_info, get_plain_lines_from_file
 
 def new_flow(db, flow: Flow) -> int:
     """Create a new flow and return its id."""
@@ -40,8 +41,13 @@ def enrich_match_with_git_info(match):
     match.git_commit_sha = git_commit_sha
     match.git_branch = git_branch
 
-def save_match(db, match: Match, flow_id: int=None) -> int:
-    """Save a new match and return its id."""
+def save_match(db, match: Match | SearchHit, flow_id: int=None, snapshot: bool=False) -> int:
+    """
+    Save a new match and return its id. Search hits are converted to a full Match first.
+    With snapshot the lines around the match are stored alongside it.
+    """
+    if isinstance(match, SearchHit):
+        match = match.to_match()
     order_index = 0
     enrich_match_with_git_info(match)
 
@@ -68,10 +74,102 @@ def save_match(db, match: Match, flow_id: int=None) -> int:
             matches_id=match_id,
             order_index=order_index
         ))
+        if snapshot:
+            save_match_snapshot(db, match_id, match)
         return match_id
     except Exception as e:
         print(e)
 
+MATCH_COLUMNS = ("line", "file_path", "file_name", "line_no", "grep_meta", "git_repo_root", "git_commit_sha", "git_branch")
+
+def match_values(match: Match) -> list:
+    """match's MATCH_COLUMNS values, grep_meta stored as JSON like sqlite_utils does."""
+    values = [getattr(match, column) for column in MATCH_COLUMNS]
+    if isinstance(match.grep_meta, dict):
+        values[MATCH_COLUMNS.index("grep_meta")] = json.dumps(match.grep_meta)
+    return values
+
+def save_matches(db, matches: List[Match | SearchHit], flow_id: int=None) -> List[int]:
+    """
+    Save many matches to the end of a flow in one transaction and return their ids.
+    Matches already saved are reused, ones already in the flow, or repeated in
+    matches, are only added once. Without flow_id a new flow is created, as save_match does.
+    """
+    matches = [match.to_match() if isinstance(match, SearchHit) else match for match in matches]
+    for match in matches:
+        enrich_match_with_git_info(match)
+
+    upsert = f"""
+        INSERT INTO matches ({', '.join(MATCH_COLUMNS)}) VALUES ({', '.join('?' * len(MATCH_COLUMNS))})
+        ON CONFLICT(line, file_path) DO UPDATE SET line = excluded.line
+        RETURNING id
+    """
+    with db.conn:
+        if not flow_id:
+            flow_id = db.execute(
+                "INSERT INTO flows (name, description) VALUES (?, ?)",
+                [f"New Flow {datetime.now()}", f"Auto-created flow for {len(matches)} matches"]
+            ).lastrowid
+        in_flow = {row[0] for row in db.execute(
+            "SELECT matches_id FROM flow_matches WHERE flows_id = ? AND archived = 0", [flow_id]
+        )}
+        order_index = db.execute(
+            "SELECT COUNT(*) FROM flow_matches WHERE flows_id = ? AND archived = 0", [flow_id]
+        ).fetchone()[0]
+
+        match_ids, new_rows = [], []
+        for match in matches:
+            # fetchall steps the statement to the end, so it isn't left open when committing
+            match_id = db.execute(upsert, match_values(match)).fetchall()[0][0]
+            match_ids.append(match_id)
+            if match_id not in in_flow:
+                in_flow.add(match_id)
+                new_rows.append((flow_id, match_id, order_index + len(new_rows)))
+        db.conn.executemany(
+            "INSERT INTO flow_matches (flows_id, matches_id, order_index) VALUES (?, ?, ?)", new_rows
+        )
+    return match_ids
+
+def take_snapshot(match_id: int, match: Match) -> MatchSnapshot:
+    """Read the lines around match from disk, compressed for the database."""
+    try:
+        context = get_plain_lines_from_file(match, FLOW_CONTEXT_LINES)
+    except (IndexError, OSError):
+        # the file was shortened or became unreadable since the search
+        context = match.line
+    return MatchSnapshot.from_text(match_id, context)
+
+def save_match_snapshot(db, match_id: int, match: Match):
+    """Store a snapshot of match, replacing any earlier one."""
+    save_match_snapshots(db, [take_snapshot(match_id, match)])
+
+def save_match_snapshots(db, snapshots: List[MatchSnapshot]):
+    """Store snapshots in one transaction, replacing any earlier ones."""
+    with db.conn:
+        db.conn.executemany(
+            "INSERT OR REPLACE INTO match_snapshots (match_id, context) VALUES (?, ?)",
+            [(snapshot.match_id, snapshot.context) for snapshot in snapshots]
+        )
+
+def get_match_snapshots(db, match_ids: List[int]) -> dict[int, MatchSnapshot]:
+    """Snapshots for match_ids in one query, keyed by match id. Matches without one are left out."""
+    if not match_ids:
+        return {}
+    ids = sorted(set(match_ids))
+    rows = db.query(
+        f"SELECT * FROM match_snapshots WHERE match_id IN ({', '.join('?' * len(ids))})", ids
+    )
+    return {row["match_id"]: MatchSnapshot(**row) for row in rows}
+
+def refresh_match_snapshots(db, matches: List[Match]) -> int:
+    """
+    Take the snapshots of matches again from disk and return how many were taken.
+    Matches whose file is gone keep the snapshot they have.
+    """
+    snapshots = [take_snapshot(match.id, match) for match in matches if os.path.exists(match.file_path)]
+    save_match_snapshots(db, snapshots)
+    return len(snapshots)
+
 def add_match_note(db, match_note: MatchNote) -> int:
     """Add a note to a match and return its id."""
     return insert_row(db, "match_notes", match_note)
@@ -133,7 +231,7 @@ def get_flow_history(db, limit: int = 10) -> list:
         FROM flow_history fh
         JOIN flows f ON fh.flow_id = f.id
         WHERE f.archived = FALSE
-        ORDER BY fh.created_at DESC
+        ORDER BY fh.created_at DESC, fh.id DESC
         LIMIT ?
     """, [limit]).fetchall()]
 
@@ -159,6 +257,7 @@ def get_flow_matches(db, flow_id: int) -> List[Tuple[Match, FlowMatch, Optional[
                    ROW_NUMBER() OVER (PARTITION BY flow_match_id ORDER BY created_at DESC) as rn
             FROM match_notes
             WHERE archived = 0
+              AND flow_match_id IN (SELECT id FROM flow_matches WHERE flows_id = :flow_id)
         )
         SELECT 
             m.*, 
@@ -169,14 +268,14 @@ def get_flow_matches(db, flow_id: int) -> List[Tuple[Match, FlowMatch, Optional[
             ln.note as note_content
         FROM matches m
         JOIN flow_matches fm ON m.id = fm.matches_id
-        LEFT JOIN latest_notes ln ON m.id = ln.flow_match_id AND ln.rn = 1
-        WHERE fm.flows_id = ? 
+        LEFT JOIN latest_notes ln ON fm.id = ln.flow_match_id AND ln.rn = 1
+        WHERE fm.flows_id = :flow_id 
           AND m.archived = 0 
           AND fm.archived = 0
         ORDER BY fm.order_index ASC
     """
     
-    results = db.query(query, [flow_id])
+    results = db.query(query, {"flow_id": flow_id})
     matches_data = []
     
     for row in results:
@@ -0,0 +1,136 @@
+"""
+Query plans and timings of the queries run on every screen resume, on a
+database the size of a year's use, without and with the indexes added by
+migration 2 in db.py.
+
+    python bench_queries.py [--flows 500] [--steps 100] [--repeat 50]
+"""
+import argparse
+import os
+import re
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+from app_actions import get_active_flow_id, get_flow_history, get_flow_match_counts, get_flow_matches, get_match
+from db import MIGRATIONS, Match, get_db
+
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "schema.sql")
+INDEX_MIGRATION = MIGRATIONS[0]
+INDEX_NAMES = re.findall(r"CREATE INDEX IF NOT EXISTS (\w+)", INDEX_MIGRATION)
+
+def populate(db, flows: int = 500, steps: int = 100, activations: int = 20):
+    """flows flows of steps steps each, every step its own match with a note, activated a few times a day."""
+    start = datetime(2025, 1, 1)
+    with db.conn:
+        db.conn.executemany(
+            "INSERT INTO flows (id, name) VALUES (?, ?)",
+            [(flow, f"flow {flow}") for flow in range(1, flows + 1)],
+        )
+        db.conn.executemany(
+            "INSERT INTO matches (id, line, file_path, file_name, line_no) VALUES (?, ?, ?, ?, ?)",
+            [(i, f"line {i}", f"/src/file_{i % 997}.py", f"file_{i % 997}.py", i % 400 + 1) for i in range(1, flows * steps + 1)],
+        )
+        db.conn.executemany(
+            "INSERT INTO flow_matches (id, flows_id, matches_id, order_index, archived) VALUES (?, ?, ?, ?, ?)",
+            [(i, (i - 1) // steps + 1, i, (i - 1) % steps, i % 10 == 0) for i in range(1, flows * steps + 1)],
+        )
+        db.conn.executemany(
+            "INSERT INTO match_notes (flow_match_id, name, note, archived) VALUES (?, ?, ?, ?)",
+            [(i, "note", f"why step {i} matters", i % 7 == 0) for i in range(1, flows * steps + 1, 2)],
+        )
+        db.conn.executemany(
+            "INSERT INTO flow_history (flow_id, created_at) VALUES (?, ?)",
+            [(i % flows + 1, (start + timedelta(hours=8 * i)).strftime("%Y-%m-%d %H:%M:%S")) for i in range(flows * activations)],
+        )
+
+def hot_queries(db, flow_id: int) -> dict:
+    """The queries a screen resume runs, by name."""
+    session_start = datetime(2025, 6, 1, tzinfo=timezone.utc)
+    match = Match(line="line 42", file_path=f"/src/file_{42 % 997}.py", file_name="")
+    return {
+        "get_active_flow_id": lambda: get_active_flow_id(db, session_start=session_start),
+        "get_flow_history": lambda: get_flow_history(db),
+        "get_flow_match_counts": lambda: list(get_flow_match_counts(db, range(1, 51))),
+        "get_flow_matches": lambda: get_flow_matches(db, flow_id),
+        "get_match": lambda: get_match(db, match),
+    }
+
+def traced_sql(db, query) -> list[str]:
+    """The statements query runs, with their parameters filled in."""
+    statements = []
+    db.conn.set_trace_callback(statements.append)
+    try:
+        query()
+    finally:
+        db.conn.set_trace_callback(None)
+    return [sql for sql in statements if sql.lstrip().upper().startswith(("SELECT", "WITH"))]
+
+def query_plans(db, flow_id: int) -> dict[str, list[str]]:
+    """EXPLAIN QUERY PLAN of each hot query, one line per plan step."""
+    # a cached EXPLAIN isn't recompiled when indexes come and go, so tag it with the schema version
+    schema_version = db.execute("PRAGMA schema_version").fetchone()[0]
+    plans = {}
+    for name, query in hot_queries(db, flow_id).items():
+        plans[name] = [
+            row[3]
+            for sql in traced_sql(db, query)
+            for row in db.execute(f"EXPLAIN QUERY PLAN {sql} -- schema {schema_version}").fetchall()
+        ]
+    return plans
+
+def drop_indexes(db):
+    with db.conn:
+        for name in INDEX_NAMES:
+            db.execute(f"DROP INDEX IF EXISTS {name}")
+
+def create_indexes(db):
+    with db.conn:
+        db.conn.executescript(INDEX_MIGRATION)
+
+def timings(db, flow_id: int, repeat: int) -> dict[str, float]:
+    """Mean milliseconds per call of each hot query."""
+    results = {}
+    for name, query in hot_queries(db, flow_id).items():
+        query()
+        start = time.perf_counter()
+        for _ in range(repeat):
+            query()
+        results[name] = (time.perf_counter() - start) * 1000 / repeat
+    return results
+
+def report(db, label: str, flow_id: int, repeat: int) -> dict[str, float]:
+    print(f"== {label}")
+    plans = query_plans(db, flow_id)
+    ms = timings(db, flow_id, repeat)
+    for name, plan in plans.items():
+        print(f"{name}: {ms[name]:.3f} ms")
+        for step in plan:
+            print(f"    {step}")
+    return ms
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--flows", type=int, default=500)
+    parser.add_argument("--steps", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = get_db(os.path.join(tmp, "bench.db"), SCHEMA_PATH)
+        populate(db, args.flows, args.steps)
+        flow_id = args.flows // 2
+        print(f"{args.flows * args.steps} steps in {args.flows} flows, {args.repeat} runs each\n")
+
+        drop_indexes(db)
+        before = report(db, "without migration 2", flow_id, args.repeat)
+        create_indexes(db)
+        print()
+        after = report(db, "with migration 2", flow_id, args.repeat)
+
+        print()
+        for name in before:
+            print(f"{name}: {before[name]:.3f} ms -> {after[name]:.3f} ms ({before[name] / max(after[name], 1e-9):.1f}x)")
+
+if __name__ == "__main__":
+    main()
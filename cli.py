@@ -5,7 +5,10 @@ from app_actions import get_active_flow
 from screens.base_screen import ActiveFlowChanged, FlowHeader
 
 # Import shared logic from waystation.py
-from waystation import UserGrep
+from waystation import SearchOptions, UserGrep
+from search_results import DEFAULT_RESULT_BUDGET
+from search_cache import SearchCache, IncrementalSearch
+from parser_pool import ParserPool
 
 # Import screens from the screens package
 from screens import SearchScreen, FlowScreen, StepScreen
@@ -18,7 +21,27 @@ class RGApp(App):
         self.db = db
         self.user_grep = user_grep
         self.session_start = datetime.now(timezone.utc)
-        self.config = {"show_notes": True}  # Add note visibility config
+        self.search_cache = SearchCache()
+        self.incremental_search = IncrementalSearch()
+        self.config = {
+            "show_notes": True,  # Add note visibility config
+            "result_budget": DEFAULT_RESULT_BUDGET,  # matches kept in memory before spilling to disk
+            "search_workers": None,  # ripgrep processes run at once for multi-root searches, defaults to the cpu count
+            "parser_processes": 0,  # worker processes parsing previews off the UI process, 0 parses in-process
+            "save_snapshots": True,  # store the compressed lines around each saved match, flows are then shown without reading files
+        }
+        self._parser_pool = None
+
+    @property
+    def parser_pool(self) -> ParserPool | None:
+        """The shared ParserPool, None unless config["parser_processes"] is set."""
+        if self._parser_pool is None and self.config.get("parser_processes"):
+            self._parser_pool = ParserPool(self.config["parser_processes"])
+        return self._parser_pool
+
+    def on_unmount(self):
+        if self._parser_pool is not None:
+            self._parser_pool.shutdown(wait=False)
 
     def on_mount(self):
         self.install_screen(screen=SearchScreen, name='search')
@@ -32,17 +55,26 @@ class RGApp(App):
 
 if __name__ == "__main__": # pragma: no cover
     from waystation import init_waystation
+    from db import CONNECTION_PROFILES, DEFAULT_PROFILE
     import argparse
 
-    # Initialize the database and $HOME/.waystation directory
-    db = init_waystation()
-
     parser = argparse.ArgumentParser(description="Textual ripgrep-ast browser")
     parser.add_argument('pattern', nargs='?', help="Pattern to search")
     parser.add_argument('paths', nargs='*', help="Search in these files/dirs")
+    parser.add_argument('-o', '--options', default='', help="ripgrep style search options, e.g. \"-F -t py -g '!vendor'\"")
+    parser.add_argument('--db-profile', choices=sorted(CONNECTION_PROFILES), default=DEFAULT_PROFILE,
+                        help="SQLite tuning, durable syncs every commit, fast only at checkpoints")
     args = parser.parse_args()
 
+    # Initialize the database and $HOME/.waystation directory
+    db = init_waystation(args.db_profile)
+
+    try:
+        options = SearchOptions.parse(args.options)
+    except ValueError as e:
+        parser.error(str(e))
+
     if args.pattern is None:
         RGApp(db).run()
     else:
-        RGApp(db, UserGrep(args.pattern, args.paths)).run()
+        RGApp(db, UserGrep(args.pattern, args.paths, options)).run()
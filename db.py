@@ -1,3 +1,5 @@
+import sqlite3
+import zlib
 import sqlite_utils
 from sqlite_utils.db import NotFoundError
 from dataclasses import asdict, dataclass, fields
@@ -5,14 +7,116 @@ from typing import Type, TypeVar, List, Optional
 
 T = TypeVar("T")
 
-def get_db(db_path="rgf.db", schema_path="schema.sql"):
+# PRAGMA settings applied to each connection get_db opens. Both use WAL, so
+# readers don't block the writer and a commit appends to the log instead of
+# rewriting pages. "durable" still syncs every commit, "fast" only syncs at
+# checkpoints, a crash can lose the last commits but never corrupts the file.
+CONNECTION_PROFILES = {
+    "durable": {
+        "journal_mode": "wal",
+        "synchronous": "full",
+        "cache_size": -16 * 1024,  # negative is KiB
+        "mmap_size": 0,
+        "temp_store": "memory",
+        "busy_timeout": 5000,  # ms
+    },
+    "fast": {
+        "journal_mode": "wal",
+        "synchronous": "normal",
+        "cache_size": -64 * 1024,
+        "mmap_size": 256 * 1024 * 1024,
+        "temp_store": "memory",
+        "busy_timeout": 5000,
+    },
+}
+DEFAULT_PROFILE = "fast"
+
+def apply_profile(db, profile: str | dict = DEFAULT_PROFILE):
+    """Apply a CONNECTION_PROFILES preset, or a dict of pragmas, to db's connection."""
+    pragmas = CONNECTION_PROFILES[profile] if isinstance(profile, str) else profile
+    for name, value in pragmas.items():
+        # journal_mode answers with the mode it ended up in, in-memory databases stay "memory"
+        db.execute(f"PRAGMA {name} = {value}").fetchall()
+
+def drop_snapshot_previews(db):
+    """Drop the preview column from a match_snapshots table created before it left schema.sql."""
+    if "preview" in db["match_snapshots"].columns_dict:
+        db.execute("ALTER TABLE match_snapshots DROP COLUMN preview")
+
+# Schema changes after the tables in schema.sql, in order. Each is SQL or a
+# function taking the db, and runs in one transaction with the version bump,
+# so an index build or a backfill is applied whole or not at all. Only ever
+# append: a database's PRAGMA user_version counts the steps it has had, the
+# first being schema.sql.
+MIGRATIONS: list = [
+    # 2: indexes for the queries run on every screen resume, bench_queries.py shows their plans.
+    # get_match and the notes of a step already seek on schema.sql's unique indexes.
     """
-    Returns a sqlite_utils.Database instance and ensures the schema is loaded.
+    -- a flow's live steps in order: get_flow_matches, get_flow_match_counts and the search screen's saved rows
+    CREATE INDEX IF NOT EXISTS idx_flow_matches_flow_steps
+    ON flow_matches(flows_id, archived, order_index, matches_id);
+
+    -- the latest activations: get_active_flow_id and get_flow_history, read backwards from the newest
+    CREATE INDEX IF NOT EXISTS idx_flow_history_created
+    ON flow_history(created_at, id, flow_id);
+    """,
+    # 3: match_snapshots.preview was never shown
+    drop_snapshot_previews,
+]
+
+def split_sql(sql: str) -> list[str]:
+    """The statements in a script, so they can run inside a transaction executescript would commit."""
+    statements, current = [], ""
+    for line in sql.splitlines(keepends=True):
+        current += line
+        if sqlite3.complete_statement(current):
+            statements.append(current.strip())
+            current = ""
+    leftover = [line for line in current.splitlines() if line.strip() and not line.strip().startswith("--")]
+    if leftover:
+        raise ValueError(f"incomplete SQL statement: {leftover[0]}")
+    return statements
+
+def migrate(db, schema_path="schema.sql") -> int:
+    """
+    Bring db up to the latest schema version and return it. A database that is
+    already current costs one PRAGMA read, schema.sql isn't even opened.
+    """
+    # None stands for schema.sql, only read when it has to run
+    steps = [None, *MIGRATIONS]
+    version = db.execute("PRAGMA user_version").fetchone()[0]
+    while version < len(steps):
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            # another process may have migrated while we waited for the lock
+            version = db.execute("PRAGMA user_version").fetchone()[0]
+            if version < len(steps):
+                step = steps[version]
+                if step is None:
+                    with open(schema_path, "r") as f:
+                        step = f.read()
+                if callable(step):
+                    step(db)
+                else:
+                    for statement in split_sql(step):
+                        db.execute(statement)
+                version += 1
+                db.execute(f"PRAGMA user_version = {version}")
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+    return version
+
+def get_db(db_path="rgf.db", schema_path="schema.sql", profile: str | dict | None = DEFAULT_PROFILE):
+    """
+    Returns a sqlite_utils.Database instance with its schema migrated to the latest version.
+    The connection is tuned with `profile`, see CONNECTION_PROFILES, None leaves SQLite's defaults.
     """
     db = sqlite_utils.Database(db_path)
-    with open(schema_path, "r") as f:
-        schema_sql = f.read()
-    db.conn.executescript(schema_sql)
+    if profile is not None:
+        apply_profile(db, profile)
+    migrate(db, schema_path)
     return db
 
 # --- Dataclasses for each table ---
@@ -64,6 +168,19 @@ class MatchNote:
     updated_at: Optional[str] = None
     archived: bool = False
 
+@dataclass
+class MatchSnapshot:
+    match_id: int = 0
+    context: bytes = b""
+    created_at: Optional[str] = None
+
+    @classmethod
+    def from_text(cls, match_id: int, context: str) -> "MatchSnapshot":
+        return cls(match_id=match_id, context=compress_text(context))
+
+    def context_text(self) -> str:
+        return decompress_text(self.context)
+
 @dataclass
 class FlowHistory:
     id: Optional[int] = None
@@ -82,6 +199,12 @@ def prepare_row(row: T) -> dict:
     data = asdict(row)
     return {k: v for k, v in data.items() if v is not None and k != "id"}
 
+def compress_text(text: Optional[str]) -> Optional[bytes]:
+    return None if text is None else zlib.compress(text.encode("utf-8"))
+
+def decompress_text(data: Optional[bytes]) -> Optional[str]:
+    return None if data is None else zlib.decompress(data).decode("utf-8")
+
 def insert_row(db, table: str, row: T) -> int:
     """Insert a dataclass row into the table. Returns the inserted row id."""
     data = asdict(row)
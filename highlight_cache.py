@@ -0,0 +1,93 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from textual.widgets import TextArea
+
+class HighlightCache:
+    """
+    LRU cache of TextArea highlight maps keyed by (snippet hash, language).
+
+    The same snippet shows up in the flow's step list, the step editor and
+    again every time that list is rebuilt, its highlights only need working
+    out once. Maps are stored as {row: tuple of highlights} and never mutated.
+    """
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries: OrderedDict = OrderedDict()
+
+    @staticmethod
+    def key(text: str, language: str | None) -> tuple:
+        return hashlib.blake2b(text.encode("utf-8", errors="surrogatepass"), digest_size=16).digest(), language
+
+    def get(self, text: str, language: str | None) -> dict | None:
+        key = self.key(text, language)
+        with self._lock:
+            highlights = self._entries.get(key)
+            if highlights is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return highlights
+
+    def put(self, text: str, language: str | None, highlights: dict):
+        key = self.key(text, language)
+        with self._lock:
+            self._entries[key] = {row: tuple(line) for row, line in highlights.items() if line}
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+highlight_cache = HighlightCache()
+
+# private TextArea internals CachedTextArea hooks into, as of textual 4.0. With
+# a textual that lacks them it behaves as a plain TextArea.
+TEXT_AREA_HOOKS = ("_set_document", "_build_highlight_map", "_watch_read_only")
+hooks_available = all(callable(getattr(TextArea, name, None)) for name in TEXT_AREA_HOOKS)
+
+class CachedTextArea(TextArea):
+    """
+    A TextArea that takes its highlights from the shared HighlightCache while
+    it is read only. On a hit the text isn't parsed at all, the document stays
+    plain text and only the cached highlights are drawn. Making it editable
+    parses it again so editing gets a syntax tree.
+    """
+
+    highlight_cache = highlight_cache
+
+    def _set_document(self, text: str, language: str | None) -> None:
+        # TextArea.__init__ sets up the document before self.language
+        self._document_language = language
+        cached = self.highlight_cache.get(text, language) if language and self.read_only and self._hooked() else None
+        if cached is None:
+            super()._set_document(text, language)
+            return
+        super()._set_document(text, None)
+        self._line_cache.clear()
+        self._highlights.update(cached)
+
+    def _build_highlight_map(self) -> None:
+        super()._build_highlight_map()
+        if self.read_only and self._hooked() and getattr(self, "_highlight_query", None):
+            self.highlight_cache.put(self.text, self._document_language, self._highlights)
+
+    def _watch_read_only(self, read_only: bool) -> None:
+        if hasattr(TextArea, "_watch_read_only"):
+            super()._watch_read_only(read_only)
+        if hooks_available and not read_only and self.language and not self.is_syntax_aware:
+            super()._set_document(self.text, self.language)
+
+    def _hooked(self) -> bool:
+        """Whether this textual has the internals the cache relies on."""
+        return hooks_available and isinstance(getattr(self, "_highlights", None), dict) and hasattr(self, "_line_cache")
@@ -0,0 +1,168 @@
+import os
+import re
+import threading
+from grep_ast.parsers import PARSERS, filename_to_lang
+
+# files grep-ast's own table misses, for languages it can already parse
+EXTRA_EXTENSIONS = {
+    ".pyi": "python",
+    ".pyw": "python",
+    ".cjs": "javascript",
+    ".mts": "typescript",
+    ".cts": "typescript",
+    ".ksh": "bash",
+}
+EXTRA_FILENAMES = {
+    "Gemfile": "ruby",
+    "Rakefile": "ruby",
+    "Podfile": "ruby",
+    "Vagrantfile": "ruby",
+    "SConstruct": "python",
+    "SConscript": "python",
+    ".bashrc": "bash",
+    ".bash_profile": "bash",
+    ".zshrc": "bash",
+    ".profile": "bash",
+}
+# languages to highlight files in, whether or not grep-ast can parse them
+HIGHLIGHT_EXTENSIONS = {
+    ".py": "python",
+    ".js": "javascript",
+    ".ts": "typescript",
+    ".html": "html",
+    ".css": "css",
+    ".sql": "sql",
+    ".json": "json",
+    ".yaml": "yaml",
+    ".yml": "yaml",
+    ".md": "markdown",
+    ".sh": "bash",
+    ".rs": "rust",
+    ".go": "go",
+    ".java": "java",
+    ".cpp": "cpp",
+    ".c": "c",
+}
+# interpreter named on a #! line, version numbers stripped
+SHEBANGS = {
+    "python": "python",
+    "pypy": "python",
+    "node": "javascript",
+    "deno": "typescript",
+    "bun": "typescript",
+    "sh": "bash",
+    "bash": "bash",
+    "zsh": "bash",
+    "ksh": "bash",
+    "dash": "bash",
+    "ruby": "ruby",
+    "perl": "perl",
+    "php": "php",
+    "lua": "lua",
+    "Rscript": "r",
+    "elixir": "elixir",
+}
+SHEBANG_RE = re.compile(r"#!\s*(\S+)(?:\s+(?:-\S+\s+)*(\S+))?")
+
+class LanguageRegistry:
+    """
+    Maps a file to the grep-ast language that previews it, by exact filename,
+    then extension, then the interpreter on its #! line. The language a file
+    is highlighted in is a separate question, see highlight_language.
+
+    Whether a language's parser actually loads is probed once per process and
+    remembered, so a file nothing can parse goes straight to the plain preview
+    instead of failing a TreeContext on every cursor move.
+    """
+
+    def __init__(self, extensions: dict | None = None, filenames: dict | None = None, shebangs: dict | None = None, highlights: dict | None = None):
+        self.extensions = {**{k: v for k, v in PARSERS.items() if k.startswith(".")}, **EXTRA_EXTENSIONS, **(extensions or {})}
+        self.filenames = {**{k: v for k, v in PARSERS.items() if not k.startswith(".")}, **EXTRA_FILENAMES, **(filenames or {})}
+        self.shebangs = {**SHEBANGS, **(shebangs or {})}
+        self.highlights = {**HIGHLIGHT_EXTENSIONS, **(highlights or {})}
+        self.probes = 0
+        self._parsers: dict[str, bool] = {}
+        self._text_areas: dict[str, bool] = {}
+        self._lock = threading.Lock()
+
+    def language_for(self, path, first_line: str | None = None) -> str | None:
+        """The language of path, or None. first_line is only looked at when the name says nothing."""
+        name = os.path.basename(str(path))
+        language = self.filenames.get(name)
+        if language is None:
+            ext = os.path.splitext(name)[1]
+            language = self.extensions.get(ext) or self.extensions.get(ext.lower())
+        if language is None and first_line:
+            language = self.shebang_language(first_line)
+        return language
+
+    def shebang_language(self, first_line: str) -> str | None:
+        found = SHEBANG_RE.match(first_line)
+        if not found:
+            return None
+        interpreter = os.path.basename(found.group(1))
+        if interpreter == "env" and found.group(2):
+            interpreter = found.group(2)
+        return self.shebangs.get(interpreter.rstrip("0123456789.") or interpreter)
+
+    def parser_available(self, language: str) -> bool:
+        """Whether grep-ast can load a parser for language, probed once."""
+        with self._lock:
+            available = self._parsers.get(language)
+            if available is None:
+                available = self._parsers[language] = self._probe_parser(language)
+            return available
+
+    def parseable_language(self, path, first_line: str | None = None) -> str | None:
+        """The language of path if grep-ast can parse it, otherwise None."""
+        language = self.language_for(path, first_line)
+        return language if language is not None and self.parser_available(language) else None
+
+    def grep_ast_filename(self, path, language: str) -> str | None:
+        """
+        A filename grep-ast's TreeContext detects as language, None if there is
+        none. It only looks at the name, so files found by the extra tables or
+        a shebang get the language's usual extension added.
+        """
+        path = str(path)
+        if filename_to_lang(path) == language:
+            return path
+        ext = next((ext for ext, lang in PARSERS.items() if lang == language and ext.startswith(".")), None)
+        return None if ext is None else path + ext
+
+    def highlight_language(self, path) -> str | None:
+        """The language to highlight path in, including languages grep-ast has no parser for."""
+        ext = os.path.splitext(str(path))[1].lower()
+        return self.highlights.get(ext) or self.language_for(path)
+
+    def text_area_language(self, path) -> str | None:
+        """The language for a TextArea showing path, None when TextArea can't highlight it."""
+        language = self.highlight_language(path)
+        if language is None:
+            return None
+        with self._lock:
+            available = self._text_areas.get(language)
+            if available is None:
+                available = self._text_areas[language] = self._probe_text_area(language)
+        return language if available else None
+
+    def _probe_parser(self, language: str) -> bool:
+        from grep_ast.tsl import get_parser
+        self.probes += 1
+        try:
+            get_parser(language).parse(b"")
+        except Exception:
+            # not in the installed language pack, or built for another tree-sitter
+            return False
+        return True
+
+    def _probe_text_area(self, language: str) -> bool:
+        from textual.widgets import TextArea
+        self.probes += 1
+        try:
+            TextArea("", language=language)
+        except Exception:
+            return False
+        return True
+
+language_registry = LanguageRegistry()
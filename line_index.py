@@ -0,0 +1,171 @@
+import mmap
+import os
+import threading
+from array import array
+from collections import OrderedDict
+
+class MappedFile:
+    """A memory-mapped file with the offsets of the line starts found so far."""
+
+    def __init__(self, path: str, stat: tuple[int, int]):
+        self.stat = stat
+        self.size = stat[1]
+        with open(path, 'rb') as f:
+            # mmap can't map an empty file
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if self.size else b''
+        self.starts = array('q', [0])
+        self.complete = self.size == 0
+
+    def line_count(self) -> int:
+        self._scan_to(None)
+        # a trailing newline, or an empty file, doesn't start another line
+        return len(self.starts) - (1 if self.starts[-1] == self.size else 0)
+
+    def lines(self, start: int, end: int) -> list[str]:
+        """Lines [start, end), 0-based, without their line endings. Stops early at the end of the file."""
+        self._scan_to(end)
+        end = min(end, self.line_count() if self.complete else end)
+        lines = []
+        for i in range(max(start, 0), end):
+            line_start = self.starts[i]
+            line_end = self.starts[i + 1] - 1 if i + 1 < len(self.starts) else self.size
+            lines.append(self.data[line_start:line_end].decode('utf-8', errors='replace').rstrip('\r'))
+        return lines
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+
+    def _scan_to(self, line: int | None):
+        """Find line starts up to line, or to the end of the file when line is None."""
+        pos = self.starts[-1]
+        while not self.complete and (line is None or len(self.starts) <= line):
+            newline = self.data.find(b'\n', pos)
+            if newline == -1:
+                self.complete = True
+                break
+            pos = newline + 1
+            self.starts.append(pos)
+        if pos >= self.size:
+            self.complete = True
+
+class LineIndex:
+    """
+    Shared cache of memory-mapped files and their line offsets, keyed by path
+    and checked against the file's mtime and size.
+
+    Line starts are found lazily, only as far as the lines asked for, and kept,
+    so pulling a few lines around many hits in one file maps and scans it once
+    instead of reading it into Python strings for every hit.
+    """
+
+    def __init__(self, max_files: int = 64):
+        self.max_files = max_files
+        self._files: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def window(self, path, line_no: int, before: int = 0, after: int = 0) -> list[str]:
+        """
+        Line line_no (1-based) with up to `before` lines above and `after` below it.
+        Raises IndexError if the file has no such line.
+        """
+        with self._lock:
+            mapped = self._open(path)
+            idx = line_no - 1
+            lines = mapped.lines(max(0, idx - before), idx + after + 1)
+            if idx < 0 or idx - max(0, idx - before) >= len(lines):
+                raise IndexError(f"{path} has no line {line_no}")
+            return lines
+
+    def lines(self, path, first: int, last: int) -> list[str]:
+        """Lines first to last (1-based, inclusive), fewer if the file ends sooner."""
+        with self._lock:
+            return self._open(path).lines(max(first, 1) - 1, last)
+
+    def line_count(self, path) -> int:
+        with self._lock:
+            return self._open(path).line_count()
+
+    def clear(self):
+        with self._lock:
+            for mapped in self._files.values():
+                mapped.close()
+            self._files.clear()
+
+    def __len__(self):
+        return len(self._files)
+
+    def _open(self, path) -> MappedFile:
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        key = (stat.st_mtime_ns, stat.st_size)
+        mapped = self._files.get(path)
+        if mapped is not None and mapped.stat == key:
+            self._files.move_to_end(path)
+            return mapped
+        if mapped is not None:
+            mapped.close()
+        mapped = self._files[path] = MappedFile(path, key)
+        self._files.move_to_end(path)
+        while len(self._files) > self.max_files:
+            _, evicted = self._files.popitem(last=False)
+            evicted.close()
+        return mapped
+
+class LineWindow:
+    """
+    A growable view of the lines around a hit. Growing it only reads the newly
+    exposed chunk from the LineIndex, the lines already shown are kept.
+    """
+
+    def __init__(self, path, line_no: int, context_lines: int = 3, index: LineIndex | None = None):
+        self.path = path
+        self.line_no = line_no
+        self.index = index if index is not None else line_index
+        self.first = max(1, line_no - context_lines)
+        self.lines = self.index.lines(path, self.first, line_no + context_lines)
+        self.header: list[str] = []
+
+    @property
+    def last(self) -> int:
+        return self.first + len(self.lines) - 1
+
+    def expand_up(self, count: int) -> int:
+        """Show up to count more lines above, returns how many were added."""
+        first = max(1, self.first - count)
+        if first < self.first:
+            self.lines[:0] = self.index.lines(self.path, first, self.first - 1)
+            count, self.first = self.first - first, first
+            return count
+        return 0
+
+    def expand_down(self, count: int) -> int:
+        """Show up to count more lines below, returns how many were added."""
+        added = self.index.lines(self.path, self.last + 1, self.last + count)
+        self.lines.extend(added)
+        return len(added)
+
+    def show_header(self, count: int):
+        """Show the first count lines of the file above the window, or hide them when count is 0."""
+        self.header = self.index.lines(self.path, 1, min(count, self.first - 1)) if count else []
+
+    def visible_header(self) -> list[str]:
+        # the window may have grown up into the header
+        return self.header[:self.first - 1]
+
+    def hit_row(self) -> int:
+        """The row of the hit line in render()."""
+        header = self.visible_header()
+        return len(header) + (1 if header and len(header) < self.first - 1 else 0) + self.line_no - self.first
+
+    def render(self) -> str:
+        """The window in grep-ast's style, the hit marked with █ and gaps with ⋮."""
+        header = self.visible_header()
+        rows = [f"│{line}" for line in header]
+        if header and len(header) < self.first - 1:
+            rows.append("⋮")
+        for line_no, line in enumerate(self.lines, self.first):
+            rows.append(f"{'█' if line_no == self.line_no else '│'}{line}")
+        return "\n".join(rows)
+
+line_index = LineIndex()
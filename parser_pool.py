@@ -0,0 +1,71 @@
+import asyncio
+import multiprocessing
+import os
+import sys
+import zlib
+from multiprocessing import resource_tracker
+from concurrent.futures import Future, ProcessPoolExecutor
+
+def render_preview(match) -> str:
+    """Runs in a worker, the worker's own PreviewCache keeps parsed trees warm between calls."""
+    from waystation import get_grep_ast_preview
+    try:
+        return get_grep_ast_preview(match)
+    except Exception:
+        return "<no preview>"
+
+def silence_output():
+    """Worker initializer, anything a worker prints would land on top of the TUI."""
+    devnull = open(os.devnull, "w")
+    sys.stdout = sys.stderr = devnull
+
+def start_resource_tracker():
+    """
+    Start multiprocessing's resource tracker with the real stderr. Textual swaps
+    sys.stderr for a capture object without a usable file descriptor, which
+    spawning the tracker would otherwise pass on and fail with.
+    """
+    stderr, sys.stderr = sys.stderr, sys.__stderr__
+    try:
+        resource_tracker.ensure_running()
+    finally:
+        sys.stderr = stderr
+
+class ParserPool:
+    """
+    Optional worker processes for grep-ast previews, so tree-sitter parsing
+    runs on other cores instead of the UI process. Only real parses are worth
+    the round trip, plain line reads such as flow snippets stay in-process.
+
+    Each worker is a single-process executor and a file always goes to the same
+    one, so its parse stays cached in that worker. Workers are started on first use.
+    """
+
+    def __init__(self, processes: int | None = None):
+        self.processes = processes or os.cpu_count() or 2
+        # spawn rather than fork, the UI process has threads running
+        self._context = multiprocessing.get_context("spawn")
+        self._workers: list[ProcessPoolExecutor | None] = [None] * self.processes
+
+    def worker_for(self, file_path: str) -> int:
+        return zlib.crc32(os.path.abspath(file_path).encode()) % self.processes
+
+    def submit_preview(self, match) -> Future:
+        return self._executor(match.file_path).submit(render_preview, match)
+
+    async def previews(self, matches: list) -> list[str]:
+        """Previews for matches, rendered in parallel across the workers, in order. Awaited, never blocks the caller."""
+        return list(await asyncio.gather(*(asyncio.wrap_future(self.submit_preview(match)) for match in matches)))
+
+    def shutdown(self, wait: bool = True):
+        for executor in self._workers:
+            if executor is not None:
+                executor.shutdown(wait=wait, cancel_futures=True)
+        self._workers = [None] * self.processes
+
+    def _executor(self, file_path: str) -> ProcessPoolExecutor:
+        idx = self.worker_for(file_path)
+        if self._workers[idx] is None:
+            start_resource_tracker()
+            self._workers[idx] = ProcessPoolExecutor(max_workers=1, mp_context=self._context, initializer=silence_output)
+        return self._workers[idx]
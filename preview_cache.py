@@ -0,0 +1,209 @@
+import codecs
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from dataclasses import dataclass, field
+import grep_ast
+from languages import language_registry
+
+# rough memory cost of a parsed TreeContext relative to the size of its source
+TREE_CONTEXT_WEIGHT = 8
+
+@dataclass
+class PreviewPolicy:
+    """Limits that keep a preview fast whatever file the cursor lands on."""
+    # files larger than this get a plain window of lines instead of AST context
+    max_ast_bytes: int = 1024 * 1024
+    # a line this long in the sniffed block marks the file as minified or generated
+    max_line_length: int = 1000
+    # bytes read to decide whether a file is binary, minified or not UTF-8
+    sniff_bytes: int = 64 * 1024
+    # seconds to wait for a parse before showing the plain window, per grep-ast language
+    parse_timeouts: dict[str, float] = field(default_factory=dict)
+    default_parse_timeout: float = 0.5
+    # lines either side of the hit in the plain window, and where long lines are cut
+    window_lines: int = 3
+    window_line_length: int = 300
+
+    def parse_timeout(self, path) -> float:
+        return self.parse_timeouts.get(language_registry.language_for(path), self.default_parse_timeout)
+
+class PreviewTimeout(Exception):
+    """The parse took longer than the policy allows, it carries on in the background."""
+
+def reset_tree_context(tc: grep_ast.TreeContext):
+    """Clear the lines of interest left by the previous user of a cached TreeContext."""
+    tc.lines_of_interest = set()
+    tc.show_lines = set()
+    tc.output_lines = {}
+    tc.done_parent_scopes = set()
+
+class PreviewCache:
+    """
+    LRU cache of file contents and parsed grep_ast.TreeContext objects,
+    keyed by (absolute path, mtime, size) so an edited file is re-read.
+
+    Moving between hits in the same file reuses one parse. Entries are evicted
+    once there are more than `max_entries` files or their estimated size
+    passes `max_bytes`. Parses run on a small thread pool so a caller can stop
+    waiting after the policy's timeout while the parse finishes into the cache.
+    Hold `lock` while using a TreeContext and reset it first, they are shared.
+    """
+
+    def __init__(self, max_entries: int = 64, max_bytes: int = 256 * 1024 * 1024, policy: PreviewPolicy | None = None, languages=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.policy = policy or PreviewPolicy()
+        self.languages = languages if languages is not None else language_registry
+        self.total_bytes = 0
+        self.parses = 0
+        self.lock = threading.RLock()
+        self._entries: OrderedDict = OrderedDict()
+        # (path, mtime, size) -> sniff() verdict
+        self._sniffed: OrderedDict = OrderedDict()
+        self._parser = ThreadPoolExecutor(max_workers=2, thread_name_prefix="preview-parse")
+
+    def sniff(self, path) -> str:
+        """
+        Classify path once per (path, mtime, size): "binary", "large", "minified",
+        "undecodable" (not UTF-8) or "text". Only "text" files get AST context.
+        Raises FileNotFoundError.
+        """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        key = (path, stat.st_mtime_ns, stat.st_size)
+        with self.lock:
+            verdict = self._sniffed.get(key)
+            if verdict is not None:
+                self._sniffed.move_to_end(key)
+                return verdict
+        verdict = self._classify(path, stat.st_size)
+        with self.lock:
+            self._sniffed[key] = verdict
+            while len(self._sniffed) > 4096:
+                self._sniffed.popitem(last=False)
+        return verdict
+
+    def read(self, path, encoding=None) -> str | None:
+        """The contents of path, or None if it can't be decoded. Raises FileNotFoundError."""
+        with self.lock:
+            return self._entry(path, encoding)["code"]
+
+    def tree_context(self, path, encoding=None, timeout: float | None = None, **options) -> grep_ast.TreeContext | None:
+        """
+        A TreeContext for path built with options, None when the file can't be
+        decoded or there is no parser for its language, neither is parsed.
+        Raises PreviewTimeout when the parse isn't done within `timeout` seconds.
+        """
+        option_key = tuple(sorted(options.items()))
+        with self.lock:
+            entry = self._entry(path, encoding)
+            if entry["code"] is None:
+                return None
+            if option_key in entry["contexts"]:
+                return entry["contexts"][option_key]
+            if "grep_ast_name" not in entry:
+                entry["grep_ast_name"] = self._grep_ast_name(path, entry["code"])
+            if entry["grep_ast_name"] is None:
+                return None
+            future = entry["pending"].get(option_key)
+            if future is None:
+                future = entry["pending"][option_key] = self._parser.submit(
+                    self._parse, entry, option_key, entry["grep_ast_name"], options
+                )
+        try:
+            return future.result(timeout=timeout)
+        except TimeoutError:
+            raise PreviewTimeout(f"parsing {path} took longer than {timeout}s")
+
+    def clear(self):
+        with self.lock:
+            self._entries.clear()
+            self._sniffed.clear()
+            self.total_bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _classify(self, path: str, size: int) -> str:
+        try:
+            with open(path, "rb") as f:
+                head = f.read(self.policy.sniff_bytes)
+        except OSError:
+            return "binary"
+        if b"\0" in head:
+            return "binary"
+        try:
+            # the block may end part way through a character
+            codecs.getincrementaldecoder("utf8")().decode(head, final=False)
+        except UnicodeDecodeError:
+            return "undecodable"
+        if size > self.policy.max_ast_bytes:
+            return "large"
+        lines = head.split(b"\n")
+        if len(head) < size:
+            # the last line may have been cut off by the block, a single long line still counts
+            lines = lines[:-1] or lines
+        if any(len(line) > self.policy.max_line_length for line in lines):
+            return "minified"
+        return "text"
+
+    def _grep_ast_name(self, path, code: str) -> str | None:
+        """The name to give TreeContext for path, None when no parser can read it."""
+        language = self.languages.parseable_language(path, code[:256].partition("\n")[0])
+        return None if language is None else self.languages.grep_ast_filename(path, language)
+
+    def _parse(self, entry, option_key, path, options):
+        try:
+            tc = grep_ast.TreeContext(path, entry["code"], **options)
+        except Exception:
+            # a grammar grep-ast can't walk, there is no AST preview
+            tc = None
+        with self.lock:
+            self.parses += 1
+            entry["pending"].pop(option_key, None)
+            # the entry may have been evicted, or replaced by an edit, while the parse ran
+            if self._entries.get(entry["key"]) is entry:
+                entry["contexts"][option_key] = tc
+                if tc is not None:
+                    self._resize(entry, entry["size"] + len(entry["code"]) * TREE_CONTEXT_WEIGHT)
+                self._evict()
+        return tc
+
+    def _entry(self, path, encoding):
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        key = (path, encoding)
+        entry = self._entries.get(key)
+        if entry is not None and entry["stat"] == (stat.st_mtime_ns, stat.st_size):
+            self._entries.move_to_end(key)
+            return entry
+
+        self._remove(key)
+        try:
+            with open(path, "r", encoding=encoding) as f:
+                code = f.read()
+        except UnicodeDecodeError:
+            code = None
+        entry = {"key": key, "stat": (stat.st_mtime_ns, stat.st_size), "code": code, "contexts": {}, "pending": {}, "size": 0}
+        self._entries[key] = entry
+        self._resize(entry, len(code or ""))
+        self._evict()
+        return entry
+
+    def _resize(self, entry, size):
+        self.total_bytes += size - entry["size"]
+        entry["size"] = size
+
+    def _evict(self):
+        # the newest entry is always kept, even when it alone is over max_bytes
+        while len(self._entries) > 1 and (len(self._entries) > self.max_entries or self.total_bytes > self.max_bytes):
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry:
+            self.total_bytes -= entry["size"]
+
+preview_cache = PreviewCache()
@@ -0,0 +1,150 @@
+import os
+import subprocess
+import threading
+from collections import OrderedDict
+
+def rev_parse_git_info(path="."):
+    """git_repo_root, git_commit_sha, git_branch for path from `git rev-parse`, (None, None, None) outside a repo."""
+    def run_git_cmd(args):
+        return subprocess.check_output(
+            ["git"] + args, cwd=path, stderr=subprocess.DEVNULL
+        ).decode("utf-8").strip()
+
+    try:
+        git_repo_root = run_git_cmd(["rev-parse", "--show-toplevel"])
+        git_commit_sha = run_git_cmd(["rev-parse", "HEAD"])
+        git_branch = run_git_cmd(["rev-parse", "--abbrev-ref", "HEAD"])
+        return git_repo_root, git_commit_sha, git_branch
+    except Exception:
+        return None, None, None
+
+def _stat_key(path: str):
+    try:
+        stat = os.stat(path)
+        return stat.st_mtime_ns, stat.st_size
+    except OSError:
+        return None
+
+def _read(path: str) -> str | None:
+    try:
+        with open(path, encoding="utf-8") as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+class RepoInfoCache:
+    """
+    Repo root, HEAD commit and branch for a directory, read straight from the
+    .git files instead of running git.
+
+    The repo a directory belongs to is found once. A repo's (sha, branch) is
+    kept until the mtime of HEAD, the branch's ref file or packed-refs changes,
+    so saving several matches in a row reads nothing but a few stats. Anything
+    the files can't answer (an unborn branch, reftable repos) goes to git rev-parse.
+    """
+
+    def __init__(self, max_dirs: int = 4096):
+        self.max_dirs = max_dirs
+        self.rev_parses = 0
+        self._lock = threading.Lock()
+        # directory -> (root, git_dir, common_dir), or None outside a repo
+        self._dirs: OrderedDict = OrderedDict()
+        # git_dir -> (stat key, sha, branch)
+        self._heads: dict = {}
+
+    def get(self, path=".") -> tuple[str | None, str | None, str | None]:
+        """git_repo_root, git_commit_sha, git_branch for path. The branch is "HEAD" when it is detached."""
+        path = os.path.abspath(path)
+        with self._lock:
+            repo = self._repo(path)
+            if repo is None:
+                return None, None, None
+            root, git_dir, common_dir = repo
+            head = self._head(git_dir, common_dir)
+        if head is None:
+            self.rev_parses += 1
+            return rev_parse_git_info(path)
+        return root, *head
+
+    def root(self, path=".") -> str | None:
+        """The root of the repo containing path, None outside a repo. Doesn't read HEAD."""
+        with self._lock:
+            repo = self._repo(os.path.abspath(path))
+        return None if repo is None else repo[0]
+
+    def clear(self):
+        with self._lock:
+            self._dirs.clear()
+            self._heads.clear()
+
+    def _repo(self, path: str):
+        if path in self._dirs:
+            self._dirs.move_to_end(path)
+            return self._dirs[path]
+        repo = None
+        current = path
+        while True:
+            dot_git = os.path.join(current, ".git")
+            if os.path.isdir(dot_git):
+                git_dir = dot_git
+            elif os.path.isfile(dot_git):
+                # worktrees and submodules point at their git dir from a .git file
+                pointer = _read(dot_git) or ""
+                git_dir = pointer[len("gitdir:"):].strip() if pointer.startswith("gitdir:") else None
+                if git_dir is not None:
+                    git_dir = os.path.normpath(os.path.join(current, git_dir))
+            else:
+                git_dir = None
+            if git_dir is not None:
+                common = _read(os.path.join(git_dir, "commondir"))
+                common_dir = os.path.normpath(os.path.join(git_dir, common)) if common else git_dir
+                repo = (os.path.realpath(current), git_dir, common_dir)
+                break
+            parent = os.path.dirname(current)
+            if parent == current:
+                break
+            current = parent
+        self._dirs[path] = repo
+        while len(self._dirs) > self.max_dirs:
+            self._dirs.popitem(last=False)
+        return repo
+
+    def _head(self, git_dir: str, common_dir: str):
+        """(sha, branch) from HEAD and the refs, None when git has to be asked."""
+        head_path = os.path.join(git_dir, "HEAD")
+        head = _read(head_path)
+        if head is None:
+            return None
+        ref = head[len("ref:"):].strip() if head.startswith("ref:") else None
+        packed_refs = os.path.join(common_dir, "packed-refs")
+        ref_path = os.path.join(common_dir, ref) if ref else None
+        key = (head, _stat_key(head_path), ref_path and _stat_key(ref_path), _stat_key(packed_refs))
+        cached = self._heads.get(git_dir)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        if ref is None:
+            # detached, HEAD holds the sha itself
+            value = (head, "HEAD")
+        else:
+            sha = _read(ref_path) or self._packed_ref(packed_refs, ref)
+            if not sha:
+                return None
+            value = (sha, ref[len("refs/heads/"):] if ref.startswith("refs/heads/") else ref)
+        self._heads[git_dir] = (key, value)
+        return value
+
+    @staticmethod
+    def _packed_ref(packed_refs: str, ref: str) -> str | None:
+        try:
+            with open(packed_refs, encoding="utf-8") as f:
+                for line in f:
+                    if line.startswith(("#", "^")):
+                        continue
+                    sha, _, name = line.strip().partition(" ")
+                    if name == ref:
+                        return sha
+        except OSError:
+            pass
+        return None
+
+repo_info = RepoInfoCache()
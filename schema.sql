@@ -73,3 +73,12 @@ CREATE TABLE IF NOT EXISTS flow_history (
     created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
     FOREIGN KEY (flow_id) REFERENCES flows(id)
 );
+
+-- Table: match_snapshots
+-- what a match looked like when it was saved, so a flow can be shown without reading its files
+CREATE TABLE IF NOT EXISTS match_snapshots (
+    match_id INTEGER PRIMARY KEY,
+    context BLOB NOT NULL, -- zlib compressed lines around the match
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (match_id) REFERENCES matches(id)
+);
@@ -1,3 +1,7 @@
+import os
+import asyncio
+from collections import OrderedDict
+from functools import partial
 from os import system
 
 from textual.binding import Binding
@@ -10,8 +14,22 @@ from rich.text import Text
 from .base_screen import BaseScreen, FlowHeader, ActiveFlowChanged, FlowDataChanged
 
 # Import shared logic from waystation.py
-from waystation import Match, UserGrep, get_rg_matches, get_grep_ast_preview
-from app_actions import activate_flow, delete_flow_match_for_match, get_active_flow_id, get_latest_flow, get_match, save_match, get_active_flow
+from line_index import LineWindow
+from waystation import Match, SearchHit, SearchOptions, UserGrep, SearchJob, SearchJobManager, get_grep_ast_preview
+from search_results import SearchResults, DEFAULT_RESULT_BUDGET, DEFAULT_PAGE_SIZE
+from app_actions import (
+    activate_flow, delete_flow_match_for_match, get_active_flow_id, get_latest_flow, get_match, save_match, get_active_flow,
+    save_matches, save_match_snapshots, take_snapshot
+)
+
+# seconds the cursor has to rest on a row before its preview is rendered
+PREVIEW_DEBOUNCE = 0.05
+# rows either side of the cursor whose previews are rendered ahead of time
+PREVIEW_PREFETCH_ROWS = 3
+PREVIEW_CACHE_SIZE = 128
+# lines added to the preview window per expand, and lines of the file header shown
+PREVIEW_EXPAND_LINES = 10
+PREVIEW_HEADER_LINES = 20
 
 def get_match_ids_for_flow(db, flow_id):
     """Return a set of match IDs for the given flow_id."""
@@ -40,6 +58,12 @@ class UserGrepInput(Container):
 .w-half {
     width: 50%;
 }
+.w-2div5 {
+    width: 40%;
+}
+.w-3div10 {
+    width: 30%;
+}
 '''
     BINDINGS = [
         Binding("escape", "unfocus_all", "Cancel", show=True),
@@ -52,12 +76,28 @@ class UserGrepInput(Container):
 
     def compose(self):
         with Horizontal():
-            yield Input(placeholder="Pattern", id="pattern_input", classes="w-half", value=self.user_grep.pattern if self.user_grep else "")
-            yield Input(placeholder="Path(s) (optional, space separated)", id="paths_input", classes="w-half", value=' '.join(self.user_grep.paths) if self.user_grep else "")
+            yield Input(placeholder="Pattern", id="pattern_input", classes="w-2div5", value=self.user_grep.pattern if self.user_grep else "")
+            yield Input(placeholder="Path(s) (optional, space separated)", id="paths_input", classes="w-3div10", value=' '.join(self.user_grep.paths) if self.user_grep else "")
+            yield Input(placeholder="Options (-s -F -w -t py -g '!vendor' -m 5)", id="options_input", classes="w-3div10", value=str(self.user_grep.options) if self.user_grep else "")
 
     def action_unfocus_all(self):
         self.set_focus(None)
 
+def render_preview_text(match) -> str:
+    """The preview text for match, "<no preview>" if it can't be rendered."""
+    try:
+        return get_grep_ast_preview(match)
+    except Exception:
+        return "<no preview>"
+
+def preview_key(match) -> tuple:
+    """Identifies a rendered preview, the file's mtime makes an edit render it again."""
+    try:
+        mtime = os.stat(match.file_path).st_mtime_ns
+    except OSError:
+        mtime = None
+    return match.file_path, match.line_no, match.line, mtime
+
 class GrepAstPreview(TextArea):
     id="grep_ast_preview"
 
@@ -73,8 +113,15 @@ class SearchScreen(BaseScreen):
         Binding(key="/", action="new_search", description="New Search", show=True, priority=True),
         # Binding(key="s", action="save_match", description="Save Match", show=False),
         Binding(key="enter", action="save_match", description="Save Match", show=True, priority=True),
+        Binding(key="ctrl+s", action="save_all_matches", description="Save all shown", show=True),
         Binding(key="d", action="delete_match", description="Remove match", show=True),
         Binding(key="shift+enter", action="open_in_editor", description="Open in editor", show=True),
+        Binding(key="ctrl+x", action="cancel_search", description="Cancel search", show=True),
+        # printable keys go to the table filter, so the preview window uses ctrl keys
+        Binding(key="ctrl+up", action="expand_preview_up", description="More above", show=False),
+        Binding(key="ctrl+down", action="expand_preview_down", description="More below", show=False),
+        Binding(key="ctrl+t", action="toggle_preview_header", description="Top of file", show=True),
+        Binding(key="ctrl+r", action="reset_preview", description="Reset preview", show=False),
         # Binding(key="j", action="cursor_down", show=False),
         # Binding(key="k", action="cursor_up", show=False),
         # Binding(key="ctrl+f", action="page_down", show=False),
@@ -97,15 +144,31 @@ class SearchScreen(BaseScreen):
     def check_action(self, action: str, parameters: tuple[object, ...]) -> bool | None:
         """Hide common bindings when inputs are focused"""
         if isinstance(self.focused, Input):
-            return action in {"unfocus_all", "submit_input"}
+            return action in {"unfocus_all", "submit_input", "cancel_search"}
         return True
 
     def __init__(self, user_grep: UserGrep = None):
         super().__init__()
         self.user_grep = user_grep or self.app.user_grep
-        self.matches: list[Match] = []
+        self.matches: SearchResults | list[SearchHit] = []
+        # indices into self.matches in display order, only the first self.row_limit are in the DataTable
+        self.visible_matches: list[int] = []
+        self.row_limit = DEFAULT_PAGE_SIZE
         self.dg = None
         self.preview = None
+        self.search_worker = None
+        self.search_jobs = SearchJobManager(
+            cache=self.app.search_cache,
+            incremental=self.app.incremental_search,
+            max_workers=self.app.config.get("search_workers"),
+        )
+        self.search_interrupted = False
+        # rendered preview text by preview_key, the cursor row's preview is only rendered
+        # once it stops moving, neighbouring rows are rendered ahead of time
+        self.rendered_previews: OrderedDict = OrderedDict()
+        self.preview_generation = 0
+        # the expanded plain view of the current match, None while the AST preview is shown
+        self.preview_window: LineWindow | None = None
         # This attribute will store the current filter string as the user types while the DataTable is focused.
         # It will be displayed above the DataTable, but will not affect filtering yet.
         self.table_filter = ""
@@ -131,51 +194,145 @@ class SearchScreen(BaseScreen):
 
     def on_mount(self):
         if self.user_grep:
-            self.matches = get_rg_matches(self.user_grep)
+            self.run_search()
             self.focus_datatable()
         else:
             self.focus_search_input()
+            self.render_matches()
 
-        self.render_matches()
+    def run_search(self):
+        """Cancel any running search, clear the results and stream the new ones in a worker."""
+        # a search that spills past the result budget isn't held in memory again for the cache
+        job = self.search_jobs.start(self.user_grep, max_hits=self.app.config.get("result_budget", DEFAULT_RESULT_BUDGET))
+        self.search_interrupted = False
+        self.reset_matches()
+        self.dg.clear()
+        self.show_root_column(len(self.user_grep.paths) > 1)
+        self.update_preview(0)
+        self.search_worker = self.run_worker(self.stream_matches(job), group="search", exclusive=True)
+
+    def is_searching(self) -> bool:
+        """True while a search worker is still streaming results."""
+        return self.search_worker is not None and self.search_worker.is_running
+
+    def cancel_search(self) -> bool:
+        """Kill the running ripgrep process, keeping the rows found so far."""
+        cancelled = self.search_jobs.cancel()
+        if self.search_worker:
+            self.search_worker.cancel()
+        return cancelled
+
+    def action_cancel_search(self):
+        if self.cancel_search():
+            self.notify(f"Search cancelled after {len(self.matches)} matches")
+
+    async def stream_matches(self, job: SearchJob):
+        """Append rows batch by batch as ripgrep finds them."""
+        async for batch in job.stream():
+            # a newer search has started, anything still arriving for this one is stale
+            if not self.search_jobs.is_current(job):
+                return
+            self.append_matches(batch)
+        if not self.search_jobs.is_current(job):
+            return
+
+        # saved matches are sorted to the top, which needs the complete result set
+        flow_id = get_active_flow_id(self.app.db, session_start=self.app.session_start)
+        if flow_id and get_match_ids_for_flow(self.app.db, flow_id):
+            self.render_matches(initial_selection=self.dg.cursor_coordinate.row)
+        else:
+            self.screen.post_message(FlowDataChanged())
+
+    def reset_matches(self):
+        """Release the previous results, including any spilled to disk."""
+        if isinstance(self.matches, SearchResults):
+            self.matches.close()
+        self.matches = SearchResults(budget=self.app.config.get("result_budget", DEFAULT_RESULT_BUDGET))
+        self.visible_matches = []
+        self.row_limit = DEFAULT_PAGE_SIZE
+
+    def append_matches(self, batch: list[SearchHit]):
+        """Add a batch of matches to the end of the DataTable without re-rendering it."""
+        had_rows = self.dg.row_count > 0
+        start = len(self.matches)
+        self.matches.extend(batch)
+        self.visible_matches.extend(start + i for i, match in enumerate(batch) if self.matches_filter(match))
+        self.load_rows(self.row_limit)
+        if not had_rows and self.dg.row_count:
+            self.dg.move_cursor(row=0)
+
+    def show_root_column(self, show: bool):
+        """Multi-root searches get a Root column labelling which repo each hit came from."""
+        if show and "root" not in self.dg.columns:
+            self.dg.add_column("Root", key="root")
+        elif not show and "root" in self.dg.columns:
+            self.dg.remove_column("root")
+
+    def load_rows(self, limit: int):
+        """Add DataTable rows for self.visible_matches, up to `limit` rows."""
+        with_root = "root" in self.dg.columns
+        for idx in self.visible_matches[self.dg.row_count:limit]:
+            match = self.matches[idx]
+            cells = [Text(match.file_name), Text(str(match.line_no)), Text(match.line)]
+            if with_root:
+                cells.append(Text(os.path.basename(match.root) or match.root))
+            self.dg.add_row(*cells, key=str(idx))
+
+    def load_next_page(self):
+        if self.dg.row_count < len(self.visible_matches):
+            self.row_limit = self.dg.row_count + DEFAULT_PAGE_SIZE
+            self.load_rows(self.row_limit)
+
+    def matches_filter(self, match) -> bool:
+        """True if self.table_filter appears in the file name, line, or line number."""
+        filter_str = self.table_filter.lower().strip()
+        return (
+            not filter_str
+            or filter_str in match.file_name.lower()
+            or filter_str in match.line.lower()
+            or filter_str in str(match.line_no)
+        )
+
+    def match_for_row(self, row_key) -> SearchHit | None:
+        if row_key is None or row_key.value is None:
+            return None
+        return self.matches[int(row_key.value)]
+
+    def current_match(self) -> SearchHit | None:
+        """The match under the DataTable cursor."""
+        if not self.dg.row_count:
+            return None
+        return self.match_for_row(self.dg.ordered_rows[self.dg.cursor_row].key)
 
     def render_matches(self, initial_selection=0):
         """
         Render the DataTable rows, filtered by self.table_filter if set.
         Only matches containing the filter string in file name, line, or line number are shown.
+        Rows are added a page at a time, see load_next_page.
         """
         self.dg.clear()
-        filter_str = self.table_filter.lower().strip()
 
         # Sort matches as before: saved matches (in flow) appear first
         flow_id = get_active_flow_id(self.app.db, session_start=self.app.session_start)
         saved_matches = list(get_matches_for_flow(self.app.db, flow_id))
-        lines = [match.get('line') for match in saved_matches]
-        file_paths = [match.get('file_path') for match in saved_matches]
-        sorted_matches = sorted(self.matches, key=lambda m: 0 if m.line in lines and m.file_path in file_paths else 1)
-
-        # Filter matches if filter_str is not empty
-        if filter_str:
-            # Filter matches: show only those where the filter string appears in file_name, line, or line_no
-            filtered_matches = [
-                m for m in sorted_matches
-                if filter_str in m.file_name.lower()
-                or filter_str in m.line.lower()
-                or filter_str in str(m.line_no)
-            ]
-        else:
-            filtered_matches = sorted_matches
-
-        # Add filtered matches to the DataTable
-        for match in filtered_matches:
-            self.dg.add_row(
-                Text(match.file_name),
-                Text(str(match.line_no)),
-                Text(match.line)
-            )
+        lines = set(match.get('line') for match in saved_matches)
+        file_paths = set(match.get('file_path') for match in saved_matches)
+        saved, others = [], []
+        for idx, match in enumerate(self.matches):
+            if not self.matches_filter(match):
+                continue
+            if match.line in lines and match.file_path in file_paths:
+                saved.append(idx)
+            else:
+                others.append(idx)
+        self.visible_matches = saved + others
+
+        self.row_limit = max(DEFAULT_PAGE_SIZE, initial_selection + 1)
+        self.load_rows(self.row_limit)
 
         self.screen.post_message(FlowDataChanged())
         # If there are filtered matches, select the first row and update preview
-        if filtered_matches:
+        if self.visible_matches:
             self.update_preview(0)
             self.dg.move_cursor(row=initial_selection)
         else:
@@ -184,22 +341,124 @@ class SearchScreen(BaseScreen):
     def on_input_submitted(self, event):
         pattern = self.query_one("#pattern_input").value
         paths = self.query_one("#paths_input").value.split()
-        self.user_grep = UserGrep(pattern, paths)
+        try:
+            options = SearchOptions.parse(self.query_one("#options_input").value)
+        except ValueError as e:
+            self.notify(str(e), severity="error")
+            return
+        self.user_grep = UserGrep(pattern, paths, options)
         self.on_mount()
 
     def update_preview(self, match):
+        self.preview_generation += 1
+        self.preview_window = None
         try:
             self.preview.update_preview(match)
         except Exception as e:
             self.preview.update_preview(Match("<no preview>", 0, str(e)))
 
+    def schedule_preview(self, match, row: int):
+        """
+        Show the preview for match without blocking the UI. A cached preview is shown
+        straight away, otherwise it is rendered on a thread after PREVIEW_DEBOUNCE,
+        and superseded by any later cursor move. Neighbouring rows are prefetched.
+        """
+        if match is None:
+            self.update_preview(None)
+            return
+        self.preview_generation += 1
+        self.preview_window = None
+        key = preview_key(match)
+        text = self.rendered_previews.get(key)
+        if text is not None:
+            self.rendered_previews.move_to_end(key)
+            self.preview.load_text(text)
+        self.run_worker(
+            partial(self.render_preview, match, key, row, self.preview_generation, cached=text is not None),
+            group="preview", exclusive=True
+        )
+
+    async def render_preview(self, match, key, row: int, generation: int, cached: bool):
+        # a newer cursor move cancels this worker, so holding a key only renders the last row
+        await asyncio.sleep(PREVIEW_DEBOUNCE)
+        if not cached:
+            text = await self.render_preview_text(match)
+            self.remember_preview(key, text)
+            if generation != self.preview_generation:
+                return
+            self.preview.load_text(text)
+        for neighbour in self.neighbour_matches(row):
+            neighbour_key = preview_key(neighbour)
+            if neighbour_key not in self.rendered_previews:
+                self.remember_preview(neighbour_key, await self.render_preview_text(neighbour))
+
+    async def render_preview_text(self, match) -> str:
+        """Render on the app's ParserPool when there is one, otherwise on a thread."""
+        pool = self.app.parser_pool
+        if pool is not None:
+            return await asyncio.wrap_future(pool.submit_preview(match))
+        return await asyncio.to_thread(render_preview_text, match)
+
+    def current_preview_window(self) -> LineWindow | None:
+        """The expandable window for the current match, opened on first use."""
+        if self.preview_window is None:
+            match = self.current_match()
+            if match is None:
+                return None
+            try:
+                self.preview_window = LineWindow(match.file_path, match.line_no)
+            except OSError:
+                return None
+            # a preview still rendering for this row must not replace the window
+            self.preview_generation += 1
+        return self.preview_window
+
+    def show_preview_window(self):
+        window = self.preview_window
+        self.preview.load_text(window.render())
+        self.preview.cursor_location = (window.hit_row(), 0)
+
+    def action_expand_preview_up(self):
+        if window := self.current_preview_window():
+            window.expand_up(PREVIEW_EXPAND_LINES)
+            self.show_preview_window()
+
+    def action_expand_preview_down(self):
+        if window := self.current_preview_window():
+            window.expand_down(PREVIEW_EXPAND_LINES)
+            self.show_preview_window()
+
+    def action_toggle_preview_header(self):
+        """Show or hide the top of the file, for its imports, above the window."""
+        if window := self.current_preview_window():
+            window.show_header(0 if window.header else PREVIEW_HEADER_LINES)
+            self.show_preview_window()
+
+    def action_reset_preview(self):
+        """Go back to the AST preview of the current match."""
+        match = self.current_match()
+        self.schedule_preview(match, self.dg.cursor_row)
+
+    def remember_preview(self, key, text: str):
+        self.rendered_previews[key] = text
+        self.rendered_previews.move_to_end(key)
+        while len(self.rendered_previews) > PREVIEW_CACHE_SIZE:
+            self.rendered_previews.popitem(last=False)
+
+    def neighbour_matches(self, row: int) -> list[SearchHit]:
+        """The matches in the rows around row, nearest first."""
+        rows = []
+        for distance in range(1, PREVIEW_PREFETCH_ROWS + 1):
+            rows += [row + distance, row - distance]
+        return [self.matches[self.visible_matches[r]] for r in rows if 0 <= r < len(self.visible_matches)]
+
     def on_data_table_row_highlighted(self, event):
         # if not event.row_key or not event.row_key.value: return
         try:
-            row = self.dg.get_row(event.row_key)
-            match = next((match for match in self.matches if match.file_name == row[0].plain and match.line_no == int(row[1].plain) and match.line == row[2].plain), None)
-            self.update_preview(match)
-        except (CellDoesNotExist, RowDoesNotExist):
+            if event.cursor_row >= self.dg.row_count - 20:
+                self.load_next_page()
+            self.schedule_preview(self.match_for_row(event.row_key), event.cursor_row)
+        except (CellDoesNotExist, RowDoesNotExist, IndexError):
             """likely an empty table"""
 
     async def on_key(self, event: events.Key) -> None:
@@ -209,6 +468,7 @@ class SearchScreen(BaseScreen):
         # If the DataTable is focused (and not an Input), capture typed keys to build the filter string.
         # Now, also filter the DataTable as the filter string changes.
         if self.focused == self.dg:
+            previous_filter = self.table_filter
             # Handle backspace: remove last character from filter string
             if event.key == "backspace":
                 self.table_filter = self.table_filter[:-1]
@@ -222,8 +482,9 @@ class SearchScreen(BaseScreen):
                 self.table_filter = ""
             # Update the label above the DataTable to show the current filter string
             self.update_table_filter_label()
-            # Re-render the DataTable with the filtered results
-            self.render_matches()
+            # Re-render the DataTable with the filtered results, navigation keys leave it alone
+            if self.table_filter != previous_filter:
+                self.render_matches()
             # Do not return here; allow other key handling to proceed as normal
 
         if self.focused != self.dg and isinstance(self.focused, Input):
@@ -257,15 +518,12 @@ class SearchScreen(BaseScreen):
     def on_data_table_row_selected(self, event):
         if not event.row_key: return
         try:
-            row = self.dg.get_row(event.row_key)
-            match = next((match for match in self.matches if match.file_name == row[0].plain and match.line_no == int(row[1].plain) and match.line == row[2].plain), None)
-            self.update_preview(match)
-        except CellDoesNotExist:
+            self.schedule_preview(self.match_for_row(event.row_key), event.cursor_row)
+        except (CellDoesNotExist, IndexError):
             """likely an empty table"""
 
     def action_open_in_editor(self):
-        idx = self.dg.cursor_coordinate.row
-        match = self.matches[idx]
+        match = self.current_match()
         try:
             with self.app.suspend():
                 system(f'$EDITOR {match.filename} +{match.line_no}')
@@ -281,8 +539,8 @@ class SearchScreen(BaseScreen):
         idx = self.dg.cursor_coordinate.row
         flow_id = get_active_flow_id(self.app.db, session_start=self.app.session_start)     
 
-        match = self.matches[idx]
-        save_match(self.app.db, match, flow_id=flow_id)
+        match = self.current_match()
+        save_match(self.app.db, match, flow_id=flow_id, snapshot=self.app.config.get("save_snapshots", True))
         if flow_id:
             """do nothing"""
         else:
@@ -302,6 +560,44 @@ class SearchScreen(BaseScreen):
         # Notify other screens that flow data has changed (e.g., match count)
         self.screen.post_message(FlowDataChanged())
 
+    def action_save_all_matches(self):
+        """Save every row the filter shows, including ones not loaded into the table yet, to the active flow."""
+        if not self.visible_matches:
+            self.notify("No matches available.", severity="warning")
+            return
+
+        idx = self.dg.cursor_coordinate.row
+        flow_id = get_active_flow_id(self.app.db, session_start=self.app.session_start)
+        matches = [self.matches[i] for i in self.visible_matches]
+        match_ids = save_matches(self.app.db, matches, flow_id=flow_id)
+        if not flow_id:
+            activate_flow(self.app.db, get_latest_flow(self.app.db).id)
+
+        active_flow = get_active_flow(self.app.db, self.app.session_start)
+        self.post_message(ActiveFlowChanged(active_flow.name if active_flow else "No active flow"))
+        self.notify(f"Saved {len(matches)} matches")
+        self.render_matches(initial_selection=idx)
+        self.screen.post_message(FlowDataChanged())
+
+        if self.app.config.get("save_snapshots", True):
+            self.run_worker(partial(self.snapshot_matches, match_ids, matches), group="snapshots", exit_on_error=False)
+
+    async def snapshot_matches(self, match_ids: list[int], matches: list):
+        """
+        Snapshot bulk saved matches off the UI thread, then store them in one transaction.
+        A match that can't be snapshotted is left without one, the rest are still stored.
+        """
+        def take_snapshots():
+            snapshots = []
+            for match_id, match in zip(match_ids, matches):
+                try:
+                    snapshots.append(take_snapshot(match_id, match))
+                except Exception:
+                    continue
+            return snapshots
+        snapshots = await asyncio.to_thread(take_snapshots)
+        save_match_snapshots(self.app.db, snapshots)
+
     def action_new_search(self):
         """Focus on the pattern input and clear it for a new search."""
         pattern_input = self.query_one("#pattern_input", Input)
@@ -315,10 +611,19 @@ class SearchScreen(BaseScreen):
         self.update_flow_name_in_header()
         self.refresh_row_highlighting()
 
+    def on_screen_suspend(self, event):
+        # don't leave ripgrep running while another screen is shown
+        self.search_interrupted = self.cancel_search()
+
+    def on_unmount(self):
+        self.cancel_search()
+
     async def on_screen_resume(self, event):
         await super().on_screen_resume(event)  # Update header
+        if self.search_interrupted:
+            self.run_search()
         self.refresh_row_highlighting()
-        if len(self.matches) == 0:
+        if len(self.matches) == 0 and not self.is_searching():
             self.focus_search_input()
 
     def focus_search_input(self):
@@ -355,8 +660,7 @@ class SearchScreen(BaseScreen):
             self.notify("No matches available.", severity="warning")
             return
 
-        idx = self.dg.cursor_coordinate.row
-        match = self.matches[idx]
+        match = self.current_match()
         flow_id = get_active_flow_id(self.app.db, session_start=self.app.session_start)
 
         if not flow_id:
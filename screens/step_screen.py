@@ -6,9 +6,11 @@ from textual.widgets import Footer, ListView, ListItem, TextArea, Label, Input,
 from textual.containers import Container, Horizontal, Vertical
 from textual.screen import Screen
 from .base_screen import BaseScreen, FlowHeader
-from app_actions import get_active_flow_id, get_flow_matches, update_match_note
+from app_actions import get_active_flow_id, get_flow_matches, get_match_snapshots, refresh_match_snapshots, update_match_note
 from db import Match, FlowMatch, MatchNote
-from waystation import get_plain_lines_from_file, get_language_from_filename
+from waystation import flow_snippets, get_plain_lines_from_file
+from highlight_cache import CachedTextArea
+from languages import language_registry
 
 class NewMatchNote(Message):
     """"""
@@ -118,12 +120,17 @@ class EditFlowScreen(Screen):
             matches_list.append(ListItem(Label("No matches in this flow.")))
             return
             
+        snapshots = get_match_snapshots(self.app.db, [match.id for match, _, _ in self.flow_matches])
+        snippets = flow_snippets(self.flow_matches, snapshots)
+        # kept so reordering rebuilds the list without reading the files again
+        self.snippets = {flow_match.id: snippet for (_, flow_match, _), snippet in zip(self.flow_matches, snippets)}
         for match, flow_match, note in self.flow_matches:
             matches_list.append(
                 self.create_match_list_item(
                     match, 
                     flow_match,
-                    note
+                    note,
+                    self.snippets[flow_match.id]
                 )
             )
 
@@ -131,7 +138,8 @@ class EditFlowScreen(Screen):
         self, 
         match: Match, 
         flow_match: FlowMatch, 
-        note
+        note,
+        preview_text: str | None = None
     ) -> ListItem:
         """Create a ListItem with syntax-highlighted code and note"""
         # Step header with note indicator
@@ -154,7 +162,7 @@ class EditFlowScreen(Screen):
             note_container_children = []
             note_container_children.append(Label(note.name, classes="note-title")) if note.name else None
             note_container_children.append(
-                TextArea(
+                CachedTextArea(
                     note.note, 
                     language="markdown", 
                     read_only=True, 
@@ -166,9 +174,10 @@ class EditFlowScreen(Screen):
 
 
         # Code area
-        preview_text = get_plain_lines_from_file(match, 3)
-        language = get_language_from_filename(match.file_name)
-        code_area = TextArea.code_editor(
+        if preview_text is None:
+            preview_text = get_plain_lines_from_file(match, 3)
+        language = language_registry.text_area_language(match.file_name)
+        code_area = CachedTextArea.code_editor(
             preview_text, 
             language=language,
             read_only=True,
@@ -244,7 +253,8 @@ class EditFlowScreen(Screen):
                 self.create_match_list_item(
                     match, 
                     flow_match,
-                    note
+                    note,
+                    self.snippets.get(flow_match.id)
                 )
             )
         
@@ -297,6 +307,7 @@ class StepScreen(BaseScreen):
     id = "steps"
     BINDINGS = [
         Binding("e", "edit_flow", "Edit Flow", show=True),
+        Binding("r", "refresh_snapshots", "Refresh from files", show=True),
     ]
     
     def __init__(self, **kwargs):
@@ -328,9 +339,17 @@ class StepScreen(BaseScreen):
         
         flow_id = get_active_flow_id(self.app.db, session_start=self.app.session_start)
         self.flow_matches = flow_matches or get_flow_matches(self.app.db, flow_id)
-        md = flow_matches_to_markdown(self.flow_matches)
+        # steps are drawn from the snapshots taken when they were saved, files are only read for steps without one
+        snapshots = get_match_snapshots(self.app.db, [match.id for match, _, _ in self.flow_matches])
+        md = flow_matches_to_markdown(self.flow_matches, snapshots)
         self.query_one(Markdown).update(md)
 
+    def action_refresh_snapshots(self):
+        """Take the step snapshots again from the files on disk"""
+        refreshed = refresh_match_snapshots(self.app.db, [match for match, _, _ in self.flow_matches])
+        self.load_flow_matches()
+        self.notify(f"Refreshed {refreshed} of {len(self.flow_matches)} steps from disk")
+
     async def action_edit_flow(self):
         """Switch to EditFlowScreen"""
         def reload_flow_matches(flows):
@@ -0,0 +1,219 @@
+import hashlib
+import subprocess
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import replace
+from pathlib import Path
+
+def _stat_key(path: Path):
+    try:
+        stat = path.stat()
+        return stat.st_mtime_ns, stat.st_size
+    except OSError:
+        return None
+
+# coarse filesystem timestamps can date a write during a search to just before it
+MTIME_SLACK_NS = 2 * 10**9
+
+def file_stats(args, started: int | None = None) -> dict[str, tuple | None]:
+    """
+    Stat every file ripgrep would search for args. When the stats are taken
+    after the search, started is its time.time_ns(): files modified since then,
+    give or take MTIME_SLACK_NS, get None instead of a stat, so hits read from
+    them are never trusted later.
+    """
+    from waystation import rg_file_flags
+    cmd = ['rg', '--files'] + rg_file_flags(args) + args.paths
+    listing = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True).stdout
+    cutoff = None if started is None else started - MTIME_SLACK_NS
+    files = {}
+    for file_path in listing.splitlines():
+        stat = _stat_key(Path(file_path))
+        if stat:
+            files[file_path] = None if cutoff is not None and stat[0] >= cutoff else stat
+    return files
+
+def _search_root(file_path: str, roots: list[str]) -> str:
+    """The entry of roots that file_path was found under."""
+    path = Path(file_path).absolute()
+    for root in roots:
+        if path.is_relative_to(Path(root).absolute()):
+            return root
+    return str(path.parent)
+
+def tag_roots(hits, args) -> list:
+    """Tag hits from a search over some of args' files with the repo root of the entry of args.paths they are under."""
+    from waystation import repo_root_for
+    hits = list(hits)
+    for hit in hits:
+        hit.root = repo_root_for(_search_root(hit.file_path, args.paths))
+    return hits
+
+def tree_fingerprint(files: dict[str, tuple | None]) -> bytes | None:
+    """
+    Digest of the stats from file_stats, used to invalidate cached results.
+    It changes when any searched file is added, removed or edited in place.
+    None when a file has no stat, results read from it can't be cached.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for file_path, stat in sorted(files.items()):
+        if stat is None:
+            return None
+        digest.update(f"{file_path}\0{stat[0]}\0{stat[1]}\n".encode("utf-8", errors="surrogateescape"))
+    return digest.digest()
+
+class SearchCache:
+    """
+    LRU cache of search results keyed by (pattern, paths, flags).
+
+    A hit is only served when the stats of every file the search covers are
+    unchanged, see tree_fingerprint, and at most `ttl` seconds old. The cache
+    holds at most `max_entries` searches and `max_hits` hits in total,
+    larger result sets are never cached.
+    """
+
+    def __init__(self, max_entries: int = 32, max_hits: int = 200_000, ttl: float = 30.0):
+        self.max_entries = max_entries
+        self.max_hits = max_hits
+        self.ttl = ttl
+        self.total_hits = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(args) -> tuple:
+        from waystation import rg_flags
+        return args.pattern, tuple(args.paths), tuple(rg_flags(args))
+
+    def can_serve(self, args) -> bool:
+        """Whether args has an entry, which still has to be checked against the files."""
+        return self.key(args) in self._entries
+
+    def get(self, args, fingerprint: bytes | None = None):
+        """Return the cached hits for args, or None if missing or stale."""
+        key = self.key(args)
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            return None
+        hits, cached_fingerprint, created = entry
+        if fingerprint is None:
+            fingerprint = tree_fingerprint(file_stats(args))
+        if fingerprint is None or fingerprint != cached_fingerprint or time.monotonic() - created > self.ttl:
+            self.invalidate(args)
+            return None
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+        return hits
+
+    def put(self, args, hits: list, fingerprint: bytes | None):
+        """Cache hits for args, fingerprint being the tree_fingerprint the search saw. None caches nothing."""
+        if fingerprint is None or len(hits) > self.max_hits:
+            return
+        key = self.key(args)
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (hits, fingerprint, time.monotonic())
+            self.total_hits += len(hits)
+            while len(self._entries) > self.max_entries or self.total_hits > self.max_hits:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, args):
+        with self._lock:
+            self._remove(self.key(args))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.total_hits = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry:
+            self.total_hits -= len(entry[0])
+
+class IncrementalSearch:
+    """
+    Remembers the per-file hits and file stats from the previous run of each search,
+    so a re-run only passes new or changed files to ripgrep and reuses the
+    hits of unchanged files.
+    """
+
+    def __init__(self, max_searches: int = 8, max_hits: int = 200_000, chunk_size: int = 500, full_rescan_ratio: float = 0.5):
+        self.max_searches = max_searches
+        self.max_hits = max_hits
+        self.chunk_size = chunk_size
+        # refresh gives up in favour of a full search when more than this share of files changed
+        self.full_rescan_ratio = full_rescan_ratio
+        self._runs: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def record(self, args, snapshot: dict[str, tuple | None], hits: list):
+        """Remember a complete run of args, snapshot is its file_stats."""
+        if len(hits) > self.max_hits:
+            return
+        hits_by_file = {}
+        for hit in hits:
+            hits_by_file.setdefault(hit.file_path, []).append(hit)
+        key = SearchCache.key(args)
+        with self._lock:
+            self._runs[key] = (snapshot, hits_by_file)
+            self._runs.move_to_end(key)
+            while len(self._runs) > self.max_searches:
+                self._runs.popitem(last=False)
+
+    def can_refresh(self, args) -> bool:
+        return SearchCache.key(args) in self._runs
+
+    def plan(self, args, current: dict[str, tuple | None]) -> tuple[list[str], dict] | None:
+        """
+        The files to rescan to refresh args against current, their file_stats, and
+        the hits kept from the recorded run for every other file. None if there is
+        no recorded run or too much changed.
+        """
+        with self._lock:
+            run = self._runs.get(SearchCache.key(args))
+        if run is None:
+            return None
+        previous, hits_by_file = run
+        changed = [path for path, stat in current.items() if previous.get(path) != stat]
+        if current and len(changed) > len(current) * self.full_rescan_ratio:
+            return None
+        kept = {path: hits_by_file[path] for path in current if previous.get(path) == current[path] and path in hits_by_file}
+        return changed, kept
+
+    def chunks(self, changed: list[str]) -> list[list[str]]:
+        """The changed files in groups of chunk_size, one ripgrep each."""
+        return [changed[start:start + self.chunk_size] for start in range(0, len(changed), self.chunk_size)]
+
+    def finish(self, args, current: dict[str, tuple | None], kept: dict, fresh: list) -> list:
+        """Merge the kept and fresh hits of a refresh in file order, record them and return them."""
+        fresh_by_file = {}
+        for hit in fresh:
+            fresh_by_file.setdefault(hit.file_path, []).append(hit)
+        hits = [hit for path in current for hit in kept.get(path) or fresh_by_file.get(path) or ()]
+        self.record(args, current, hits)
+        return hits
+
+    def refresh(self, args, current: dict[str, tuple] | None = None) -> list | None:
+        """
+        Re-run args against the files that changed since the recorded run, current
+        is their file_stats if already taken. Returns the merged hits, or None if
+        there is no recorded run or too much changed.
+        """
+        from waystation import iter_rg_matches
+        if current is None:
+            current = file_stats(args)
+        plan = self.plan(args, current)
+        if plan is None:
+            return None
+        changed, kept = plan
+        fresh = []
+        for chunk in self.chunks(changed):
+            fresh.extend(tag_roots(iter_rg_matches(replace(args, paths=chunk)), args))
+        return self.finish(args, current, kept, fresh)
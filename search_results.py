@@ -0,0 +1,102 @@
+import json
+import sqlite3
+from waystation import SearchHit, intern_path
+
+DEFAULT_RESULT_BUDGET = 5000
+DEFAULT_PAGE_SIZE = 500
+
+class SearchResults:
+    """
+    List-like container for search hits with a memory budget.
+
+    The first `budget` matches are kept in memory, anything after that is
+    spilled to a temporary SQLite table and read back a page at a time, so
+    memory stays flat however many hits ripgrep reports.
+    """
+
+    def __init__(self, budget: int = DEFAULT_RESULT_BUDGET, page_size: int = DEFAULT_PAGE_SIZE):
+        self.budget = budget
+        self.page_size = page_size
+        self.in_memory: list[SearchHit] = []
+        self.spilled = 0
+        self._spill = None
+        self._page_start = None
+        self._page: list[SearchHit] = []
+
+    def append(self, match: SearchHit):
+        if len(self.in_memory) < self.budget:
+            self.in_memory.append(match)
+            return
+        if self._spill is None:
+            self._spill = self._open_spill()
+        self._spill.execute(
+            "INSERT INTO spill (id, line, file_path, line_no, submatches, root) VALUES (?, ?, ?, ?, ?, ?)",
+            (self.spilled, match.line, match.file_path, match.line_no,
+             json.dumps(match.submatches) if match.submatches else None, match.root)
+        )
+        self.spilled += 1
+
+    def extend(self, matches):
+        for match in matches:
+            self.append(match)
+
+    def __len__(self):
+        return len(self.in_memory) + self.spilled
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def __getitem__(self, idx: int) -> SearchHit:
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError(idx)
+        if idx < len(self.in_memory):
+            return self.in_memory[idx]
+        spill_idx = idx - len(self.in_memory)
+        page_start = spill_idx - spill_idx % self.page_size
+        if page_start != self._page_start:
+            self._page = self._load_page(page_start)
+            self._page_start = page_start
+        return self._page[spill_idx - page_start]
+
+    def __iter__(self):
+        yield from self.in_memory
+        for page_start in range(0, self.spilled, self.page_size):
+            yield from self._load_page(page_start)
+
+    def page(self, start: int, count: int) -> list[SearchHit]:
+        """Return matches [start, start + count) without loading anything else."""
+        return [self[i] for i in range(start, min(start + count, len(self)))]
+
+    def close(self):
+        """Drop the spill table. Safe to call more than once."""
+        if self._spill is not None:
+            self._spill.close()
+            self._spill = None
+        self.in_memory = []
+        self.spilled = 0
+        self._page_start = None
+        self._page = []
+
+    def _open_spill(self):
+        # an unnamed on-disk database, sqlite removes the file when it is closed
+        conn = sqlite3.connect("")
+        conn.execute("""
+            CREATE TABLE spill (
+                id INTEGER PRIMARY KEY,
+                line TEXT, file_path TEXT, line_no INTEGER, submatches TEXT, root TEXT
+            )
+        """)
+        return conn
+
+    def _load_page(self, page_start: int) -> list[SearchHit]:
+        rows = self._spill.execute(
+            "SELECT line, file_path, line_no, submatches, root FROM spill WHERE id >= ? ORDER BY id LIMIT ?",
+            (page_start, self.page_size)
+        )
+        return [
+            SearchHit(*intern_path(file_path), line_no, line,
+                      tuple(map(tuple, json.loads(submatches))) if submatches else (), root)
+            for line, file_path, line_no, submatches, root in rows
+        ]
@@ -156,6 +156,18 @@ class TestMatchOperations:
         assert saved_match.git_commit_sha == sha
         assert saved_match.git_branch == branch
 
+    def test_save_match_converts_search_hit(self, db, monkeypatch):
+        """Search hits are turned into a full Match when saved."""
+        from waystation import SearchHit
+        from db import get_row
+        monkeypatch.setattr("app_actions.get_git_info", lambda path: (None, None, None))
+        hit = SearchHit(file_path="/tmp/hit.py", file_name="hit.py", line_no=7, line="hit line", submatches=((0, 3),))
+        match_id = save_match(db, hit)
+        saved_match = get_row(db, "matches", match_id, Match)
+        assert saved_match.file_path == "/tmp/hit.py"
+        assert saved_match.line_no == 7
+        assert '"line_number": 7' in saved_match.grep_meta
+
     def test_archive_match(self, db, sample_match):
         """Test archiving a match."""
         match_id = save_match(db, sample_match)
@@ -575,4 +587,122 @@ class TestFlowHistory:
         # Should only include flow2's activation
         assert len(history) == 1
         assert history[0].flow_id == flow2_id
-        assert history[0].name == "Flow 2"
\ No newline at end of file
+        assert history[0].name == "Flow 2"
+
+def test_saved_snapshot_replaces_reading_the_file(db, tmp_path, monkeypatch):
+    """A flow saved with snapshots renders the same after its file is gone."""
+    from app_actions import get_flow_matches, get_match_snapshots, refresh_match_snapshots
+    from waystation import flow_matches_to_markdown
+    monkeypatch.setattr("app_actions.get_git_info", lambda path: (None, None, None))
+    path = tmp_path / "module.py"
+    path.write_text("import os\n\n\ndef main():\n    return os.getcwd()\n\n\nmain()\n")
+    match = Match(line="def main():\n", file_path=str(path), file_name="module.py", line_no=4,
+                  grep_meta='{"submatches": [{"start": 4, "end": 8}]}')
+    match_id = save_match(db, match, snapshot=True)
+
+    flow_matches = get_flow_matches(db, get_latest_flow(db).id)
+    snapshots = get_match_snapshots(db, [m.id for m, _, _ in flow_matches])
+    assert list(snapshots) == [match_id]
+    assert snapshots[match_id].context_text() == "import os\n\n\ndef main():\n    return os.getcwd()\n\n"
+    # stored compressed
+    assert isinstance(snapshots[match_id].context, bytes)
+    markdown = flow_matches_to_markdown(flow_matches)
+    assert flow_matches_to_markdown(flow_matches, snapshots=snapshots) == markdown
+
+    os.unlink(path)
+    assert flow_matches_to_markdown(flow_matches, snapshots=snapshots) == markdown
+    assert "return os.getcwd()" not in flow_matches_to_markdown(flow_matches)
+    # refreshing skips a missing file instead of losing the snapshot
+    assert refresh_match_snapshots(db, [match]) == 0
+    assert get_match_snapshots(db, [match_id])[match_id].context == snapshots[match_id].context
+
+    path.write_text("import os\n\n\ndef main():\n    return 1\n")
+    match.id = match_id
+    assert refresh_match_snapshots(db, [match]) == 1
+    assert "return 1" in get_match_snapshots(db, [match_id])[match_id].context_text()
+
+
+def test_snapshot_of_a_file_shortened_since_the_search(db, tmp_path, monkeypatch):
+    """A hit past the end of its edited file is snapshotted as its saved line instead of failing."""
+    from app_actions import get_match_snapshots, refresh_match_snapshots, take_snapshot
+    monkeypatch.setattr("app_actions.get_git_info", lambda path: (None, None, None))
+    path = tmp_path / "short.py"
+    path.write_text("".join(f"x_{i} = {i}\n" for i in range(10)))
+    match = Match(line="x_8 = 8", file_path=str(path), file_name="short.py", line_no=9)
+    path.write_text("x_0 = 0\n")
+
+    assert take_snapshot(1, match).context_text() == "x_8 = 8"
+    match_id = save_match(db, match, snapshot=True)
+    assert match_id is not None
+    assert get_match_snapshots(db, [match_id])[match_id].context_text() == "x_8 = 8"
+    match.id = match_id
+    assert refresh_match_snapshots(db, [match]) == 1
+
+
+def test_save_match_without_snapshot(db, sample_match, monkeypatch):
+    from app_actions import get_match_snapshots
+    monkeypatch.setattr("app_actions.get_git_info", lambda path: (None, None, None))
+    match_id = save_match(db, sample_match)
+    assert get_match_snapshots(db, [match_id]) == {}
+
+
+def test_save_matches_in_one_transaction(db, sample_flow, monkeypatch):
+    """Bulk saves reuse saved matches and append contiguous steps in one commit."""
+    from app_actions import save_matches, get_flow_matches
+    from waystation import SearchHit
+    monkeypatch.setattr("app_actions.get_git_info", lambda path: ("/repo", "abc", "main"))
+    flow_id = new_flow(db, sample_flow)
+    first = Match(line="first", file_path="/repo/a.py", file_name="a.py", line_no=1)
+    first_id = save_match(db, first, flow_id=flow_id)
+
+    hits = [SearchHit(f"/repo/m{i}.py", f"m{i}.py", i, f"line {i}", ((0, 4),)) for i in range(500)]
+    statements = []
+    db.conn.set_trace_callback(statements.append)
+    match_ids = save_matches(db, [first, *hits, hits[0]], flow_id=flow_id)
+    db.conn.set_trace_callback(None)
+
+    assert statements.count("COMMIT") == 1
+    assert match_ids[0] == first_id
+    assert match_ids[1] == match_ids[-1]
+    steps = get_flow_matches(db, flow_id)
+    assert [flow_match.order_index for _, flow_match, _ in steps] == list(range(501))
+    assert [match.line for match, _, _ in steps] == ["first"] + [f"line {i}" for i in range(500)]
+    saved = steps[3][0]
+    assert (saved.git_commit_sha, saved.git_branch, saved.line_no) == ("abc", "main", 2)
+    assert '"submatches": [{"start": 0, "end": 4}]' in saved.grep_meta
+
+
+def test_save_matches_creates_a_flow(db, monkeypatch):
+    from app_actions import save_matches, get_flow_matches
+    monkeypatch.setattr("app_actions.get_git_info", lambda path: (None, None, None))
+    matches = [Match(line=f"l{i}", file_path="/tmp/x.py", file_name="x.py", line_no=i) for i in range(3)]
+    save_matches(db, matches)
+    flow = get_latest_flow(db)
+    assert flow.description == "Auto-created flow for 3 matches"
+    assert len(get_flow_matches(db, flow.id)) == 3
+
+
+def test_notes_show_on_their_own_step(db, monkeypatch):
+    """A note belongs to a flow match, not to every step showing the same match."""
+    from app_actions import get_flow_matches
+    monkeypatch.setattr("app_actions.get_git_info", lambda path: (None, None, None))
+    a = Match(line="a", file_path="/repo/a.py", file_name="a.py", line_no=1)
+    b = Match(line="b", file_path="/repo/b.py", file_name="b.py", line_no=2)
+    first_flow = new_flow(db, Flow(name="first"))
+    second_flow = new_flow(db, Flow(name="second"))
+    save_match(db, a, flow_id=first_flow)
+    save_match(db, b, flow_id=first_flow)
+    save_match(db, b, flow_id=second_flow)
+    save_match(db, a, flow_id=second_flow)
+    first_steps = get_flow_matches(db, first_flow)
+    second_steps = get_flow_matches(db, second_flow)
+    b_in_first = first_steps[1][1]
+    b_in_second = second_steps[0][1]
+    assert b_in_second.id != b_in_second.matches_id
+    add_match_note(db, MatchNote(flow_match_id=b_in_first.id, name="b", note="b in first"))
+    add_match_note(db, MatchNote(flow_match_id=b_in_second.id, name="b", note="b in second"))
+
+    steps = get_flow_matches(db, second_flow)
+    assert [(match.line, note.note if note else None) for match, _, note in steps] == [("b", "b in second"), ("a", None)]
+    steps = get_flow_matches(db, first_flow)
+    assert [(match.line, note.note if note else None) for match, _, note in steps] == [("a", None), ("b", "b in first")]
@@ -149,4 +149,36 @@ async def test_save_match_causes_saved_row_to_be_sorted_to_the_top(db):
         assert len(list(db['matches'].rows)) == 1
         assert real_row_after[0].plain == app.screen.matches[0].file_name
         assert real_row_after[1].plain == str(app.screen.matches[0].line_no)
-        assert real_row[0].plain == real_row_after[0].plain
\ No newline at end of file
+        assert real_row[0].plain == real_row_after[0].plain
+async def test_steps_screen_reads_snippets_in_process(db):
+    """Flow snippets are plain line reads, they never wait on the parser pool."""
+    from concurrent.futures import Future
+    from parser_pool import render_preview
+
+    class PreviewOnlyPool:
+        def submit_preview(self, match):
+            future = Future()
+            future.set_result(render_preview(match))
+            return future
+
+        def shutdown(self, wait=True):
+            pass
+
+    from datetime import timedelta
+    app = RGApp(db, UserGrep("def", ["test_data/"]))
+    # flow_history is stored to the second, keep the flow saved below active
+    app.session_start -= timedelta(seconds=1)
+    # without a snapshot every step reads its file
+    app.config["save_snapshots"] = False
+    async with app.run_test() as pilot:
+        await app.workers.wait_for_complete()
+        await pilot.press("enter")
+        await app.workers.wait_for_complete()
+        app._parser_pool = PreviewOnlyPool()
+        await pilot.press("3")
+        await pilot.pause()
+        assert app.screen.id == "steps"
+        assert len(app.screen.flow_matches) == 1
+        await pilot.press("e")
+        await pilot.pause()
+        assert len(app.screen.snippets) == 1
@@ -107,4 +107,108 @@ def test_prepare_row_removes_null_values():
     assert(len(prepared_row) == 2)
 
     prepared_row = prepare_row(Flow(description='wat'))
-    assert(len(prepared_row) == 3)
\ No newline at end of file
+    assert(len(prepared_row) == 3)
+
+
+@pytest.mark.parametrize("profile, synchronous, cache_size, mmap_size", [
+    ("fast", 1, -64 * 1024, 256 * 1024 * 1024),
+    ("durable", 2, -16 * 1024, 0),
+])
+def test_connection_profiles(tmp_path, profile, synchronous, cache_size, mmap_size):
+    schema_path = os.path.join(os.path.dirname(__file__), "../schema.sql")
+    db = get_db(str(tmp_path / "way.db"), schema_path, profile=profile)
+    pragma = lambda name: db.execute(f"PRAGMA {name}").fetchone()[0]
+    assert pragma("journal_mode") == "wal"
+    assert pragma("synchronous") == synchronous
+    assert pragma("cache_size") == cache_size
+    assert pragma("mmap_size") == mmap_size
+    assert pragma("temp_store") == 2
+    assert pragma("busy_timeout") == 5000
+
+def test_profile_can_be_left_off(tmp_path):
+    schema_path = os.path.join(os.path.dirname(__file__), "../schema.sql")
+    db = get_db(str(tmp_path / "way.db"), schema_path, profile=None)
+    assert db.execute("PRAGMA journal_mode").fetchone()[0] == "delete"
+    assert get_db(":memory:", schema_path).execute("PRAGMA journal_mode").fetchone()[0] == "memory"
+
+def test_migrations_run_once_and_in_order(tmp_path, monkeypatch):
+    import db as db_module
+    from db import migrate
+    schema_path = os.path.join(os.path.dirname(__file__), "../schema.sql")
+    applied = []
+    def backfill(db):
+        applied.append("backfill")
+        db.execute("UPDATE flows SET description = 'backfilled' WHERE description IS NULL")
+    monkeypatch.setattr(db_module, "MIGRATIONS", [
+        "CREATE INDEX IF NOT EXISTS idx_test_flow_name ON flows(name);",
+        backfill,
+    ])
+    db_path = str(tmp_path / "way.db")
+    db = get_db(db_path, schema_path)
+    assert db.execute("PRAGMA user_version").fetchone()[0] == 3
+    assert "idx_test_flow_name" in [index.name for index in db["flows"].indexes]
+    assert applied == ["backfill"]
+
+    # a current database doesn't read schema.sql or rerun anything
+    db = get_db(db_path, str(tmp_path / "missing.sql"))
+    assert migrate(db) == 3
+    assert applied == ["backfill"]
+
+def test_failed_migration_is_rolled_back(tmp_path, monkeypatch):
+    import db as db_module
+    from db import migrate
+    schema_path = os.path.join(os.path.dirname(__file__), "../schema.sql")
+    db_path = str(tmp_path / "way.db")
+    version = migrate(get_db(db_path, schema_path))
+    monkeypatch.setattr(db_module, "MIGRATIONS", [
+        *db_module.MIGRATIONS,
+        "CREATE TABLE extra (id INTEGER);\nINSERT INTO no_such_table VALUES (1);",
+    ])
+    with pytest.raises(Exception):
+        get_db(db_path, schema_path)
+    import sqlite_utils
+    db = sqlite_utils.Database(db_path)
+    assert db.execute("PRAGMA user_version").fetchone()[0] == version
+    assert "extra" not in db.table_names()
+
+def test_existing_unversioned_database_is_upgraded(tmp_path):
+    import sqlite_utils
+    schema_path = os.path.join(os.path.dirname(__file__), "../schema.sql")
+    db_path = str(tmp_path / "way.db")
+    legacy = sqlite_utils.Database(db_path)
+    legacy.execute("CREATE TABLE flows (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, description TEXT, parent_flow_id INTEGER NULL, parent_flow_match_id INTEGER NULL, created_at DATETIME DEFAULT CURRENT_TIMESTAMP, updated_at DATETIME DEFAULT CURRENT_TIMESTAMP, archived BOOLEAN DEFAULT FALSE)")
+    insert_row(legacy, "flows", Flow(name="kept"))
+    db = get_db(db_path, schema_path)
+    assert [flow.name for flow in list_rows(db, "flows", Flow)] == ["kept"]
+    assert "match_snapshots" in db.table_names()
+
+def test_hot_queries_seek_on_indexes(db):
+    from bench_queries import INDEX_NAMES, drop_indexes, populate, query_plans
+    populate(db, flows=5, steps=4, activations=3)
+    plans = query_plans(db, flow_id=2)
+    steps = [step for plan in plans.values() for step in plan]
+    assert not [step for step in steps if step.startswith("SCAN") and "INDEX" not in step and "subquery" not in step and step != "SCAN ln LEFT-JOIN"]
+    assert not [step for step in steps if "TEMP B-TREE" in step]
+    assert any("idx_flow_history_created" in step for step in plans["get_active_flow_id"])
+    assert any("COVERING INDEX idx_flow_matches_flow_steps" in step for step in plans["get_flow_match_counts"])
+    assert any("idx_unique_match_location" in step for step in plans["get_match"])
+
+    # the bench's baseline, what a database from before migration 2 does
+    drop_indexes(db)
+    assert not set(INDEX_NAMES) & {index.name for table in ("flow_matches", "flow_history") for index in db[table].indexes}
+    assert "SCAN fh" in query_plans(db, flow_id=2)["get_active_flow_id"]
+
+def test_snapshot_previews_are_dropped_from_older_databases(tmp_path):
+    import sqlite_utils
+    from db import MIGRATIONS
+    schema_path = os.path.join(os.path.dirname(__file__), "../schema.sql")
+    db_path = str(tmp_path / "way.db")
+    older = sqlite_utils.Database(db_path)
+    older.execute("CREATE TABLE match_snapshots (match_id INTEGER PRIMARY KEY, preview BLOB, context BLOB NOT NULL, created_at DATETIME DEFAULT CURRENT_TIMESTAMP)")
+    older.execute("INSERT INTO match_snapshots (match_id, preview, context) VALUES (1, x'00', x'01')")
+    older.execute("PRAGMA user_version = 2")
+    older.conn.commit()
+    db = get_db(db_path, schema_path)
+    assert db.execute("PRAGMA user_version").fetchone()[0] == 1 + len(MIGRATIONS)
+    assert list(db["match_snapshots"].columns_dict) == ["match_id", "context", "created_at"]
+    assert db.execute("SELECT context FROM match_snapshots").fetchone()[0] == b"\x01"
@@ -0,0 +1,75 @@
+import pytest
+from textual.widgets import TextArea
+from highlight_cache import CachedTextArea, HighlightCache
+
+# a grammar textual's TextArea can load whatever tree-sitter wheels are installed
+CODE = '{"name": "waystation", "steps": [1, 2, {"note": null}],\n "done": true}\n'
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = HighlightCache()
+    monkeypatch.setattr(CachedTextArea, "highlight_cache", cache)
+    return cache
+
+
+def highlights(text_area):
+    return {row: sorted(line) for row, line in text_area._highlights.items() if line}
+
+
+def test_same_snippet_is_highlighted_once(cache):
+    try:
+        expected = highlights(TextArea(CODE, language="json"))
+    except ValueError:
+        pytest.skip("installed json grammar doesn't match tree-sitter")
+    first = CachedTextArea(CODE, language="json", read_only=True)
+    assert highlights(first) == expected
+    assert cache.misses == 1
+
+    # a rebuilt step list reuses the highlights without parsing the snippet
+    again = CachedTextArea.code_editor(CODE, language="json", read_only=True)
+    assert not again.is_syntax_aware
+    assert highlights(again) == expected
+    assert len(cache) == 1
+
+    # a different language or an edited snippet is highlighted afresh
+    CachedTextArea(CODE, language="yaml", read_only=True)
+    CachedTextArea(CODE + "\n", language="json", read_only=True)
+    assert len(cache) == 3
+
+
+def test_editable_text_area_gets_a_syntax_tree(cache):
+    try:
+        CachedTextArea(CODE, language="json", read_only=True)
+    except ValueError:
+        pytest.skip("installed json grammar doesn't match tree-sitter")
+    editable = CachedTextArea(CODE, language="json")
+    assert editable.is_syntax_aware
+    cached = CachedTextArea(CODE, language="json", read_only=True)
+    cached.read_only = False
+    assert cached.is_syntax_aware
+    assert highlights(cached) == highlights(editable)
+
+
+def test_cache_is_bounded():
+    cache = HighlightCache(max_entries=2)
+    for i in range(3):
+        cache.put(f"x = {i}", "python", {0: [(0, 1, "variable")]})
+    assert len(cache) == 2
+    assert cache.get("x = 0", "python") is None
+    assert cache.get("x = 2", "python") == {0: ((0, 1, "variable"),)}
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_without_the_textarea_internals_it_is_a_plain_text_area(cache, monkeypatch):
+    import highlight_cache
+    try:
+        expected = highlights(TextArea(CODE, language="json"))
+    except ValueError:
+        pytest.skip("installed json grammar doesn't match tree-sitter")
+    monkeypatch.setattr(highlight_cache, "hooks_available", False)
+    for _ in range(2):
+        text_area = CachedTextArea(CODE, language="json", read_only=True)
+        assert text_area.is_syntax_aware
+        assert highlights(text_area) == expected
+    assert len(cache) == 0
@@ -0,0 +1,78 @@
+import pytest
+from languages import LanguageRegistry
+from preview_cache import PreviewCache
+from waystation import SearchHit, get_grep_ast_preview, get_language_from_filename
+
+
+@pytest.mark.parametrize("path, first_line, language", [
+    ("src/app.py", None, "python"),
+    ("types/api.pyi", None, "python"),
+    ("web/App.tsx", None, "typescript"),
+    ("lib/model.rb", None, "ruby"),
+    ("Main.kt", None, "kotlin"),
+    ("analysis.R", None, "r"),
+    ("Gemfile", None, "ruby"),
+    ("Dockerfile", None, "dockerfile"),
+    ("bin/deploy", "#!/usr/bin/env python3.11", "python"),
+    ("bin/run", "#!/bin/bash -e", "bash"),
+    ("bin/serve", "#!/usr/bin/env -S node --no-warnings", "javascript"),
+    ("bin/tool.py", "#!/bin/sh", "python"),
+    ("notes.unknownext", None, None),
+    ("bin/data", "plain text", None),
+])
+def test_language_for(path, first_line, language):
+    assert LanguageRegistry().language_for(path, first_line) == language
+
+
+def test_parser_availability_is_probed_once(monkeypatch):
+    registry = LanguageRegistry(extensions={".nope": "not_a_language"})
+    for _ in range(3):
+        assert registry.parseable_language("a.nope") is None
+        assert registry.parseable_language("a.py") == "python"
+    assert registry.probes == 2
+    assert get_language_from_filename("a.nope") == "text"
+
+
+def test_shebang_script_gets_an_ast_preview(tmp_path, monkeypatch):
+    import waystation
+    monkeypatch.setattr(waystation, "preview_cache", PreviewCache())
+    script = tmp_path / "deploy"
+    script.write_text("#!/usr/bin/env python3\n\ndef main():\n    return 1\n")
+    preview = get_grep_ast_preview(SearchHit(str(script), "deploy", 4, "    return 1\n", ((11, 12),)))
+    assert "█" in preview
+    assert "def main():" in preview
+    assert waystation.preview_cache.parses == 1
+
+
+def test_unsupported_language_skips_the_parse(tmp_path, monkeypatch):
+    import waystation
+    cache = PreviewCache(languages=LanguageRegistry(extensions={".py": "not_a_language"}))
+    monkeypatch.setattr(waystation, "preview_cache", cache)
+    path = tmp_path / "module.py"
+    path.write_text("a = 1\nb = 2\nc = 3\n")
+    for _ in range(3):
+        assert get_grep_ast_preview(SearchHit(str(path), "module.py", 2, "b = 2\n", ((0, 1),))) == "a = 1\nb = 2\nc = 3"
+    assert cache.parses == 0
+    assert cache.languages.probes == 1
+
+
+@pytest.mark.parametrize("path, language", [
+    ("config.yaml", "yaml"),
+    (".github/workflows/ci.yml", "yaml"),
+    ("README.md", "markdown"),
+    ("src/main.c", "c"),
+    ("types/api.pyi", "python"),
+    ("notes.unknownext", "text"),
+])
+def test_highlight_language_covers_files_grep_ast_cant_parse(path, language):
+    assert get_language_from_filename(path) == language
+
+
+def test_yaml_is_highlighted_in_the_flow_editor():
+    from textual.widgets import TextArea
+    try:
+        TextArea("a: 1\n", language="yaml")
+    except Exception:
+        pytest.skip("installed yaml grammar doesn't match tree-sitter")
+    assert LanguageRegistry().language_for("config.yaml") is None
+    assert LanguageRegistry().text_area_language("config.yaml") == "yaml"
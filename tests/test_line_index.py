@@ -0,0 +1,110 @@
+import os
+import pytest
+from line_index import LineIndex
+from waystation import Match, get_plain_lines_from_file
+
+
+def readlines_window(path, line_no, context):
+    with open(path) as f:
+        lines = f.readlines()
+    idx = line_no - 1
+    return [line.rstrip() for line in lines[max(0, idx - context):idx + context + 1]]
+
+
+@pytest.mark.parametrize("text", [
+    "one\ntwo\nthree\nfour\nfive\n",
+    "one\ntwo\nthree\nfour\nfive",
+    "one\r\ntwo\r\n\r\nfour\r\n",
+    "only",
+    "café\n☕ ünïcode\nend\n",
+])
+def test_window_matches_readlines(tmp_path, text):
+    path = tmp_path / "file.txt"
+    path.write_bytes(text.encode())
+    index = LineIndex()
+    count = len(text.splitlines())
+    assert index.line_count(path) == count
+    for line_no in range(1, count + 1):
+        for context in (0, 1, 3):
+            assert index.window(path, line_no, context, context) == readlines_window(path, line_no, context)
+    with pytest.raises(IndexError):
+        index.window(path, count + 1)
+
+
+def test_empty_file(tmp_path):
+    path = tmp_path / "empty.txt"
+    path.write_text("")
+    index = LineIndex()
+    assert index.line_count(path) == 0
+    with pytest.raises(IndexError):
+        index.window(path, 1)
+
+
+def test_offsets_are_scanned_lazily_and_reused(tmp_path):
+    path = tmp_path / "big.txt"
+    path.write_text("".join(f"line {i}\n" for i in range(10_000)))
+    index = LineIndex()
+    assert index.window(path, 5, 1, 1) == ["line 3", "line 4", "line 5"]
+    mapped = index._files[str(path)]
+    assert not mapped.complete
+    assert len(mapped.starts) < 10
+    assert index.window(path, 9_000) == ["line 8999"]
+    assert index._files[str(path)] is mapped
+
+
+def test_changed_file_is_mapped_again(tmp_path):
+    path = tmp_path / "file.txt"
+    path.write_text("old\n")
+    index = LineIndex(max_files=1)
+    assert index.window(path, 1) == ["old"]
+    path.write_text("new line\nsecond\n")
+    os.utime(path, ns=(0, 10**9))
+    assert index.window(path, 2) == ["second"]
+
+    other = tmp_path / "other.txt"
+    other.write_text("x\n")
+    index.window(other, 1)
+    assert len(index) == 1
+
+
+def test_get_plain_lines_from_file_uses_context(tmp_path):
+    path = tmp_path / "code.py"
+    path.write_text("a\nb\nc\nd\ne\n")
+    match = Match(file_path=str(path), line_no=3, line="c\n")
+    assert get_plain_lines_from_file(match) == "b\nc\nd"
+    assert get_plain_lines_from_file(match, 3) == "a\nb\nc\nd\ne"
+    missing = Match(file_path=str(tmp_path / "gone.py"), line_no=1, line="stored line")
+    assert get_plain_lines_from_file(missing) == "stored line"
+
+
+def test_line_window_grows_by_reading_only_new_chunks(tmp_path):
+    from line_index import LineWindow
+    path = tmp_path / "module.py"
+    path.write_text("".join(f"line {i}\n" for i in range(1, 101)))
+    index = LineIndex()
+    reads = []
+    original = index.lines
+    index.lines = lambda p, first, last: reads.append((first, last)) or original(p, first, last)
+
+    window = LineWindow(path, 50, context_lines=2, index=index)
+    assert (window.first, window.last) == (48, 52)
+    assert window.render().splitlines()[2] == "█line 50"
+    assert window.expand_up(10) == 10
+    assert window.expand_down(10) == 10
+    assert reads == [(48, 52), (38, 47), (53, 62)]
+    assert window.lines == [f"line {i}" for i in range(38, 63)]
+    assert window.render().splitlines()[window.hit_row()] == "█line 50"
+
+    window.show_header(5)
+    rows = window.render().splitlines()
+    assert rows[:6] == ["│line 1", "│line 2", "│line 3", "│line 4", "│line 5", "⋮"]
+    assert rows[window.hit_row()] == "█line 50"
+
+    # growing into the header or past the ends stops at the file
+    assert window.expand_up(100) == 37
+    assert window.render().splitlines()[:2] == ["│line 1", "│line 2"]
+    assert window.render().splitlines()[window.hit_row()] == "█line 50"
+    assert window.expand_down(100) == 38
+    assert window.expand_down(10) == 0
+    window.show_header(0)
+    assert len(window.render().splitlines()) == 100
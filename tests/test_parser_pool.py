@@ -0,0 +1,40 @@
+import pytest
+from db import Match
+from parser_pool import ParserPool
+from waystation import get_grep_ast_preview
+
+
+@pytest.fixture(scope="module")
+def pool():
+    pool = ParserPool(processes=2)
+    yield pool
+    pool.shutdown()
+
+
+def sample_matches():
+    return [
+        Match(file_path="test_data/sample_code.py", file_name="sample_code.py", line_no=no, line=line)
+        for no, line in enumerate(open("test_data/sample_code.py").read().splitlines(keepends=True), 1)
+        if line.strip().startswith(("def ", "async def ", "class "))
+    ] + [
+        Match(file_path="test_data/other_file.py", file_name="other_file.py", line_no=1,
+              line=open("test_data/other_file.py").readline()),
+        Match(file_path="test_data/missing.py", file_name="missing.py", line_no=1, line="gone"),
+    ]
+
+
+async def test_previews_match_in_process_rendering(pool):
+    matches = sample_matches()
+    expected = []
+    for match in matches:
+        try:
+            expected.append(get_grep_ast_preview(match))
+        except Exception:
+            expected.append("<no preview>")
+    assert await pool.previews(matches) == expected
+
+
+def test_files_stick_to_one_worker(pool):
+    assert pool.worker_for("test_data/sample_code.py") == pool.worker_for("./test_data/sample_code.py")
+    assert 0 <= pool.worker_for("test_data/other_file.py") < pool.processes
+
@@ -0,0 +1,186 @@
+import json
+import os
+import grep_ast
+from preview_cache import PreviewCache
+from waystation import process_filename
+
+ARGS = {"verbose": False, "encoding": "utf8", "ignore_case": True, "color": True, "line_numbers": False}
+
+
+def fresh_preview(path, pattern):
+    with open(path, encoding="utf8") as f:
+        tc = grep_ast.TreeContext(str(path), f.read(), color=True)
+    tc.add_lines_of_interest(tc.grep(pattern, ignore_case=True))
+    tc.add_context()
+    return tc.format()
+
+
+def write_module(path, count):
+    path.write_text("".join(f"def func_{i}():\n    return {i}\n\n" for i in range(count)))
+    return path
+
+
+def test_hits_in_one_file_share_a_parse(tmp_path):
+    path = write_module(tmp_path / "module.py", 50)
+    cache = PreviewCache()
+    for i in range(50):
+        preview = process_filename(path, {**ARGS, "pattern": f"def func_{i}()"}, cache=cache)
+        # a reused TreeContext renders exactly what a fresh one does
+        assert preview == fresh_preview(path, rf"def func_{i}\(\)")
+    assert cache.parses == 1
+
+
+def test_edited_file_is_parsed_again(tmp_path):
+    path = write_module(tmp_path / "module.py", 3)
+    cache = PreviewCache()
+    assert "func_2" in process_filename(path, {**ARGS, "pattern": "def func_2()"}, cache=cache)
+    write_module(path, 5)
+    os.utime(path, ns=(0, 10**9))
+    assert "func_4" in process_filename(path, {**ARGS, "pattern": "def func_4()"}, cache=cache)
+    assert cache.parses == 2
+    assert len(cache) == 1
+
+
+def test_cache_is_bounded(tmp_path):
+    paths = [write_module(tmp_path / f"m{i}.py", 10) for i in range(4)]
+    cache = PreviewCache(max_entries=2)
+    for path in paths:
+        cache.tree_context(path)
+    assert len(cache) == 2
+
+    cache = PreviewCache(max_bytes=os.path.getsize(paths[0]) * 3)
+    for path in paths:
+        cache.tree_context(path)
+    # one parsed file is already over a third of the budget
+    assert len(cache) == 1
+    assert cache.total_bytes > 0
+
+
+def test_unparseable_files_are_cached_as_none(tmp_path):
+    unknown = tmp_path / "notes.unknownext"
+    unknown.write_text("def foo():\n")
+    binary = tmp_path / "blob.py"
+    binary.write_bytes(b"\xff\xfe\x00def")
+    cache = PreviewCache()
+    for _ in range(3):
+        assert cache.tree_context(unknown, encoding="utf8") is None
+        assert cache.tree_context(binary, encoding="utf8") is None
+    # neither has a parser to try, so nothing was parsed
+    assert cache.parses == 0
+    assert process_filename(unknown, {**ARGS, "pattern": "foo"}, cache=cache) is None
+
+
+def test_preview_is_anchored_on_the_hit_line(tmp_path):
+    from waystation import SearchHit, get_grep_ast_preview
+    path = tmp_path / "dupes.py"
+    path.write_text("def first():\n    return None\n\n\ndef second():\n    x = 1\n    return None\n")
+    hit = SearchHit(str(path), "dupes.py", 7, "    return None\n", ((11, 15),))
+    preview = get_grep_ast_preview(hit)
+    marked = [line for line in preview.splitlines() if "\033[31m█" in line]
+    # only the hit is a line of interest, not the other `return None`
+    assert len(marked) == 1
+    assert "return \033[1;31mNone\033[0m" in marked[0]
+
+    # a saved match carries its submatches in grep_meta
+    saved = hit.to_match()
+    saved.grep_meta = json.dumps(saved.grep_meta)
+    assert get_grep_ast_preview(saved) == preview
+
+
+def test_preview_falls_back_to_grep_when_the_line_moved(tmp_path):
+    from waystation import SearchHit, get_grep_ast_preview
+    path = tmp_path / "moved.py"
+    path.write_text("def a():\n    pass\n")
+    hit = SearchHit(str(path), "moved.py", 5, "def a():\n", ((0, 3),))
+    assert "def a()" in get_grep_ast_preview(hit)
+
+
+def test_files_are_sniffed_once(tmp_path, monkeypatch):
+    from preview_cache import PreviewPolicy
+    cache = PreviewCache(policy=PreviewPolicy(max_ast_bytes=10_000, max_line_length=100, sniff_bytes=1000))
+    files = {
+        "code.py": b"def a():\n    pass\n",
+        "blob.py": b"\x00\x01def",
+        "latin.py": "caf\xe9 = 1\n".encode("latin-1"),
+        "big.py": b"x = 1\n" * 2000,
+        "bundle.min.js": b"var a=1;" * 50 + b"\n",
+        "one_line.js": b"var a=1;" * 500,
+    }
+    for name, data in files.items():
+        (tmp_path / name).write_bytes(data)
+    classified = []
+    original = cache._classify
+    monkeypatch.setattr(cache, "_classify", lambda *args: classified.append(args[0]) or original(*args))
+    verdicts = {name: cache.sniff(tmp_path / name) for name in files}
+    assert verdicts == {
+        "code.py": "text", "blob.py": "binary", "latin.py": "undecodable",
+        "big.py": "large", "bundle.min.js": "minified", "one_line.js": "minified",
+    }
+    for name in files:
+        cache.sniff(tmp_path / name)
+    assert len(classified) == len(files)
+
+
+def test_guarded_previews(tmp_path, monkeypatch):
+    import waystation
+    from preview_cache import PreviewPolicy
+    from waystation import SearchHit, get_grep_ast_preview
+    monkeypatch.setattr(waystation, "preview_cache", PreviewCache(policy=PreviewPolicy(max_line_length=100)))
+
+    blob = tmp_path / "blob.py"
+    blob.write_bytes(b"needle\x00")
+    assert get_grep_ast_preview(SearchHit(str(blob), "blob.py", 1, "needle")) == "<no preview>"
+
+    bundle = tmp_path / "bundle.js"
+    line = "a" * 1000 + "needle" + "b" * 1000
+    bundle.write_text(f"first\n{line}\nlast\n")
+    preview = get_grep_ast_preview(SearchHit(str(bundle), "bundle.js", 2, line + "\n", ((1000, 1006),)))
+    first, hit, last = preview.splitlines()
+    assert (first, last) == ("first", "last")
+    assert "needle" in hit and len(hit) <= 302
+    assert waystation.preview_cache.parses == 0
+
+
+def test_slow_parse_shows_plain_window_until_it_finishes(tmp_path, monkeypatch):
+    import time
+    import waystation
+    from preview_cache import PreviewPolicy
+    from waystation import SearchHit, get_grep_ast_preview
+    cache = PreviewCache(policy=PreviewPolicy(parse_timeouts={"python": 0.0}))
+    monkeypatch.setattr(waystation, "preview_cache", cache)
+    slow_tree_context = grep_ast.TreeContext
+    def tree_context(*args, **kwargs):
+        time.sleep(0.2)
+        return slow_tree_context(*args, **kwargs)
+    monkeypatch.setattr(grep_ast, "TreeContext", tree_context)
+
+    path = write_module(tmp_path / "module.py", 5)
+    hit = SearchHit(str(path), "module.py", 4, "def func_1():\n", ((0, 3),))
+    assert get_grep_ast_preview(hit) == "def func_0():\n    return 0\n\ndef func_1():\n    return 1\n\ndef func_2():"
+    # the parse carries on in the background and is used once it is done
+    cache._parser.shutdown(wait=True)
+    assert cache.parses == 1
+    assert "█" in get_grep_ast_preview(hit)
+
+
+def test_parse_of_a_replaced_entry_is_not_counted(tmp_path, monkeypatch):
+    import time
+    import pytest
+    from preview_cache import PreviewTimeout
+    slow_tree_context = grep_ast.TreeContext
+    def tree_context(*args, **kwargs):
+        time.sleep(0.2)
+        return slow_tree_context(*args, **kwargs)
+    monkeypatch.setattr(grep_ast, "TreeContext", tree_context)
+    path = write_module(tmp_path / "module.py", 5)
+    cache = PreviewCache()
+    with pytest.raises(PreviewTimeout):
+        cache.tree_context(path, timeout=0)
+
+    # edited while the parse runs
+    write_module(path, 2)
+    os.utime(path, ns=(0, 10**9))
+    code = cache.read(path)
+    cache._parser.shutdown(wait=True)
+    assert cache.parses == 1
+    assert cache.total_bytes == len(code)
@@ -0,0 +1,85 @@
+import subprocess
+import pytest
+from repo_info import RepoInfoCache, rev_parse_git_info
+
+
+def git(repo, *args):
+    return subprocess.run(["git", *args], cwd=repo, check=True, capture_output=True, text=True).stdout.strip()
+
+
+@pytest.fixture
+def repo(tmp_path):
+    repo = tmp_path / "repo"
+    repo.mkdir()
+    git(repo, "init", "-b", "main")
+    (repo / "file.txt").write_text("hello")
+    git(repo, "add", "file.txt")
+    git(repo, "commit", "-m", "init")
+    return repo
+
+
+def test_matches_rev_parse_without_running_git(repo, monkeypatch):
+    (repo / "sub" / "dir").mkdir(parents=True)
+    expected = rev_parse_git_info(str(repo))
+    cache = RepoInfoCache()
+    monkeypatch.setattr(subprocess, "check_output", lambda *args, **kwargs: pytest.fail("ran git"))
+    assert cache.get(str(repo)) == expected
+    assert cache.get(str(repo / "sub" / "dir")) == expected
+    assert cache.get(str(repo.parent)) == (None, None, None)
+
+
+def test_follows_commits_branches_and_detached_head(repo):
+    cache = RepoInfoCache()
+    root, sha, branch = cache.get(str(repo))
+    assert branch == "main"
+
+    (repo / "file.txt").write_text("changed")
+    git(repo, "commit", "-am", "second")
+    assert cache.get(str(repo)) == rev_parse_git_info(str(repo))
+    assert cache.get(str(repo))[1] != sha
+
+    git(repo, "checkout", "-b", "feature/x")
+    assert cache.get(str(repo))[2] == "feature/x"
+
+    git(repo, "checkout", sha)
+    assert cache.get(str(repo)) == (root, sha, "HEAD")
+
+    # refs moved into packed-refs are still found
+    git(repo, "checkout", "main")
+    git(repo, "pack-refs", "--all")
+    assert cache.get(str(repo)) == rev_parse_git_info(str(repo))
+    assert cache.rev_parses == 0
+
+
+def test_worktree_reads_the_shared_refs(repo, tmp_path):
+    worktree = tmp_path / "worktree"
+    git(repo, "worktree", "add", "-b", "other", str(worktree))
+    assert RepoInfoCache().get(str(worktree)) == rev_parse_git_info(str(worktree))
+
+
+def test_unborn_branch_asks_git(tmp_path):
+    empty = tmp_path / "empty"
+    empty.mkdir()
+    git(empty, "init")
+    cache = RepoInfoCache()
+    assert cache.get(str(empty)) == (None, None, None)
+    assert cache.rev_parses == 1
+
+
+def test_search_roots_agree_with_git_info_in_a_worktree(repo, tmp_path):
+    from waystation import get_git_info, repo_root_for
+    worktree = tmp_path / "worktree"
+    git(repo, "worktree", "add", "-b", "other", str(worktree))
+    (worktree / "pkg").mkdir()
+    assert repo_root_for(str(worktree / "pkg")) == get_git_info(str(worktree / "pkg"))[0] == str(worktree.resolve())
+
+
+def test_saved_hit_gets_the_repo_of_its_own_file(repo, tmp_path):
+    from app_actions import enrich_match_with_git_info
+    from waystation import UserGrep, search_roots
+    # the search root isn't a repo, the file is in one below it
+    hits = search_roots(UserGrep("hello", [str(tmp_path)]))
+    assert [hit.root for hit in hits] == [str(tmp_path)]
+    match = hits[0].to_match()
+    enrich_match_with_git_info(match)
+    assert match.git_repo_root == str(repo.resolve())
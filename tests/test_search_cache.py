@@ -0,0 +1,262 @@
+import os
+import time
+import waystation
+import subprocess
+from search_cache import SearchCache, IncrementalSearch, file_stats, tree_fingerprint
+from waystation import UserGrep, SearchHit, SearchJobManager, get_rg_matches
+
+
+def make_hits(n, path="a.py"):
+    return [SearchHit(file_path=path, file_name=path, line_no=i, line=f"line {i}") for i in range(n)]
+
+
+def backdate(*paths):
+    """Date files an hour back, so none count as changed while a search ran."""
+    an_hour_ago = time.time_ns() - 3600 * 10**9
+    for path in paths:
+        os.utime(path, ns=(an_hour_ago, an_hour_ago))
+
+
+def make_tree(tmp_path):
+    (tmp_path / "pkg").mkdir()
+    (tmp_path / "pkg" / "one.py").write_text("def one():\n    return 1\n")
+    (tmp_path / "two.py").write_text("def two():\n    return 2\n")
+    backdate(tmp_path / "pkg" / "one.py", tmp_path / "two.py")
+    return str(tmp_path)
+
+
+def test_cache_hit_skips_ripgrep(tmp_path, monkeypatch):
+    root = make_tree(tmp_path)
+    cache = SearchCache()
+    user_grep = UserGrep("def", [root])
+    first = get_rg_matches(user_grep, cache=cache)
+    assert len(first) == 2
+
+    def fail(args):
+        raise AssertionError("ripgrep should not run for a cached search")
+    monkeypatch.setattr(waystation, "iter_rg_matches", fail)
+    second = get_rg_matches(UserGrep("def", [root]), cache=cache)
+    assert [(h.file_path, h.line_no) for h in second] == [(h.file_path, h.line_no) for h in first]
+
+
+def test_cache_invalidated_when_tree_changes(tmp_path):
+    root = make_tree(tmp_path)
+    cache = SearchCache()
+    user_grep = UserGrep("def", [root])
+    assert len(get_rg_matches(user_grep, cache=cache)) == 2
+
+    fingerprint = tree_fingerprint(file_stats(user_grep))
+    (tmp_path / "pkg" / "three.py").write_text("def three():\n    return 3\n")
+    assert tree_fingerprint(file_stats(user_grep)) != fingerprint
+    assert cache.get(user_grep) is None
+    assert len(get_rg_matches(user_grep, cache=cache)) == 3
+
+
+def test_cache_key_includes_pattern_and_paths():
+    cache = SearchCache()
+    cache.put(UserGrep("def", ["a"]), make_hits(1), fingerprint=())
+    assert cache.get(UserGrep("def", ["a"]), fingerprint=()) is not None
+    assert cache.get(UserGrep("class", ["a"]), fingerprint=()) is None
+    assert cache.get(UserGrep("def", ["b"]), fingerprint=()) is None
+
+
+def test_cache_lru_eviction_and_size_cap():
+    cache = SearchCache(max_entries=2, max_hits=10)
+    cache.put(UserGrep("a", []), make_hits(3), fingerprint=())
+    cache.put(UserGrep("b", []), make_hits(3), fingerprint=())
+    # touch "a" so "b" is the least recently used
+    assert cache.get(UserGrep("a", []), fingerprint=()) is not None
+    cache.put(UserGrep("c", []), make_hits(3), fingerprint=())
+    assert len(cache) == 2
+    assert cache.get(UserGrep("b", []), fingerprint=()) is None
+
+    cache.put(UserGrep("d", []), make_hits(6), fingerprint=())
+    assert cache.total_hits <= 10
+    cache.put(UserGrep("e", []), make_hits(11), fingerprint=())
+    assert cache.get(UserGrep("e", []), fingerprint=()) is None
+
+
+def test_cache_entries_expire(monkeypatch):
+    cache = SearchCache(ttl=5)
+    cache.put(UserGrep("a", []), make_hits(1), fingerprint=())
+    now = time.monotonic()
+    monkeypatch.setattr("search_cache.time.monotonic", lambda: now + 10)
+    assert cache.get(UserGrep("a", []), fingerprint=()) is None
+
+
+async def test_search_job_served_from_cache(tmp_path):
+    root = make_tree(tmp_path)
+    jobs = SearchJobManager(cache=SearchCache())
+    first = jobs.start(UserGrep("def", [root]))
+    assert sum([len(batch) async for batch in first.stream()]) == 2
+    assert not first.from_cache
+
+    second = jobs.start(UserGrep("def", [root]))
+    assert sum([len(batch) async for batch in second.stream()]) == 2
+    assert second.from_cache
+    assert second.procs == []
+
+
+def test_incremental_refresh_rescans_only_changed_files(tmp_path, monkeypatch):
+    root = make_tree(tmp_path)
+    (tmp_path / "pkg" / "gone.py").write_text("def gone():\n    pass\n")
+    for i in range(4):
+        (tmp_path / f"unchanged_{i}.txt").write_text("nothing to see\n")
+    backdate(tmp_path / "pkg" / "gone.py", *tmp_path.glob("unchanged_*.txt"))
+    incremental = IncrementalSearch()
+    user_grep = UserGrep("def", [root])
+    hits = get_rg_matches(user_grep, incremental=incremental)
+    assert len(hits) == 3
+    assert incremental.can_refresh(user_grep)
+
+    one = tmp_path / "pkg" / "one.py"
+    one.write_text("def one():\n    return 1\n\ndef uno():\n    return 1\n")
+    os.utime(one, ns=(time.time_ns() + 10**9, time.time_ns() + 10**9))
+    (tmp_path / "pkg" / "gone.py").unlink()
+    (tmp_path / "three.py").write_text("def three():\n    return 3\n")
+
+    searched = []
+    real_iter = waystation.iter_rg_matches
+    def recording_iter(args):
+        searched.extend(args.paths)
+        return real_iter(args)
+    monkeypatch.setattr(waystation, "iter_rg_matches", recording_iter)
+
+    refreshed = incremental.refresh(user_grep)
+    assert sorted(os.path.basename(p) for p in searched) == ["one.py", "three.py"]
+    assert sorted((os.path.basename(h.file_path), h.line_no) for h in refreshed) == [
+        ("one.py", 1), ("one.py", 4), ("three.py", 1), ("two.py", 1)
+    ]
+
+
+def test_incremental_refresh_falls_back_when_most_files_changed(tmp_path):
+    root = make_tree(tmp_path)
+    incremental = IncrementalSearch(full_rescan_ratio=0.5)
+    user_grep = UserGrep("def", [root])
+    get_rg_matches(user_grep, incremental=incremental)
+    for name in ("a.py", "b.py", "c.py"):
+        (tmp_path / name).write_text("def f():\n    pass\n")
+    assert incremental.refresh(user_grep) is None
+    assert incremental.refresh(UserGrep("class", [root])) is None
+
+
+async def test_search_job_refreshes_incrementally_when_cache_is_stale(tmp_path):
+    root = make_tree(tmp_path)
+    jobs = SearchJobManager(cache=SearchCache(), incremental=IncrementalSearch())
+    first = jobs.start(UserGrep("def", [root]))
+    assert sum([len(batch) async for batch in first.stream()]) == 2
+
+    (tmp_path / "pkg" / "three.py").write_text("def three():\n    return 3\n")
+    second = jobs.start(UserGrep("def", [root]))
+    assert sum([len(batch) async for batch in second.stream()]) == 3
+    assert second.incremental_refresh
+    # one ripgrep over the single changed file, owned by the job
+    assert len(second.procs) == 1
+
+
+async def test_search_job_refresh_streams_each_chunk(tmp_path):
+    root = make_tree(tmp_path)
+    for i in range(10):
+        (tmp_path / f"unchanged_{i}.txt").write_text("nothing to see\n")
+    backdate(*tmp_path.glob("unchanged_*.txt"))
+    incremental = IncrementalSearch(chunk_size=1)
+    jobs = SearchJobManager(incremental=incremental)
+    assert sum([len(batch) async for batch in jobs.start(UserGrep("def", [root])).stream()]) == 2
+
+    for name in ("three.py", "four.py"):
+        (tmp_path / name).write_text(f"def {name[:-3]}():\n    pass\n")
+    job = jobs.start(UserGrep("def", [root]))
+    batches = [batch async for batch in job.stream()]
+    assert job.incremental_refresh
+    assert len(job.procs) == 2
+    # the kept hits, then one batch per rescanned chunk
+    assert [len(batch) for batch in batches] == [2, 1, 1]
+    assert all(hit.root == root for batch in batches for hit in batch)
+    assert len(incremental.refresh(UserGrep("def", [root]))) == 4
+
+
+async def test_cancelled_refresh_kills_its_ripgrep_and_records_nothing(tmp_path):
+    root = make_tree(tmp_path)
+    for i in range(10):
+        (tmp_path / f"unchanged_{i}.txt").write_text("nothing to see\n")
+    backdate(*tmp_path.glob("unchanged_*.txt"))
+    incremental = IncrementalSearch(chunk_size=1)
+    jobs = SearchJobManager(incremental=incremental)
+    assert sum([len(batch) async for batch in jobs.start(UserGrep("def", [root])).stream()]) == 2
+
+    for name in ("three.py", "four.py"):
+        (tmp_path / name).write_text(f"def {name[:-3]}():\n    pass\n")
+    job = jobs.start(UserGrep("def", [root]))
+    stream = job.stream()
+    assert len(await anext(stream)) == 2
+    assert len(await anext(stream)) == 1
+    assert jobs.cancel()
+    assert [batch async for batch in stream] == []
+    assert len(job.procs) == 1
+    assert all(proc.returncode is not None for proc in job.procs)
+    # the recorded run is still the first one, so both new files are rescanned
+    plan = incremental.plan(UserGrep("def", [root]), file_stats(UserGrep("def", [root])))
+    assert sorted(os.path.basename(path) for path in plan[0]) == ["four.py", "three.py"]
+
+
+async def test_fresh_search_streams_before_listing_files(tmp_path, monkeypatch):
+    root = make_tree(tmp_path)
+    incremental = IncrementalSearch()
+    events = []
+    def recording_file_stats(args, started=None):
+        events.append("snapshot")
+        return file_stats(args, started)
+    monkeypatch.setattr(waystation, "file_stats", recording_file_stats)
+    jobs = SearchJobManager(incremental=incremental)
+    async for batch in jobs.start(UserGrep("def", [root])).stream():
+        events.append("batch")
+    assert events[0] == "batch"
+    assert events[-1] == "snapshot"
+    assert incremental.can_refresh(UserGrep("def", [root]))
+
+
+def test_files_changed_during_a_search_are_rescanned(tmp_path):
+    root = make_tree(tmp_path)
+    incremental = IncrementalSearch()
+    user_grep = UserGrep("def", [root])
+    started = time.time_ns()
+    hits = get_rg_matches(user_grep)
+    # edited after ripgrep read it, but before the files were stated
+    (tmp_path / "two.py").write_text("def two():\n    return 2\n\ndef dos():\n    return 2\n")
+    incremental.record(user_grep, file_stats(user_grep, started), hits)
+    assert len(incremental.refresh(user_grep)) == 3
+
+
+async def test_file_edited_in_place_in_a_repo_is_searched_again(tmp_path):
+    root = make_tree(tmp_path)
+    subprocess.run(["git", "init", "-q", root], check=True)
+    jobs = SearchJobManager(cache=SearchCache())
+    first = jobs.start(UserGrep("def", [root]))
+    assert sum([len(batch) async for batch in first.stream()]) == 2
+
+    # neither HEAD, the index nor any directory changes
+    with open(tmp_path / "two.py", "a") as f:
+        f.write("\ndef dos():\n    return 2\n")
+    second = jobs.start(UserGrep("def", [root]))
+    assert sum([len(batch) async for batch in second.stream()]) == 3
+    assert not second.from_cache
+
+
+async def test_new_search_in_a_recently_edited_tree_is_not_cached(tmp_path):
+    root = make_tree(tmp_path)
+    cache = SearchCache()
+    (tmp_path / "three.py").write_text("def three():\n    return 3\n")
+    jobs = SearchJobManager(cache=cache)
+    assert sum([len(batch) async for batch in jobs.start(UserGrep("def", [root])).stream()]) == 3
+    # three.py may have changed while ripgrep ran, so the hits can't be trusted later
+    assert len(cache) == 0
+
+
+async def test_search_over_max_hits_is_not_kept(tmp_path):
+    root = make_tree(tmp_path)
+    cache, incremental = SearchCache(), IncrementalSearch()
+    jobs = SearchJobManager(cache=cache, incremental=incremental)
+    job = jobs.start(UserGrep("def", [root]), max_hits=1)
+    assert sum([len(batch) async for batch in job.stream()]) == 2
+    assert len(cache) == 0
+    assert not incremental.can_refresh(UserGrep("def", [root]))
@@ -0,0 +1,71 @@
+import pytest
+from waystation import SearchHit
+from search_results import SearchResults
+
+
+def make_match(i):
+    return SearchHit(
+        line=f"line {i}",
+        file_path=f"src/file_{i % 3}.py",
+        file_name=f"file_{i % 3}.py",
+        line_no=i,
+        submatches=((0, 4),),
+        root=f"/repos/{i % 2}",
+    )
+
+
+def test_results_under_budget_stay_in_memory():
+    results = SearchResults(budget=10)
+    results.extend(make_match(i) for i in range(5))
+    assert len(results) == 5
+    assert results.spilled == 0
+    assert results[4].line == "line 4"
+
+
+def test_results_over_budget_spill_to_disk():
+    results = SearchResults(budget=3, page_size=4)
+    results.extend(make_match(i) for i in range(20))
+    assert len(results) == 20
+    assert len(results.in_memory) == 3
+    assert results.spilled == 17
+
+    # spilled matches come back intact, a page at a time
+    match = results[11]
+    assert match.line == "line 11"
+    assert match.file_name == "file_2.py"
+    assert match.submatches == ((0, 4),)
+    assert match.root == "/repos/1"
+    assert len(results._page) == 4
+    assert results[-1].line_no == 19
+
+    assert [m.line_no for m in results] == list(range(20))
+    assert [m.line_no for m in results.page(2, 3)] == [2, 3, 4]
+
+
+def test_results_index_out_of_range():
+    results = SearchResults(budget=1)
+    results.extend(make_match(i) for i in range(2))
+    try:
+        results[2]
+        assert False, "expected IndexError"
+    except IndexError:
+        pass
+
+
+@pytest.mark.parametrize("budget", [1, 5])
+@pytest.mark.parametrize("idx", [-3, -4, 2, 3])
+def test_results_index_out_of_range_either_side(budget, idx):
+    results = SearchResults(budget=budget)
+    results.extend(make_match(i) for i in range(2))
+    with pytest.raises(IndexError):
+        results[idx]
+    assert results[-2].line_no == 0
+
+
+def test_close_releases_spill():
+    results = SearchResults(budget=1)
+    results.extend(make_match(i) for i in range(5))
+    results.close()
+    results.close()
+    assert len(results) == 0
+    assert not results
@@ -5,8 +5,9 @@ import tempfile
 from app_actions import get_active_flow_id
 from db import get_db
 from cli import RGApp
-from waystation import UserGrep, Match
+from waystation import UserGrep, Match, SearchHit, SearchOptions
 from textual.widgets import ListView
+from screens.search_screen import preview_key as search_preview_key
 
 @pytest.fixture
 def db():
@@ -29,6 +30,7 @@ async def test_input_submission_returns_matches(db):
         paths_input.value = "test_data/"
 
         await pilot.press("enter")
+        await app.workers.wait_for_complete()
         assert len(app.screen.matches) == 1
         assert "test_data/sample_code.py" in app.screen.matches[0].file_path
         datatable = app.screen.query_one('#matches_table')
@@ -40,12 +42,79 @@ async def test_search_screen_initialization_with_user_grep(db):
     user_grep = UserGrep("test", ["test_data/"])
     app = RGApp(db, user_grep)
     async with app.run_test() as pilot:
+        await app.workers.wait_for_complete()
         assert app.user_grep == user_grep
         assert len(app.screen.matches) > 0
         datatable = app.screen.query_one('#matches_table')
         assert len(datatable.rows) > 0
 
 
+async def test_search_results_stream_into_datatable(db):
+    """Test that rows are appended as batches arrive and the first row is selected."""
+    app = RGApp(db)
+    async with app.run_test() as pilot:
+        await pilot.press("1")
+        screen = app.screen
+        screen.append_matches([SearchHit(file_path="a.py", file_name="a.py", line_no=1, line="first")])
+        screen.append_matches([SearchHit(file_path="b.py", file_name="b.py", line_no=2, line="second")])
+        datatable = screen.query_one('#matches_table')
+        assert len(datatable.rows) == 2
+        assert len(screen.matches) == 2
+        assert datatable.cursor_coordinate.row == 0
+
+
+async def test_new_search_cancels_previous_search(db):
+    """Test that submitting a new pattern cancels the in-flight search job."""
+    app = RGApp(db, UserGrep("def", ["test_data/"]))
+    async with app.run_test() as pilot:
+        screen = app.screen
+        first_job = screen.search_jobs.current
+        screen.query_one('#pattern_input').value = "async def test_some_async_operation"
+        screen.query_one('#paths_input').value = "test_data/"
+        screen.query_one('#pattern_input').focus()
+        await pilot.press("enter")
+        await app.workers.wait_for_complete()
+        assert first_job.cancelled or first_job.done
+        assert screen.search_jobs.current is not first_job
+        assert len(screen.matches) == 1
+
+
+async def test_cancel_search_keeps_rows_found_so_far(db):
+    app = RGApp(db, UserGrep("def", ["test_data/"]))
+    async with app.run_test() as pilot:
+        screen = app.screen
+        job = screen.search_jobs.current
+        screen.action_cancel_search()
+        await app.workers.wait_for_complete()
+        assert screen.search_jobs.current is None
+        assert job.cancelled or job.done
+        assert not screen.is_searching()
+
+
+async def test_rows_are_paged_into_the_datatable(db, monkeypatch):
+    """Test that only a page of rows is added and more load as the cursor nears the end."""
+    monkeypatch.setattr("screens.search_screen.DEFAULT_PAGE_SIZE", 3)
+    app = RGApp(db, UserGrep("def", ["test_data/"]))
+    app.config["result_budget"] = 4
+    async with app.run_test() as pilot:
+        await app.workers.wait_for_complete()
+        screen = app.screen
+        assert len(screen.matches) > 6
+        assert screen.matches.spilled > 0
+        # a search past the budget isn't held in memory a second time for the caches
+        assert len(app.search_cache) == 0
+        assert not app.incremental_search.can_refresh(screen.user_grep)
+        datatable = screen.query_one('#matches_table')
+        assert datatable.row_count < len(screen.matches)
+
+        datatable.focus()
+        for _ in range(len(screen.matches)):
+            await pilot.press("down")
+        assert datatable.row_count == len(screen.matches)
+        # rows loaded from the spill still resolve to their match
+        assert screen.current_match().line_no == screen.matches[int(datatable.ordered_rows[-1].key.value)].line_no
+
+
 async def test_search_screen_initialization_without_args(db):
     """Test that the search screen focuses on pattern input when no args provided."""
     app = RGApp(db)
@@ -59,30 +128,68 @@ async def test_data_table_row_selection_updates_preview(db):
     user_grep = UserGrep("def", ["./test_data/"])
     app = RGApp(db, user_grep)
     async with app.run_test() as pilot:
+        await app.workers.wait_for_complete()
         datatable = app.screen.query_one('#matches_table')
         datatable.focus()
 
         preview1 = app.screen.query_one('#grep_ast_preview').text
         assert preview1 is not None
         
-        # Test cursor down
+        # Test cursor down, previews render in a worker
         await pilot.press("down")
+        await app.workers.wait_for_complete()
         preview2 = app.screen.query_one('#grep_ast_preview').text
         # Preview should be updated for the next row
         assert preview2 is not None
         assert preview2 != preview1
 
-        # Test cursor up
+        # Test cursor up, the previous row's preview is cached and shown straight away
         await pilot.press("up")
         preview11 = app.screen.query_one('#grep_ast_preview').text
         assert preview11 is not None
         assert preview11 == preview1
 
 
+async def test_rapid_cursor_moves_only_render_the_final_row(db, monkeypatch):
+    import screens.search_screen as search_screen
+    rendered = []
+    original = search_screen.get_grep_ast_preview
+    monkeypatch.setattr(search_screen, "get_grep_ast_preview", lambda match: rendered.append(match.line_no) or original(match))
+    monkeypatch.setattr(search_screen, "PREVIEW_PREFETCH_ROWS", 0)
+    app = RGApp(db, UserGrep("def", ["./test_data/"]))
+    async with app.run_test() as pilot:
+        await app.workers.wait_for_complete()
+        screen = app.screen
+        screen.dg.focus()
+        rendered.clear()
+        # a held key moves the cursor faster than the debounce
+        for row in range(1, 5):
+            screen.dg.move_cursor(row=row)
+        await pilot.pause()
+        await app.workers.wait_for_complete()
+        final = screen.current_match()
+        # the intermediate rows were skipped while the cursor was moving
+        assert rendered == [final.line_no]
+        assert screen.preview.text == original(final)
+
+
+async def test_neighbouring_previews_are_prefetched(db):
+    app = RGApp(db, UserGrep("def", ["./test_data/"]))
+    async with app.run_test() as pilot:
+        await app.workers.wait_for_complete()
+        screen = app.screen
+        screen.dg.focus()
+        await pilot.press("down")
+        await app.workers.wait_for_complete()
+        for row in (0, 2, 3, 4):
+            match = screen.matches[screen.visible_matches[row]]
+            assert search_preview_key(match) in screen.rendered_previews
+
 async def test_new_search_action_does_not_clear_anything(db):
     user_grep = UserGrep("test", ["test_data/"])
     app = RGApp(db, user_grep)
     async with app.run_test() as pilot:
+        await app.workers.wait_for_complete()
         initial_count = len(app.screen.matches)
         # Initially should have matches
         assert initial_count > 0
@@ -112,6 +219,7 @@ async def test_empty_search_pattern(db):
         paths_input.value = "test_data/"
 
         await pilot.press("enter")
+        await app.workers.wait_for_complete()
         
         # essentially searches for all files in the path
         assert len(app.screen.matches) > 0
@@ -129,10 +237,15 @@ async def test_search_with_multiple_paths(db):
         paths_input.value = "test_data/ tests/"
 
         await pilot.press("enter")
+        await app.workers.wait_for_complete()
         # Should find matches in both directories
         assert len(app.screen.matches) > 0
         assert any("test_data/" in match.file_path for match in app.screen.matches)
         assert any("tests/" in match.file_path for match in app.screen.matches)
+        # hits are labelled with the root they came from
+        datatable = app.screen.query_one('#matches_table')
+        assert "root" in datatable.columns
+        assert all(match.root for match in app.screen.matches)
 
 
 
@@ -148,11 +261,13 @@ async def test_should_clear_data_table_on_resubmission(db):
         pattern_input.value = "def"
         paths_input.value = "test_data/"
         await pilot.press("enter")
+        await app.workers.wait_for_complete()
         assert len(app.screen.matches) > 0
 
         # Resubmit same search
         pattern_input.focus()
         await pilot.press("enter")
+        await app.workers.wait_for_complete()
         assert len(app.screen.matches) > 0  
 
 async def test_search_no_matches(db):
@@ -167,6 +282,7 @@ async def test_search_no_matches(db):
         paths_input.value = "test_data/"
 
         await pilot.press("enter")
+        await app.workers.wait_for_complete()
         assert len(app.screen.matches) == 0
         datatable = app.screen.query_one('#matches_table')
         assert len(datatable.rows) == 0
@@ -219,6 +335,7 @@ async def test_save_match_creates_and_links_to_new_flow(db):
     app = RGApp(db, user_grep)
     
     async with app.run_test() as pilot:
+        await app.workers.wait_for_complete()
         datatable = app.screen.query_one('#matches_table')
         datatable.focus()
               
@@ -241,6 +358,7 @@ async def test_save_match_activates_newly_created_flow(db):
     app = RGApp(db, user_grep)
     
     async with app.run_test() as pilot:
+        await app.workers.wait_for_complete()
         datatable = app.screen.query_one('#matches_table')
         datatable.focus()
         
@@ -255,6 +373,7 @@ async def test_save_match_relates_to_already_active_flow(db):
     app = RGApp(db, user_grep)
     
     async with app.run_test() as pilot:
+        await app.workers.wait_for_complete()
         datatable = app.screen.query_one('#matches_table')
         datatable.focus()
         
@@ -303,6 +422,7 @@ async def test_open_in_editor_action(db):
     user_grep = UserGrep("def", ["test_data/"])
     app = RGApp(db, user_grep)
     async with app.run_test() as pilot:
+        await app.workers.wait_for_complete()
         datatable = app.screen.query_one('#matches_table')
         datatable.focus()
 
@@ -378,6 +498,7 @@ async def test_regex_search(db):
 
     app = RGApp(db, user_grep)
     async with app.run_test() as pilot:
+        await app.workers.wait_for_complete()
         await pilot.pause(0.1)  # Wait for search to complete
 
         # Verify matches were found
@@ -389,4 +510,135 @@ async def test_regex_search(db):
             "def " in match.line and "(" in match.line
             for match in search_screen.matches
         )
-        assert has_function_def, "No function definitions found with regex"
\ No newline at end of file
+        assert has_function_def, "No function definitions found with regex"
+
+
+async def test_options_input_narrows_search(db):
+    app = RGApp(db)
+    async with app.run_test() as pilot:
+        await pilot.press("1")
+        screen = app.screen
+        screen.query_one('#pattern_input').value = "ASYNC DEF"
+        screen.query_one('#paths_input').value = "test_data/"
+        screen.query_one('#options_input').value = "-s"
+        screen.query_one('#pattern_input').focus()
+        await pilot.press("enter")
+        await app.workers.wait_for_complete()
+        assert screen.user_grep.options == SearchOptions(ignore_case=False)
+        assert len(screen.matches) == 0
+
+        screen.query_one('#options_input').value = "-t py -m 1"
+        screen.query_one('#pattern_input').focus()
+        await pilot.press("enter")
+        await app.workers.wait_for_complete()
+        assert len(screen.matches) > 0
+        assert all(match.file_name.endswith(".py") for match in screen.matches)
+        assert len({match.file_path for match in screen.matches}) == len(screen.matches)
+
+async def test_invalid_options_are_reported(db):
+    app = RGApp(db)
+    async with app.run_test() as pilot:
+        await pilot.press("1")
+        screen = app.screen
+        screen.query_one('#pattern_input').value = "def"
+        screen.query_one('#options_input').value = "--bogus"
+        screen.query_one('#pattern_input').focus()
+        await pilot.press("enter")
+        await pilot.pause()
+        assert screen.user_grep is None
+        assert len(screen.matches) == 0
+        assert any("--bogus" in n.message for n in app._notifications)
+
+async def test_previews_render_on_parser_pool(db):
+    from waystation import get_grep_ast_preview
+    app = RGApp(db, UserGrep("def", ["./test_data/"]))
+    app.config["parser_processes"] = 1
+    async with app.run_test() as pilot:
+        await app.workers.wait_for_complete()
+        screen = app.screen
+        screen.dg.focus()
+        await pilot.press("down")
+        await app.workers.wait_for_complete()
+        assert app.parser_pool is not None
+        assert screen.preview.text == get_grep_ast_preview(screen.current_match())
+
+async def test_preview_window_expands_without_reparsing(db, tmp_path):
+    import waystation
+    module = tmp_path / "module.py"
+    module.write_text("import os\n\n" + "".join(f"def func_{i}():\n    return {i}\n\n" for i in range(40)))
+    app = RGApp(db, UserGrep("def func_2", [str(module)]))
+    async with app.run_test() as pilot:
+        await app.workers.wait_for_complete()
+        screen = app.screen
+        screen.dg.focus()
+        await pilot.press("down", "down", "down")
+        await app.workers.wait_for_complete()
+        match = screen.current_match()
+        assert match.line == "def func_22():\n"
+        parses = waystation.preview_cache.parses
+
+        await pilot.press("ctrl+down")
+        rows = screen.preview.text.splitlines()
+        assert rows[3] == "█def func_22():"
+        assert len(rows) == 3 + 1 + 3 + 10
+
+        await pilot.press("ctrl+up")
+        assert len(screen.preview.text.splitlines()) == len(rows) + 10
+        await pilot.press("ctrl+t")
+        rows = screen.preview.text.splitlines()
+        assert rows[0] == "│import os"
+        assert rows[screen.preview_window.hit_row()] == "█def func_22():"
+        assert screen.preview.cursor_location[0] == screen.preview_window.hit_row()
+        await app.workers.wait_for_complete()
+        assert waystation.preview_cache.parses == parses
+
+        # moving the cursor goes back to the AST preview
+        await pilot.press("down")
+        assert screen.preview_window is None
+        await pilot.press("ctrl+down", "ctrl+r")
+        await app.workers.wait_for_complete()
+        assert screen.preview_window is None
+        assert "█" in screen.preview.text
+
+
+async def test_save_all_shown_matches(db):
+    from app_actions import get_flow_matches, get_latest_flow, get_match_snapshots
+    app = RGApp(db, UserGrep("def", ["test_data/"]))
+    async with app.run_test() as pilot:
+        await app.workers.wait_for_complete()
+        screen = app.screen
+        screen.dg.focus()
+        await pilot.press(*"sample")
+        shown = [screen.matches[i] for i in screen.visible_matches]
+        assert shown and all(match.file_name == "sample_code.py" for match in shown)
+
+        await pilot.press("ctrl+s")
+        await app.workers.wait_for_complete()
+        flow_id = get_latest_flow(db).id
+        steps = get_flow_matches(db, flow_id)
+        assert [(match.file_path, match.line_no) for match, _, _ in steps] == [(hit.file_path, hit.line_no) for hit in shown]
+        assert len(get_match_snapshots(db, [match.id for match, _, _ in steps])) == len(steps)
+
+        # saving again doesn't add the same steps twice
+        await pilot.press("ctrl+s")
+        assert len(get_flow_matches(db, flow_id)) == len(steps)
+
+
+async def test_one_bad_snapshot_keeps_the_rest(db, monkeypatch):
+    import screens.search_screen
+    from app_actions import get_flow_matches, get_latest_flow, get_match_snapshots, take_snapshot
+    def flaky_snapshot(match_id, match):
+        if match.line_no == first.line_no and match.file_path == first.file_path:
+            raise UnicodeError("unreadable")
+        return take_snapshot(match_id, match)
+    monkeypatch.setattr(screens.search_screen, "take_snapshot", flaky_snapshot)
+    app = RGApp(db, UserGrep("def", ["test_data/"]))
+    async with app.run_test() as pilot:
+        await app.workers.wait_for_complete()
+        first = app.screen.matches[0]
+        app.screen.dg.focus()
+        await pilot.press("ctrl+s")
+        await app.workers.wait_for_complete()
+        assert app.is_running
+        steps = get_flow_matches(db, get_latest_flow(db).id)
+        assert len(get_match_snapshots(db, [match.id for match, _, _ in steps])) == len(steps) - 1
@@ -0,0 +1,132 @@
+import os
+import subprocess
+import pytest
+import waystation
+import trigram_index
+from waystation import UserGrep, SearchJobManager, SearchOptions, iter_rg_matches
+from trigram_index import TrigramIndex, required_literals
+
+
+def make_tree(tmp_path):
+    root = tmp_path / "tree"
+    (root / "pkg").mkdir(parents=True)
+    (root / "pkg" / "alpha.py").write_text("def alpha():\n    return 'Needle'\n")
+    (root / "pkg" / "beta.py").write_text("def beta():\n    return 'hay'\n")
+    (root / "notes.md").write_text("a needle — café needle\nnothing here\n")
+    (root / "blob.bin").write_bytes(b"needle\0needle")
+    (root / "Pipfile.lock").write_text("needle\n")
+    return root
+
+
+def test_required_literals():
+    assert required_literals("def foo") == ["def foo"]
+    assert required_literals(r"foo\s+bar") == ["foo", "bar"]
+    assert required_literals("foo|bar") == []
+    assert required_literals("[") == ["["]
+
+
+def test_search_matches_ripgrep(tmp_path):
+    root = make_tree(tmp_path)
+    index = TrigramIndex(tmp_path / "index.db")
+    for pattern in ["needle", r"def \w+", "ret.rn", "nothing|hay"]:
+        args = UserGrep(pattern, [str(root)])
+        expected = {(h.file_path, h.line_no, h.line, h.submatches) for h in iter_rg_matches(args)}
+        found = {(h.file_path, h.line_no, h.line, h.submatches) for h in index.search(args)}
+        assert found == expected, pattern
+
+
+def test_search_honours_options_like_ripgrep(tmp_path):
+    root = make_tree(tmp_path)
+    (root / "vendor").mkdir()
+    (root / "vendor" / "lib.py").write_text("needle needle\nneedles\n")
+    index = TrigramIndex(tmp_path / "index.db")
+    for pattern, flags in [
+        ("Needle", "-s"), ("needle", "-w"), ("ret.rn", "-F"), ("return 'hay'", "-F"),
+        ("needle", "-g '!vendor'"), ("needle", "-g '*.md'"), ("needle", "-m 1"),
+        ("needle", "-g '!*lock' -g 'Pipfile.lock'"), ("def", "--max-filesize 30"),
+    ]:
+        args = UserGrep(pattern, [str(root)], SearchOptions.parse(flags))
+        expected = {(h.file_path, h.line_no, h.submatches) for h in iter_rg_matches(args)}
+        found = {(h.file_path, h.line_no, h.submatches) for h in index.search(args)}
+        assert found == expected, (pattern, flags)
+
+
+@pytest.mark.parametrize("in_repo", [False, True])
+def test_hidden_paths_are_skipped_like_ripgrep(tmp_path, in_repo):
+    root = make_tree(tmp_path)
+    (root / ".hidden").mkdir()
+    (root / ".hidden" / "a.txt").write_text("needle\n")
+    (root / "pkg" / ".env").write_text("needle\n")
+    if in_repo:
+        subprocess.run(["git", "init", "-q", str(root)], check=True)
+        subprocess.run(["git", "add", "-A"], cwd=root, check=True)
+    index = TrigramIndex(tmp_path / "index.db")
+    args = UserGrep("needle", [str(root)])
+    expected = {(h.file_path, h.line_no) for h in iter_rg_matches(args)}
+    found = {(h.file_path, h.line_no) for h in index.search(args)}
+    assert found == expected
+    assert {os.path.basename(path) for path, _ in found} == {"alpha.py", "notes.md"}
+
+
+def test_files_too_big_to_index_are_still_searched(tmp_path):
+    root = make_tree(tmp_path)
+    (root / "big.txt").write_text("hay\n" * 20 + "a needle at the end\n")
+    index = TrigramIndex(tmp_path / "index.db", max_file_size=64)
+    assert index.update(str(root)) == 6
+    assert "big.txt" in {os.path.basename(p) for p in index.candidates(str(root), "needle")}
+    args = UserGrep("needle", [str(root)])
+    expected = {(h.file_path, h.line_no) for h in iter_rg_matches(args)}
+    found = {(h.file_path, h.line_no) for h in index.search(args)}
+    assert found == expected
+    assert (str(root / "big.txt"), 21) in found
+
+
+def test_candidates_are_narrowed_by_trigrams(tmp_path):
+    root = make_tree(tmp_path)
+    index = TrigramIndex(tmp_path / "index.db")
+    index.update(str(root))
+    names = lambda paths: sorted(os.path.basename(p) for p in paths)
+    # globs such as !*lock are applied to the candidates at search time
+    assert names(index.candidates(str(root), "needle")) == ["Pipfile.lock", "alpha.py", "notes.md"]
+    # an alternation has no required trigrams, every text file is scanned
+    assert names(index.candidates(str(root), "alpha|beta")) == ["Pipfile.lock", "alpha.py", "beta.py", "notes.md"]
+
+
+def test_update_only_reindexes_changed_files(tmp_path):
+    root = make_tree(tmp_path)
+    index = TrigramIndex(tmp_path / "index.db")
+    assert index.update(str(root)) == 5
+    assert index.update(str(root)) == 0
+
+    (root / "pkg" / "beta.py").write_text("def beta():\n    return 'needle now'\n")
+    (root / "notes.md").unlink()
+    assert index.update(str(root)) == 1
+    assert sorted(os.path.basename(p) for p in index.candidates(str(root), "needle")) == ["Pipfile.lock", "alpha.py", "beta.py"]
+
+    # the index persists between runs
+    index.close()
+    assert TrigramIndex(tmp_path / "index.db").update(str(root)) == 0
+
+
+def test_paths_are_reported_relative_to_the_search_path(tmp_path, monkeypatch):
+    root = make_tree(tmp_path)
+    monkeypatch.chdir(root)
+    index = TrigramIndex(tmp_path / "index.db")
+    hits = index.search(UserGrep("alpha", ["pkg"]))
+    assert {hit.file_path for hit in hits} == {os.path.join("pkg", "alpha.py")}
+    hits = index.search(UserGrep("alpha", ["pkg/alpha.py"]))
+    assert {hit.file_path for hit in hits} == {"pkg/alpha.py"}
+
+
+async def test_job_falls_back_to_index_without_ripgrep(tmp_path, monkeypatch):
+    root = make_tree(tmp_path)
+    index = TrigramIndex(tmp_path / "index.db")
+    monkeypatch.setattr(waystation, "rg_available", lambda: False)
+    monkeypatch.setattr(trigram_index, "default_index", lambda: index)
+
+    job = SearchJobManager().start(UserGrep("needle", [str(root)]))
+    hits = [hit async for batch in job.stream() for hit in batch]
+    assert len(hits) == 2
+    assert job.procs == []
+    assert all(hit.root == str(root) for hit in hits)
+    assert len(waystation.get_rg_matches(UserGrep("needle", [str(root)]))) == 2
@@ -1,8 +1,10 @@
+import json
 import os
 import tempfile
 import subprocess
 import pytest
-from waystation import get_git_info
+from waystation import get_git_info, get_rg_matches, iter_rg_matches, stream_rg_matches, UserGrep, SearchJobManager, SearchHit, search_roots, parse_rg_line, SearchOptions, rg_flags
+from db import Match
 
 def test_get_git_info_returns_expected_fields(tmp_path):
     # Create a temporary git repo
@@ -55,3 +57,165 @@ def test_get_git_info_detached_head(tmp_path):
     assert sha2 == sha
     # In detached HEAD, branch may be None or 'HEAD'
     assert branch in (None, "HEAD")
+
+
+def test_iter_rg_matches_yields_matches_as_found():
+    matches = iter_rg_matches(UserGrep("def", ["test_data/"]))
+    first = next(matches)
+    assert first.file_name in ("sample_code.py", "other_file.py")
+    assert "def" in first.line.lower()
+    # stopping early must not hang waiting for ripgrep
+    matches.close()
+
+def test_get_rg_matches_collects_streamed_matches():
+    user_grep = UserGrep("def", ["test_data/"])
+    assert [(m.file_path, m.line_no) for m in get_rg_matches(user_grep)] == \
+        [(m.file_path, m.line_no) for m in iter_rg_matches(user_grep)]
+
+async def test_stream_rg_matches_yields_batches():
+    user_grep = UserGrep("def", ["test_data/"])
+    batches = [batch async for batch in stream_rg_matches(user_grep, batch_size=2)]
+    assert batches
+    assert all(0 < len(batch) <= 2 for batch in batches[1:])
+    streamed = [(m.file_path, m.line_no) for batch in batches for m in batch]
+    assert sorted(streamed) == sorted((m.file_path, m.line_no) for m in get_rg_matches(user_grep))
+
+async def test_search_job_manager_kills_previous_search():
+    jobs = SearchJobManager()
+    first = jobs.start(UserGrep("def", ["test_data/"]))
+    stream = first.stream(batch_size=1)
+    assert await anext(stream)
+
+    second = jobs.start(UserGrep("import", ["test_data/"]))
+    assert first.cancelled
+    assert not jobs.is_current(first)
+    assert jobs.is_current(second)
+    # the cancelled stream stops instead of yielding stale batches
+    assert [batch async for batch in stream] == []
+    assert all(proc.returncode is not None for proc in first.procs)
+
+    batches = [batch async for batch in second.stream()]
+    assert batches
+    assert second.done
+    assert jobs.cancel() is False
+
+def test_search_hits_are_compact_and_share_paths():
+    hits = [hit for hit in get_rg_matches(UserGrep("def", ["test_data/"])) if hit.file_name == "sample_code.py"]
+    assert len(hits) > 1
+    assert all(isinstance(hit, SearchHit) for hit in hits)
+    assert not hasattr(hits[0], "__dict__")
+    # every hit in the same file points at the same interned strings
+    assert hits[0].file_path is hits[1].file_path
+    assert hits[0].file_name is hits[1].file_name
+    start, end = hits[0].submatches[0]
+    assert hits[0].line.encode()[start:end].lower() == b"def"
+
+def test_search_hit_to_match():
+    hit = SearchHit(file_path="src/app.py", file_name="app.py", line_no=3, line="def main():\n", submatches=((0, 3),))
+    match = hit.to_match()
+    assert isinstance(match, Match)
+    assert match.id is None
+    assert (match.file_path, match.file_name, match.line_no, match.line) == ("src/app.py", "app.py", 3, "def main():\n")
+    assert match.grep_meta["line_number"] == 3
+    assert match.grep_meta["path"]["text"] == "src/app.py"
+    assert match.grep_meta["submatches"] == [{"start": 0, "end": 3}]
+
+def make_roots(tmp_path, sizes):
+    roots = []
+    for name, size in sizes.items():
+        root = tmp_path / name
+        root.mkdir()
+        (root / "code.py").write_text("".join(f"def f{i}():\n    pass\n" for i in range(size)))
+        roots.append(str(root))
+    return roots
+
+async def test_stream_multi_root_tags_hits_with_their_root(tmp_path):
+    roots = make_roots(tmp_path, {"big": 300, "small": 1, "tiny": 2})
+    jobs = SearchJobManager(max_workers=2)
+    job = jobs.start(UserGrep("def", roots))
+    hits = [hit async for batch in job.stream() for hit in batch]
+    assert len(hits) == 303
+    assert len(job.procs) == 3
+    by_root = {}
+    for hit in hits:
+        assert hit.file_path.startswith(hit.root)
+        by_root[os.path.basename(hit.root)] = by_root.get(os.path.basename(hit.root), 0) + 1
+    assert by_root == {"big": 300, "small": 1, "tiny": 2}
+
+async def test_stream_multi_root_stops_all_processes_when_closed(tmp_path):
+    roots = make_roots(tmp_path, {"a": 2000, "b": 2000})
+    jobs = SearchJobManager()
+    job = jobs.start(UserGrep("def", roots))
+    stream = job.stream(batch_size=1)
+    assert await anext(stream)
+    await stream.aclose()
+    assert job.done
+    assert all(proc.returncode is not None for proc in job.procs)
+
+def test_search_roots_runs_each_root(tmp_path):
+    roots = make_roots(tmp_path, {"one": 1, "two": 2})
+    hits = search_roots(UserGrep("def", roots), max_workers=2)
+    assert sorted(os.path.basename(hit.root) for hit in hits) == ["one", "two", "two"]
+
+def test_parse_rg_line_only_decodes_match_events(monkeypatch):
+    import waystation
+    decoded = []
+    monkeypatch.setattr(waystation, "json_loads", lambda line: decoded.append(line) or json.loads(line))
+    begin = b'{"type":"begin","data":{"path":{"text":"a.py"}}}'
+    summary = b'{"type":"summary","data":{"elapsed_total":{"secs":0}}}'
+    match = json.dumps({"type": "match", "data": {
+        "path": {"text": "src/a.py"}, "lines": {"text": "def a():\n"}, "line_number": 3,
+        "absolute_offset": 10, "submatches": [{"match": {"text": "def"}, "start": 0, "end": 3}],
+    }}, separators=(",", ":")).encode()
+    assert waystation.parse_rg_line(begin) is None
+    assert waystation.parse_rg_line(summary) is None
+    assert waystation.parse_rg_line(b"") is None
+    assert decoded == []
+
+    hit = waystation.parse_rg_line(match)
+    assert (hit.file_path, hit.file_name, hit.line_no, hit.line, hit.submatches) == ("src/a.py", "a.py", 3, "def a():\n", ((0, 3),))
+    assert waystation.parse_rg_line(match.decode()) == hit
+    assert len(decoded) == 2
+
+def test_parse_rg_line_decodes_non_utf8_fields():
+    import base64
+    match = json.dumps({"type": "match", "data": {
+        "path": {"bytes": base64.b64encode(b"caf\xe9.txt").decode()},
+        "lines": {"bytes": base64.b64encode(b"caf\xe9\n").decode()},
+        "line_number": 1, "submatches": [],
+    }}, separators=(",", ":")).encode()
+    hit = parse_rg_line(match)
+    assert hit.file_name == "caf�.txt"
+    assert hit.line == "caf�\n"
+
+def test_search_options_map_to_ripgrep_flags():
+    options = SearchOptions.parse("-s -F -w -t py -T md -g '!vendor/**' -m 3 --max-filesize 1M")
+    assert options == SearchOptions(
+        ignore_case=False, fixed_strings=True, word=True, types=("py",), types_not=("md",),
+        globs=("!*lock", "!vendor/**"), max_count=3, max_filesize="1M",
+    )
+    assert SearchOptions.parse(str(options)) == options
+    assert rg_flags(UserGrep("x", [], options)) == [
+        "--case-sensitive", "--fixed-strings", "--word-regexp", "--max-count", "3",
+        "--color=never", "--json",
+        "--type", "py", "--type-not", "md", "--glob", "!*lock", "--glob", "!vendor/**", "--max-filesize", "1M",
+    ]
+    assert rg_flags(UserGrep("x", [])) == ["--ignore-case", "--color=never", "--json", "--glob", "!*lock"]
+    assert str(SearchOptions()) == ""
+    with pytest.raises(ValueError):
+        SearchOptions.parse("-m many")
+    with pytest.raises(ValueError):
+        SearchOptions.parse("-t")
+
+def test_search_options_narrow_ripgrep(tmp_path):
+    (tmp_path / "vendor").mkdir()
+    (tmp_path / "a.py").write_text("foo.bar\nfoobar\nfoo bar\n")
+    (tmp_path / "b.txt").write_text("foo.bar\n")
+    (tmp_path / "vendor" / "c.py").write_text("foo.bar\n")
+    search = lambda pattern, flags: sorted((os.path.relpath(m.file_path, tmp_path), m.line_no)
+        for m in get_rg_matches(UserGrep(pattern, [str(tmp_path)], SearchOptions.parse(flags))))
+    assert len(search("foo.bar", "")) == 4
+    assert search("foo.bar", "-F -t py -g '!vendor'") == [("a.py", 1)]
+    assert search("FOO", "-s") == []
+    assert search("foo", "-w -m 1 -g '*.py'") == [("a.py", 1), ("vendor/c.py", 1)]
+    assert search("-bar", "") == []
@@ -0,0 +1,313 @@
+import fnmatch
+import os
+import re
+import sqlite3
+import subprocess
+import threading
+from functools import lru_cache
+from pathlib import Path
+from waystation import SearchHit, intern_path, repo_root_for
+
+try:
+    from re import _parser as sre_parse
+    from re import _constants as sre_constants
+except ImportError:  # pragma: no cover
+    import sre_parse
+    import sre_constants
+
+SIZE_SUFFIXES = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+# ripgrep treats a file with a NUL byte in its first block as binary and skips it
+BINARY_SNIFF_BYTES = 8192
+MAX_FILE_SIZE = 8 * 1024 * 1024
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    binary INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS trigrams (
+    trigram TEXT NOT NULL,
+    file_id INTEGER NOT NULL,
+    PRIMARY KEY (trigram, file_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_trigrams_file_id ON trigrams(file_id);
+"""
+
+def trigrams(text: str) -> set[str]:
+    """The lower-cased trigrams of text, ignoring any that span a line break."""
+    text = text.lower()
+    grams = {text[i:i + 3] for i in range(len(text) - 2)}
+    return {gram for gram in grams if '\n' not in gram}
+
+def required_literals(pattern: str) -> list[str]:
+    """
+    Literal runs that every match of pattern has to contain.
+    Anything the parser can't see through (alternation, classes, repeats)
+    ends the current run, so the result is always safe to filter on.
+    """
+    try:
+        parsed = sre_parse.parse(pattern, re.IGNORECASE)
+    except re.error:
+        return [pattern]
+    runs, run = [], []
+    for op, value in parsed:
+        if op is sre_constants.LITERAL:
+            run.append(chr(value))
+            continue
+        if run:
+            runs.append(''.join(run))
+        run = []
+    if run:
+        runs.append(''.join(run))
+    return runs
+
+def literal_pattern(pattern: str, options) -> str:
+    """The pattern as a regex, escaped when options ask for fixed strings."""
+    return re.escape(pattern) if options.fixed_strings else pattern
+
+def compile_pattern(pattern: str, options) -> re.Pattern:
+    """Compile a search pattern the way ripgrep reads it with options, falling back to a literal search."""
+    pattern = literal_pattern(pattern, options)
+    flags = re.IGNORECASE if options.ignore_case else 0
+    try:
+        re.compile(pattern)
+    except re.error:
+        pattern = re.escape(pattern)
+    if options.word:
+        pattern = rf'\b(?:{pattern})\b'
+    return re.compile(pattern, flags)
+
+def parse_size(size: str) -> int:
+    """Parse a ripgrep size such as 500K or 2M into bytes."""
+    size = size.strip().upper()
+    if size and size[-1] in SIZE_SUFFIXES:
+        return int(size[:-1]) * SIZE_SUFFIXES[size[-1]]
+    return int(size)
+
+def glob_matches(rel_path: str, glob: str) -> bool:
+    """Match a ripgrep glob against a path relative to the search root, or any of its parent directories."""
+    parts = rel_path.split(os.sep)
+    glob = glob.rstrip('/')
+    if '/' not in glob:
+        return any(fnmatch.fnmatchcase(part, glob) for part in parts)
+    glob = glob.lstrip('/')
+    return any(fnmatch.fnmatchcase('/'.join(parts[:i]), glob) for i in range(1, len(parts) + 1))
+
+def globs_allow(rel_path: str, globs: tuple[str, ...]) -> bool:
+    """Whether ripgrep's --glob flags let rel_path through, later globs win as they do in ripgrep."""
+    allowed = not any(not glob.startswith('!') for glob in globs)
+    for glob in globs:
+        negated = glob.startswith('!')
+        if glob_matches(rel_path, glob[1:] if negated else glob):
+            allowed = not negated
+    return allowed
+
+def is_binary(path: str) -> bool:
+    try:
+        with open(path, 'rb') as f:
+            return b'\0' in f.read(BINARY_SNIFF_BYTES)
+    except OSError:
+        return True
+
+def is_hidden(rel_path: str) -> bool:
+    """Whether any component of a path relative to the search root is hidden, ripgrep skips those by default."""
+    return any(part.startswith('.') for part in rel_path.split(os.sep))
+
+def list_files(root: str) -> list[str]:
+    """
+    Absolute paths of the files ripgrep would search under root.
+    Hidden files and directories are skipped, and inside a git repo ignored
+    files are left out by asking git.
+    """
+    root = os.path.abspath(root)
+    if os.path.isfile(root):
+        return [root]
+    try:
+        listing = subprocess.run(
+            ['git', 'ls-files', '--cached', '--others', '--exclude-standard', '-z'],
+            cwd=root, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True
+        ).stdout.decode()
+        files = [os.path.join(root, name) for name in listing.split('\0') if name and not is_hidden(name)]
+    except (OSError, subprocess.CalledProcessError):
+        files = []
+        for current, dirs, names in os.walk(root):
+            dirs[:] = [d for d in dirs if not d.startswith('.')]
+            files.extend(os.path.join(current, name) for name in names if not name.startswith('.'))
+    return [path for path in files if os.path.isfile(path)]
+
+class TrigramIndex:
+    """
+    Built-in search backend used when ripgrep isn't installed.
+
+    Keeps a persistent trigram index of every searched file in SQLite. Each
+    search first brings the index up to date for its roots, only re-reading
+    files whose mtime or size changed, then narrows the candidates to files
+    holding every trigram of the pattern's literal runs before running the
+    regex over them.
+    """
+
+    def __init__(self, db_path: str | Path, max_file_size: int = MAX_FILE_SIZE):
+        self.db_path = str(db_path)
+        self.max_file_size = max_file_size
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+    def update(self, root: str) -> int:
+        """Re-index the new or changed files under root and forget removed ones. Returns the number re-indexed."""
+        root = os.path.abspath(root)
+        current = {}
+        for path in list_files(root):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            current[path] = (stat.st_mtime_ns, stat.st_size)
+
+        with self._lock, self.conn:
+            stored = {
+                path: (file_id, (mtime_ns, size))
+                for file_id, path, mtime_ns, size, _ in self._files_under(root)
+            }
+            for path, (file_id, _) in stored.items():
+                if path not in current:
+                    self._forget(file_id)
+            changed = 0
+            for path, stat in current.items():
+                file_id, stored_stat = stored.get(path, (None, None))
+                if stored_stat == stat:
+                    continue
+                if file_id is not None:
+                    self._forget(file_id)
+                self._index(path, stat)
+                changed += 1
+        return changed
+
+    def candidates(self, root: str, pattern: str) -> list[str]:
+        """Absolute paths under root that may contain a match for pattern, files too big to index always may."""
+        root = os.path.abspath(root)
+        grams = set()
+        for literal in required_literals(pattern):
+            grams |= trigrams(literal)
+        with self._lock:
+            if not grams:
+                return [path for _, path, _, _, binary in self._files_under(root) if not binary]
+            placeholders = ', '.join('?' * len(grams))
+            rows = self.conn.execute(f"""
+                SELECT f.path FROM trigrams t
+                JOIN files f ON f.id = t.file_id
+                WHERE t.trigram IN ({placeholders})
+                  AND (f.path = ? OR (f.path >= ? AND f.path < ?))
+                GROUP BY t.file_id
+                HAVING COUNT(*) = ?
+                UNION
+                SELECT path FROM files
+                WHERE size > ? AND NOT binary
+                  AND (path = ? OR (path >= ? AND path < ?))
+                ORDER BY 1
+            """, (*grams, root, *self._prefix_range(root), len(grams),
+                  self.max_file_size, root, *self._prefix_range(root)))
+            return [path for (path,) in rows]
+
+    def search(self, args, cancelled=None) -> list[SearchHit]:
+        """
+        Search args.paths like ripgrep would, returning SearchHit objects tagged with their repo root.
+        Case, fixed strings, word, globs, max count and max file size options are
+        honoured, file types need ripgrep's type definitions and are ignored.
+        `cancelled` is polled between files so a superseded search stops early.
+        """
+        options = args.options
+        regex = compile_pattern(args.pattern, options)
+        max_size = parse_size(options.max_filesize) if options.max_filesize else None
+        hits = []
+        for search_path in args.paths:
+            root = repo_root_for(search_path)
+            self.update(search_path)
+            base = os.path.abspath(search_path)
+            for path in self.candidates(search_path, literal_pattern(args.pattern, options)):
+                if cancelled and cancelled():
+                    return hits
+                rel_path = os.path.relpath(path, base) if path != base else os.path.basename(path)
+                if not globs_allow(rel_path, options.globs):
+                    continue
+                if max_size is not None and os.path.getsize(path) > max_size:
+                    continue
+                # report paths relative to the path searched, as ripgrep does
+                shown = search_path if path == base else os.path.join(search_path, rel_path)
+                hits.extend(self._scan(shown, regex, root, options.max_count))
+        return hits
+
+    def close(self):
+        self.conn.close()
+
+    def _scan(self, file_path: str, regex: re.Pattern, root: str, max_count: int | None = None):
+        try:
+            with open(file_path, encoding='utf-8', errors='replace', newline='') as f:
+                lines = f.readlines()
+        except OSError:
+            return
+        file_path, file_name = intern_path(file_path)
+        found = 0
+        for line_no, line in enumerate(lines, 1):
+            if max_count is not None and found >= max_count:
+                return
+            if not regex.search(line):
+                continue
+            found += 1
+            submatches = tuple(
+                self._byte_span(line, m.start(), m.end()) for m in regex.finditer(line) if m.end() > m.start()
+            )
+            yield SearchHit(file_path, file_name, line_no, line, submatches, root)
+
+    @staticmethod
+    def _byte_span(line: str, start: int, end: int) -> tuple[int, int]:
+        # ripgrep reports submatch offsets in bytes
+        if line.isascii():
+            return start, end
+        start_byte = len(line[:start].encode('utf-8'))
+        return start_byte, start_byte + len(line[start:end].encode('utf-8'))
+
+    def _index(self, path: str, stat: tuple[int, int]):
+        binary = is_binary(path)
+        if binary or stat[1] > self.max_file_size:
+            grams = set()
+        else:
+            try:
+                with open(path, encoding='utf-8', errors='replace') as f:
+                    grams = trigrams(f.read())
+            except OSError:
+                return
+        file_id = self.conn.execute(
+            "INSERT INTO files (path, mtime_ns, size, binary) VALUES (?, ?, ?, ?)", (path, *stat, binary)
+        ).lastrowid
+        # binary files are remembered without trigrams so they are never re-read or searched,
+        # files over max_file_size without trigrams so candidates always scans them
+        self.conn.executemany(
+            "INSERT INTO trigrams (trigram, file_id) VALUES (?, ?)", ((gram, file_id) for gram in grams)
+        )
+
+    def _forget(self, file_id: int):
+        self.conn.execute("DELETE FROM trigrams WHERE file_id = ?", (file_id,))
+        self.conn.execute("DELETE FROM files WHERE id = ?", (file_id,))
+
+    def _files_under(self, root: str):
+        return self.conn.execute(
+            "SELECT id, path, mtime_ns, size, binary FROM files WHERE path = ? OR (path >= ? AND path < ?) ORDER BY path",
+            (root, *self._prefix_range(root))
+        ).fetchall()
+
+    @staticmethod
+    def _prefix_range(root: str) -> tuple[str, str]:
+        # every path below root sorts between 'root/' and 'root0', '0' being the character after '/'
+        root = root.rstrip(os.sep)
+        return root + os.sep, root + chr(ord(os.sep) + 1)
+
+@lru_cache(maxsize=1)
+def default_index() -> TrigramIndex:
+    """The index kept next to the waystation database in ~/.waystation."""
+    waystation_dir = Path.home() / ".waystation"
+    waystation_dir.mkdir(exist_ok=True)
+    return TrigramIndex(waystation_dir / "trigrams.db")
@@ -1,64 +1,580 @@
 import re
 import os
+import asyncio
+import shutil
 import subprocess
 import json
-from dataclasses import dataclass
+import sys
+import time
+import base64
+import shlex
+from dataclasses import dataclass, field, replace
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from contextlib import aclosing
 from pathlib import Path
-from db import get_db, Match
-import grep_ast
+from db import DEFAULT_PROFILE, get_db, Match
+from search_cache import file_stats, tag_roots, tree_fingerprint
+from preview_cache import preview_cache, reset_tree_context, PreviewTimeout
+from line_index import line_index
+from languages import language_registry
+from repo_info import repo_info
+
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
+# ripgrep writes the event type first, so other events can be skipped without decoding them
+RG_MATCH_PREFIX = b'{"type":"match"'
+
+# files that are never worth searching unless asked for
+DEFAULT_GLOBS = ('!*lock',)
+
+@dataclass(frozen=True)
+class SearchOptions:
+    """
+    How a pattern is matched and which files are searched, mapped onto ripgrep flags.
+    Written in the search bar using the same short flags, see SearchOptions.parse.
+    """
+    ignore_case: bool = True
+    fixed_strings: bool = False
+    word: bool = False
+    # ripgrep file types, e.g. 'py', see `rg --type-list`
+    types: tuple[str, ...] = ()
+    types_not: tuple[str, ...] = ()
+    # ripgrep globs, prefix with ! to exclude
+    globs: tuple[str, ...] = DEFAULT_GLOBS
+    max_count: int | None = None
+    # ripgrep size, e.g. '500K' or '2M'
+    max_filesize: str | None = None
+
+    def match_flags(self) -> list[str]:
+        flags = ['--ignore-case' if self.ignore_case else '--case-sensitive']
+        if self.fixed_strings:
+            flags.append('--fixed-strings')
+        if self.word:
+            flags.append('--word-regexp')
+        if self.max_count is not None:
+            flags += ['--max-count', str(self.max_count)]
+        return flags
+
+    def file_flags(self) -> list[str]:
+        flags = []
+        for file_type in self.types:
+            flags += ['--type', file_type]
+        for file_type in self.types_not:
+            flags += ['--type-not', file_type]
+        for glob in self.globs:
+            flags += ['--glob', glob]
+        if self.max_filesize:
+            flags += ['--max-filesize', self.max_filesize]
+        return flags
+
+    @classmethod
+    def parse(cls, text: str) -> "SearchOptions":
+        """
+        Parse options written as ripgrep flags: -s/-i, -F, -w, -t TYPE, -T TYPE,
+        -g GLOB, -m NUM and --max-filesize SIZE. Globs are added to the defaults.
+        Raises ValueError for anything else.
+        """
+        options = {}
+        words = shlex.split(text)
+        while words:
+            flag = words.pop(0)
+            if flag in ('-i', '--ignore-case'):
+                options['ignore_case'] = True
+            elif flag in ('-s', '--case-sensitive'):
+                options['ignore_case'] = False
+            elif flag in ('-F', '--fixed-strings'):
+                options['fixed_strings'] = True
+            elif flag in ('-w', '--word-regexp'):
+                options['word'] = True
+            elif flag in ('-t', '--type', '-T', '--type-not', '-g', '--glob', '-m', '--max-count', '--max-filesize'):
+                if not words:
+                    raise ValueError(f"{flag} needs a value")
+                value = words.pop(0)
+                if flag in ('-t', '--type'):
+                    options['types'] = options.get('types', ()) + (value,)
+                elif flag in ('-T', '--type-not'):
+                    options['types_not'] = options.get('types_not', ()) + (value,)
+                elif flag in ('-g', '--glob'):
+                    options['globs'] = options.get('globs', DEFAULT_GLOBS) + (value,)
+                elif flag == '--max-filesize':
+                    options['max_filesize'] = value
+                else:
+                    try:
+                        options['max_count'] = int(value)
+                    except ValueError:
+                        raise ValueError(f"{flag} needs a number, got {value!r}")
+            else:
+                raise ValueError(f"Unknown search option {flag!r}")
+        return cls(**options)
+
+    def __str__(self):
+        """The options that differ from the defaults, in the form parse() reads."""
+        words = []
+        if not self.ignore_case:
+            words.append('-s')
+        if self.fixed_strings:
+            words.append('-F')
+        if self.word:
+            words.append('-w')
+        words += [f'-t {t}' for t in self.types]
+        words += [f'-T {t}' for t in self.types_not]
+        extra_globs = self.globs[len(DEFAULT_GLOBS):] if self.globs[:len(DEFAULT_GLOBS)] == DEFAULT_GLOBS else self.globs
+        words += [f'-g {shlex.quote(glob)}' for glob in extra_globs]
+        if self.max_count is not None:
+            words.append(f'-m {self.max_count}')
+        if self.max_filesize:
+            words.append(f'--max-filesize {self.max_filesize}')
+        return ' '.join(words)
 
 @dataclass
 class UserGrep:
     pattern: str
     paths: list[str]
+    options: SearchOptions = field(default_factory=SearchOptions)
 
     def __post_init__(self):
         if not self.paths:
             self.paths = ['.']
 
-def init_waystation():
+@dataclass(slots=True)
+class SearchHit:
+    """
+    A transient ripgrep hit holding only what the search table and previews need.
+    File paths are interned so every hit in a file shares the same strings.
+    Converted to a full Match by to_match() when it is saved.
+    """
+    file_path: str
+    file_name: str
+    line_no: int
+    line: str
+    # (start, end) byte offsets of each submatch within line
+    submatches: tuple = ()
+    # repo root (or search root outside git) the hit was found under, a label for
+    # the search root only: a file under it can be in a nested repo or submodule
+    root: str = ""
+
+    def to_match(self) -> Match:
+        return Match(
+            line=self.line,
+            file_path=self.file_path,
+            file_name=self.file_name,
+            line_no=self.line_no,
+            grep_meta={
+                "path": {"text": self.file_path},
+                "lines": {"text": self.line},
+                "line_number": self.line_no,
+                "submatches": [{"start": start, "end": end} for start, end in self.submatches],
+            },
+        )
+
+@lru_cache(maxsize=4096)
+def intern_path(file_path: str) -> tuple[str, str]:
+    """Return the interned file path and file name for a path reported by ripgrep."""
+    return sys.intern(file_path), sys.intern(os.path.basename(file_path))
+
+def repo_root_for(path: str) -> str:
+    """
+    The git repo root containing path, or path itself when it is not in a repo.
+    Found by repo_info like get_git_info, so worktrees and submodules agree.
+    """
+    return sys.intern(repo_info.root(path) or str(Path(path).absolute()))
+
+def init_waystation(profile: str = DEFAULT_PROFILE):
     waystation_dir = Path.home() / ".waystation"
     waystation_dir.mkdir(exist_ok=True)
     db_path = waystation_dir / "way.db"
     schema_path = Path(__file__).parent / "schema.sql"
-    db = get_db(str(db_path), str(schema_path))
+    db = get_db(str(db_path), str(schema_path), profile=profile)
     return db
 
-def get_rg_matches(args: UserGrep):
+@lru_cache(maxsize=1)
+def rg_available() -> bool:
+    """Whether the ripgrep binary is on PATH, the built-in trigram index is used when it isn't."""
+    return shutil.which('rg') is not None
+
+def rg_file_flags(args: UserGrep) -> list[str]:
+    """The ripgrep flags that decide which files are searched."""
+    return args.options.file_flags()
+
+def rg_flags(args: UserGrep) -> list[str]:
+    """The ripgrep flags used for a UserGrep, without the pattern and paths."""
+    return args.options.match_flags() + ['--color=never', '--json'] + rg_file_flags(args)
+
+def rg_command(args: UserGrep) -> list[str]:
+    """Build the ripgrep command line for a UserGrep."""
+    # -e so a pattern starting with a dash isn't read as a flag
+    return ['rg'] + rg_flags(args) + ['-e', args.pattern, '--'] + args.paths
+
+def rg_text(data: dict) -> str:
+    """The text of a ripgrep string field, which is base64 `bytes` when it isn't valid UTF-8."""
+    if 'text' in data:
+        return data['text']
+    return base64.b64decode(data['bytes']).decode('utf-8', errors='replace')
+
+def parse_rg_line(line: bytes | str):
     """
-    Run ripgrep and returns list of Match objects.
+    Parse one line of ripgrep --json output.
+    Returns a SearchHit for `match` events and None for everything else.
+    begin, end, context and summary events are rejected on their prefix without
+    being decoded, and orjson is used for the rest when it is installed.
     """
-    cmd = ['rg', '--ignore-case', '--color=never', '--json', '--glob', '!*lock', args.pattern] + args.paths
-    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-    matches = []
-    for line in result.stdout.strip().split('\n'):
-        if not line.strip():
-            continue
-        match = json.loads(line)
-        if match.get('type') == 'match':
-            data = match.get('data')
-            file_path = data['path']['text']
-            file_name = os.path.basename(file_path)
-            matches.append(Match(line=data['lines']['text'], file_path=file_path, file_name=file_name, line_no=data['line_number'], grep_meta=data))
-    return matches
+    if isinstance(line, str):
+        line = line.encode()
+    if not line.startswith(RG_MATCH_PREFIX):
+        return None
+    data = json_loads(line)['data']
+    file_path, file_name = intern_path(rg_text(data['path']))
+    submatches = tuple((sub['start'], sub['end']) for sub in data['submatches'])
+    return SearchHit(file_path, file_name, data['line_number'], rg_text(data['lines']), submatches)
+
+def iter_rg_matches(args: UserGrep, root=""):
+    """
+    Run ripgrep and yield SearchHit objects as ripgrep emits them.
+    The child process is killed if the caller stops iterating early.
+    """
+    proc = subprocess.Popen(rg_command(args), stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    try:
+        for line in proc.stdout:
+            match = parse_rg_line(line)
+            if match:
+                match.root = root
+                yield match
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+        proc.stdout.close()
+        proc.wait()
+
+def search_roots(args: UserGrep, max_workers=None) -> list[SearchHit]:
+    """Run one ripgrep per root on a thread pool and return all hits, tagged with their repo root."""
+    if not rg_available():
+        from trigram_index import default_index
+        return default_index().search(args)
+    if len(args.paths) == 1:
+        return list(iter_rg_matches(args, root=repo_root_for(args.paths[0])))
+    def search_root(path):
+        return list(iter_rg_matches(replace(args, paths=[path]), root=repo_root_for(path)))
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        return [hit for hits in pool.map(search_root, args.paths) for hit in hits]
+
+def get_rg_matches(args: UserGrep, cache=None, incremental=None):
+    """
+    Run ripgrep and returns list of SearchHit objects.
+    With a SearchCache, ripgrep only runs when the cached result is missing or stale.
+    With an IncrementalSearch, a stale result only rescans the files that changed.
+    Without ripgrep the built-in trigram index is searched instead.
+    """
+    if not rg_available():
+        # the trigram index only re-reads changed files already
+        cache = incremental = None
+    if cache is None and incremental is None:
+        return search_roots(args)
+    hits = None
+    if (cache is not None and cache.can_serve(args)) or (incremental is not None and incremental.can_refresh(args)):
+        files = file_stats(args)
+        fingerprint = tree_fingerprint(files)
+        hits = cache.get(args, fingerprint) if cache is not None else None
+        if hits is None and incremental is not None:
+            hits = incremental.refresh(args, files)
+    if hits is None:
+        started = time.time_ns()
+        hits = search_roots(args)
+        files = file_stats(args, started)
+        fingerprint = tree_fingerprint(files)
+        if incremental is not None:
+            incremental.record(args, files, hits)
+    if cache is not None:
+        cache.put(args, hits, fingerprint)
+    return list(hits)
+
+async def stream_rg_matches(args: UserGrep, batch_size=500, batch_interval=0.05, job=None, root=""):
+    """
+    Run ripgrep without blocking the event loop and yield lists of SearchHit objects.
+
+    The first hit is yielded as soon as it arrives, after that hits are grouped
+    into batches of up to `batch_size`, or whatever arrived within `batch_interval`
+    seconds, so the caller can append rows without redrawing for every match.
+    When a SearchJob is passed it owns the child process and can kill it.
+    Every hit is tagged with `root`.
+    """
+    proc = await asyncio.create_subprocess_exec(
+        *rg_command(args), stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL
+    )
+    if job:
+        job.procs.append(proc)
+    batch = []
+    last_flush = 0.0
+    pending = b''
+    loop = asyncio.get_running_loop()
+    try:
+        while not (job and job.cancelled):
+            chunk = await proc.stdout.read(65536)
+            if not chunk:
+                break
+            lines = (pending + chunk).split(b'\n')
+            pending = lines.pop()
+            for line in lines:
+                match = parse_rg_line(line)
+                if match:
+                    match.root = root
+                    batch.append(match)
+            if batch and (len(batch) >= batch_size or loop.time() - last_flush >= batch_interval):
+                yield batch
+                batch = []
+                last_flush = loop.time()
+        if job and job.cancelled:
+            return
+        match = parse_rg_line(pending)
+        if match:
+            match.root = root
+            batch.append(match)
+        if batch:
+            yield batch
+    finally:
+        if proc.returncode is None:
+            try:
+                proc.kill()
+            except ProcessLookupError:
+                pass
+        await proc.wait()
+
+async def stream_multi_root(args: UserGrep, max_workers=None, job=None, **kwargs):
+    """
+    Search each of args.paths with its own ripgrep, at most `max_workers` at a time,
+    and yield batches from all of them as they arrive. A root with many hits only
+    adds more batches to the stream, it doesn't hold back the others.
+    """
+    queue = asyncio.Queue()
+    slots = asyncio.Semaphore(max_workers or os.cpu_count() or 4)
+
+    async def search_root(path):
+        async with slots:
+            # aclosing makes sure the process is killed as soon as the task is cancelled
+            async with aclosing(stream_rg_matches(replace(args, paths=[path]), job=job, root=repo_root_for(path), **kwargs)) as batches:
+                async for batch in batches:
+                    await queue.put(batch)
+
+    tasks = [asyncio.create_task(search_root(path)) for path in args.paths]
+    remaining = len(tasks)
+    for task in tasks:
+        task.add_done_callback(lambda _: queue.put_nowait(None))
+    try:
+        while remaining:
+            batch = await queue.get()
+            if batch is None:
+                remaining -= 1
+            else:
+                yield batch
+        for task in tasks:
+            # surface errors such as a missing rg binary
+            task.result()
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+async def stream_index_matches(args: UserGrep, batch_size=500, job=None, **kwargs):
+    """Search the built-in trigram index on a thread and yield the hits in batches."""
+    from trigram_index import default_index
+    cancelled = (lambda: job.cancelled) if job else None
+    hits = await asyncio.to_thread(default_index().search, args, cancelled)
+    for start in range(0, len(hits), batch_size):
+        if job and job.cancelled:
+            return
+        yield hits[start:start + batch_size]
+
+def stream_search(args: UserGrep, job=None, max_workers=None, **kwargs):
+    """Stream hits for args, fanning out one ripgrep per root when there are several."""
+    if not rg_available():
+        return stream_index_matches(args, job=job, **kwargs)
+    if len(args.paths) > 1:
+        return stream_multi_root(args, max_workers=max_workers, job=job, **kwargs)
+    return stream_rg_matches(args, job=job, root=repo_root_for(args.paths[0]), **kwargs)
+
+class SearchJob:
+    """A single search, possibly several ripgrep processes. Cancelling it kills them."""
+
+    def __init__(self, job_id: int, args: UserGrep, cache=None, incremental=None, max_workers=None, max_hits=None):
+        self.id = job_id
+        self.args = args
+        # searches with more hits are neither cached nor recorded, so they aren't kept beyond the results
+        self.max_hits = max_hits
+        # the trigram index used without ripgrep only re-reads changed files already
+        self.cache = cache if rg_available() else None
+        self.incremental = incremental if rg_available() else None
+        self.max_workers = max_workers
+        self.procs = []
+        self.cancelled = False
+        self.done = False
+        self.from_cache = False
+        self.incremental_refresh = False
+
+    async def stream(self, **kwargs):
+        """
+        Async iterator over batches of matches for this job.
+        Served from the cache when possible, otherwise only changed files are
+        rescanned if an earlier run was recorded. Completed runs are added to both.
+        """
+        try:
+            async with aclosing(self._stream(**kwargs)) as batches:
+                async for batch in batches:
+                    yield batch
+        finally:
+            self.done = True
+
+    async def _stream(self, **kwargs):
+        if self.cache is None and self.incremental is None:
+            async with aclosing(stream_search(self.args, job=self, max_workers=self.max_workers, **kwargs)) as batches:
+                async for batch in batches:
+                    yield batch
+            return
+
+        hits = None
+        cached = self.cache is not None and self.cache.can_serve(self.args)
+        recorded = self.incremental is not None and self.incremental.can_refresh(self.args)
+        if cached or recorded:
+            # earlier results are confirmed against the stats of every file they cover
+            files = await asyncio.to_thread(file_stats, self.args)
+            fingerprint = tree_fingerprint(files)
+            hits = self.cache.get(self.args, fingerprint) if cached else None
+            if hits is not None:
+                self.from_cache = True
+            elif recorded:
+                plan = self.incremental.plan(self.args, files)
+                if plan is not None:
+                    self.incremental_refresh = True
+                    async with aclosing(self._refresh(files, fingerprint, *plan, **kwargs)) as batches:
+                        async for batch in batches:
+                            yield batch
+                    return
+        if hits is not None:
+            if self.cache is not None and not self.from_cache:
+                self.cache.put(self.args, hits, fingerprint)
+            if hits and not self.cancelled:
+                yield list(hits)
+            return
+
+        limits = [store.max_hits for store in (self.cache, self.incremental) if store is not None]
+        max_hits = min(limits if self.max_hits is None else [*limits, self.max_hits])
+        collected = []
+        # ripgrep starts straight away, the files are only listed and stated once it is done
+        started = time.time_ns()
+        async with aclosing(stream_search(self.args, job=self, max_workers=self.max_workers, **kwargs)) as batches:
+            async for batch in batches:
+                if collected is not None:
+                    collected.extend(batch)
+                    if len(collected) > max_hits:
+                        collected = None
+                yield batch
+        if collected is not None and not self.cancelled:
+            files = await asyncio.to_thread(file_stats, self.args, started)
+            if self.cache is not None:
+                self.cache.put(self.args, collected, tree_fingerprint(files))
+            if self.incremental is not None:
+                self.incremental.record(self.args, files, collected)
+
+    async def _refresh(self, files, fingerprint, changed, kept, **kwargs):
+        """
+        Yield the kept hits of a recorded run, then rescan the changed files a chunk
+        at a time, streaming their hits. Each ripgrep belongs to the job, so it can be
+        killed, and nothing is recorded unless every chunk completed.
+        """
+        kept_hits = [hit for file_hits in kept.values() for hit in file_hits]
+        if kept_hits:
+            yield kept_hits
+        fresh = []
+        for chunk in self.incremental.chunks(changed):
+            if self.cancelled:
+                return
+            async with aclosing(stream_rg_matches(replace(self.args, paths=chunk), job=self, **kwargs)) as batches:
+                async for batch in batches:
+                    batch = tag_roots(batch, self.args)
+                    fresh.extend(batch)
+                    yield batch
+        if self.cancelled:
+            return
+        hits = self.incremental.finish(self.args, files, kept, fresh)
+        if self.cache is not None:
+            self.cache.put(self.args, hits, fingerprint)
+
+    def cancel(self):
+        self.cancelled = True
+        for proc in self.procs:
+            if proc.returncode is None:
+                try:
+                    proc.kill()
+                except ProcessLookupError:
+                    pass
+
+class SearchJobManager:
+    """
+    Owns the in-flight search. Starting a new search cancels the previous one,
+    and batches from a job that is no longer current should be dropped.
+    """
+
+    def __init__(self, cache=None, incremental=None, max_workers=None):
+        self.cache = cache
+        self.incremental = incremental
+        self.max_workers = max_workers
+        self.current: SearchJob | None = None
+        self._next_id = 0
+
+    def start(self, args: UserGrep, max_hits=None) -> SearchJob:
+        """Start a job for args, max_hits bounds the results kept for the cache, see SearchJob."""
+        self.cancel()
+        self._next_id += 1
+        self.current = SearchJob(self._next_id, args, cache=self.cache, incremental=self.incremental, max_workers=self.max_workers, max_hits=max_hits)
+        return self.current
+
+    def cancel(self) -> bool:
+        """Cancel the current job. Returns True if it was still running."""
+        job, self.current = self.current, None
+        if job and not job.cancelled and not job.done:
+            job.cancel()
+            return True
+        return False
+
+    def is_current(self, job: SearchJob) -> bool:
+        return job is self.current and not job.cancelled
 
 def get_grep_ast_preview(match: Match):
     """
     Run grep-ast on match.filename and return output as a string.
+    The context is built around match.line_no, grepping for the line text is only
+    used when the file no longer has that line there.
+    Binary files get no preview. Large, minified or non UTF-8 files, and parses
+    slower than the preview policy allows, get a plain window of lines instead.
     If grep-ast fails, show the matching line and its context.
     """
     if not match.line:
         return "<no preview>"
     try:
         path = Path(match.file_path).absolute()
-        lines = process_filename(path, {
+        kind = preview_cache.sniff(path)
+        if kind == "binary":
+            return "<no preview>"
+        if kind != "text":
+            return get_plain_window(match)
+        args = {
             "pattern": match.line.strip(),
             "verbose": False,
             "encoding": "utf8",
             "ignore_case": True,
             "color": True,
-            "line_numbers": False
-        })
+            "line_numbers": False,
+            "timeout": preview_cache.policy.parse_timeout(path),
+        }
+        try:
+            lines = process_line(path, match.line_no, match_submatches(match), args)
+            if lines is None:
+                lines = process_filename(path, args)
+        except PreviewTimeout:
+            return get_plain_window(match)
         if lines:
             return lines
         try:
@@ -70,6 +586,91 @@ def get_grep_ast_preview(match: Match):
         print(e)
         return "<no preview>"
 
+def get_plain_window(match, context_lines=None, max_line_length=None) -> str:
+    """
+    The hit line and a few lines either side, read through the LineIndex so even
+    huge files aren't loaded. Long lines are cut down, the hit line around its first submatch.
+    """
+    policy = preview_cache.policy
+    context_lines = policy.window_lines if context_lines is None else context_lines
+    max_line_length = policy.window_line_length if max_line_length is None else max_line_length
+    try:
+        lines = line_index.window(Path(match.file_path).absolute(), match.line_no, context_lines, context_lines)
+    except (OSError, IndexError):
+        return match.line.rstrip()
+    hit_idx = min(match.line_no - 1, context_lines)
+    submatches = match_submatches(match)
+    window = []
+    for idx, line in enumerate(lines):
+        line = line.rstrip()
+        if len(line) > max_line_length:
+            start = 0
+            if idx == hit_idx and submatches:
+                # submatch offsets are in bytes, find the character they start at
+                start = len(line.encode("utf8")[:submatches[0][0]].decode("utf8", errors="ignore"))
+                start = max(0, start - max_line_length // 3)
+            line = ("…" if start else "") + line[start:start + max_line_length] + "…"
+        window.append(line)
+    return "\n".join(window)
+
+def match_submatches(match) -> tuple:
+    """(start, end) byte offsets of the hits within match.line, from a SearchHit or a saved grep_meta."""
+    submatches = getattr(match, "submatches", None)
+    if submatches is not None:
+        return tuple(submatches)
+    meta = getattr(match, "grep_meta", None)
+    if isinstance(meta, str):
+        try:
+            meta = json.loads(meta)
+        except ValueError:
+            return ()
+    if not isinstance(meta, dict):
+        return ()
+    return tuple((sub["start"], sub["end"]) for sub in meta.get("submatches", ()) if "start" in sub and "end" in sub)
+
+def highlight_submatches(line: str, submatches: tuple) -> str:
+    """Wrap each submatch of line in the red escape codes grep-ast uses."""
+    if not submatches:
+        stripped = line.strip()
+        start = line.find(stripped)
+        return line[:start] + f"\033[1;31m{stripped}\033[0m" + line[start + len(stripped):]
+    data = line.encode("utf8")
+    output, last = [], 0
+    for start, end in sorted(submatches):
+        if start < last or end > len(data):
+            continue
+        output.append(data[last:start].decode("utf8", errors="replace"))
+        output.append(f"\033[1;31m{data[start:end].decode('utf8', errors='replace')}\033[0m")
+        last = end
+    output.append(data[last:].decode("utf8", errors="replace"))
+    return "".join(output)
+
+def process_line(filename, line_no: int, submatches: tuple, args, cache=None):
+    """
+    Render the grep-ast context for the hit on line_no, with its submatches highlighted.
+    Returns None when the file's line_no doesn't hold args["pattern"] any more,
+    so the caller can fall back to grepping for it.
+    Raises PreviewTimeout if the file isn't parsed within args["timeout"] seconds.
+    """
+    if cache is None:
+        cache = preview_cache
+    tc = cache.tree_context(
+        filename, encoding=args.get("encoding"), timeout=args.get("timeout"),
+        verbose=args.get("verbose"), line_number=args.get("line_number"), color=args.get("color")
+    )
+    if tc is None:
+        return None
+    with cache.lock:
+        reset_tree_context(tc)
+        idx = line_no - 1
+        if not 0 <= idx < len(tc.lines) or args.get("pattern", "").lower() not in tc.lines[idx].lower():
+            return None
+        if tc.color:
+            tc.output_lines[idx] = highlight_submatches(tc.lines[idx], submatches)
+        tc.add_lines_of_interest({idx})
+        tc.add_context()
+        return tc.format()
+
 def enumerate_files(fnames, spec, use_spec=False):
     for fname in fnames:
         fname = Path(fname)
@@ -87,28 +688,33 @@ def enumerate_files(fnames, spec, use_spec=False):
                 yield sub_fnames
 
 
-def process_filename(filename, args):
-    try:
-        with open(filename, "r", encoding=args.get("encoding")) as file:
-            code = file.read()
-    except UnicodeDecodeError:
-        return
-
-    try:
-        tc = grep_ast.TreeContext(filename, code, verbose=args.get("verbose"), line_number=args.get("line_number"), color=args.get("color"))
-    except ValueError:
-        return
-
-    loi = tc.grep(re.escape(args.get("pattern")), ignore_case=args.get("ignore_case"))
-    if not loi:
+def process_filename(filename, args, cache=None):
+    """
+    Render the grep-ast context for args["pattern"] in filename.
+    The file contents and parsed tree come from a PreviewCache, the shared one by default.
+    Raises PreviewTimeout if the file isn't parsed within args["timeout"] seconds.
+    """
+    if cache is None:
+        cache = preview_cache
+    tc = cache.tree_context(
+        filename, encoding=args.get("encoding"), timeout=args.get("timeout"),
+        verbose=args.get("verbose"), line_number=args.get("line_number"), color=args.get("color")
+    )
+    if tc is None:
         return
+    with cache.lock:
+        reset_tree_context(tc)
+        loi = tc.grep(re.escape(args.get("pattern")), ignore_case=args.get("ignore_case"))
+        if not loi:
+            return
 
-    tc.add_lines_of_interest(loi)
-    tc.add_context()
-    return tc.format()
+        tc.add_lines_of_interest(loi)
+        tc.add_context()
+        return tc.format()
 
 def get_plain_lines_from_file(match, context_lines=1):
     """Get matching line with surrounding context from file.
+    Lines are read through the shared LineIndex, so the file is only mapped once.
 
     Args:
         match: Match object containing file info
@@ -116,63 +722,45 @@ def get_plain_lines_from_file(match, context_lines=1):
     """
     path = Path(match.file_path).absolute()
     try:
-        with open(path, 'r') as f:
-            lines = f.readlines()
-            idx = match.line_no - 1
-            context = []
-
-            # Get lines before the match
-            for i in range(max(0, idx - context_lines), idx):
-                context.append(f"{lines[i].rstrip()}")
-
-            # Add the matching line itself
-            context.append(f"{lines[idx].rstrip()}")
-
-            # Get lines after the match
-            for i in range(idx + 1, min(len(lines), idx + context_lines + 1)):
-                context.append(f"{lines[i].rstrip()}")
-
-            return "\n".join(context)
+        return "\n".join(line.rstrip() for line in line_index.window(path, match.line_no, context_lines, context_lines))
     except FileNotFoundError:
         # Fall back to the line stored in the match
         return match.line
 
 def get_language_from_filename(filename: str) -> str:
-    """Determine syntax highlighting language from file extension"""
-    ext = Path(filename).suffix.lower()
-    language_map = {
-        '.py': 'python',
-        '.js': 'javascript',
-        '.ts': 'typescript',
-        '.html': 'html',
-        '.css': 'css',
-        '.sql': 'sql',
-        '.json': 'json',
-        '.yaml': 'yaml',
-        '.yml': 'yaml',
-        '.md': 'markdown',
-        '.sh': 'bash',
-        '.rs': 'rust',
-        '.go': 'go',
-        '.java': 'java',
-        '.cpp': 'cpp',
-        '.c': 'c',
-    }
-    return language_map.get(ext, 'text')
-
-def flow_matches_to_markdown(flow_matches: list) -> str:
+    """Determine syntax highlighting language from the file's name, 'text' when it is unknown"""
+    return language_registry.highlight_language(filename) or 'text'
+
+FLOW_CONTEXT_LINES = 3
+
+def flow_snippets(flow_matches: list, snapshots: dict | None = None) -> list[str]:
+    """
+    The code shown for each step of a flow, in order. A step with a snapshot
+    (match id -> MatchSnapshot) is taken from it, only the others read their file.
+    These are plain line reads through the LineIndex, cheaper in-process than
+    a round trip to a ParserPool worker.
+    """
+    snapshots = snapshots or {}
+    return [
+        snapshots[match.id].context_text() if match.id in snapshots else get_plain_lines_from_file(match, FLOW_CONTEXT_LINES)
+        for match, _, _ in flow_matches
+    ]
+
+def flow_matches_to_markdown(flow_matches: list, snapshots: dict | None = None) -> str:
     """
     Convert flow matches to markdown format.
     
     Args:
         flow_matches: List of tuples (Match, FlowMatch, Optional[MatchNote])
+        snapshots: Optional match id -> MatchSnapshot, steps with one don't read their file
     
     Returns:
         Markdown string representation of the flow
     """
     markdown_lines = []
+    snippets = flow_snippets(flow_matches, snapshots)
     
-    for idx, (match, flow_match, note) in enumerate(flow_matches):
+    for (match, flow_match, note), preview_text in zip(flow_matches, snippets):
         # Step header (##)
         step_num = flow_match.order_index + 1
         header = f"## Step {step_num}: {match.file_name}:{match.line_no}"
@@ -185,7 +773,6 @@ def flow_matches_to_markdown(flow_matches: list) -> str:
             markdown_lines.append(f"{note.note}\n")
         
         # Code block (```)
-        preview_text = get_plain_lines_from_file(match, 3)
         language = get_language_from_filename(match.file_name) or ""
         markdown_lines.append(f"```{language}")
         markdown_lines.append(preview_text)
@@ -194,16 +781,5 @@ def flow_matches_to_markdown(flow_matches: list) -> str:
     return "\n".join(markdown_lines)
 
 def get_git_info(path="."):
-    """Return git_repo_root, git_commit_sha, git_branch for the given path."""
-    def run_git_cmd(args):
-        return subprocess.check_output(
-            ["git"] + args, cwd=path
-        ).decode("utf-8").strip()
-    
-    try:
-        git_repo_root = run_git_cmd(["rev-parse", "--show-toplevel"])
-        git_commit_sha = run_git_cmd(["rev-parse", "HEAD"])
-        git_branch = run_git_cmd(["rev-parse", "--abbrev-ref", "HEAD"])
-        return git_repo_root, git_commit_sha, git_branch
-    except Exception:
-        return None, None, None
\ No newline at end of file
+    """Return git_repo_root, git_commit_sha, git_branch for the given path, read from .git without running git."""
+    return repo_info.get(path)